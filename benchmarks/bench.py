@@ -0,0 +1,293 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark suite for Random_Words.
+
+Times model building, pair counting, sampling, generation, loading and
+poem search on the kanye test corpus and on synthetic Zipfian corpora of
+increasing vocabulary size, and writes the results as JSON so runs from
+different versions can be compared.
+
+Usage:
+    python benchmarks/bench.py [--quick] [--output results.json]
+    python benchmarks/bench.py --compare old.json new.json
+"""
+
+__author__ = 'eric'
+
+import argparse
+import bisect
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import random_words.random_words as rw
+import random_words.binary_model as bm
+
+
+#
+# Globals
+#
+
+KANYE_DIR = os.path.join(ROOT, 'tests', 'data', 'kanye')
+SHIPPED_MODEL = os.path.join(ROOT, 'kanye_1_NewLines-F_Uniq-F.model')
+POEM_SCHEMES = {
+    'couplet': ['5a', '5a'],
+    'quatrain': ['5a', '7b', '5a', '7b'],
+    'limerick': ['8a', '8a', '5b', '5b', '8a'],
+}
+# A run is a regression if it's this much slower than the baseline
+REGRESSION_RATIO = 1.2
+
+
+#
+# Helpers
+#
+
+def best_time(func, repeat=3):
+    """Returns the fastest of repeat calls of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t = time.time()
+        func()
+        times.append(time.time() - t)
+    return min(times)
+
+
+def zipf_corpus(vocab_size, n_docs, doc_lines=20, line_len=8, s=1.1, seed=0):
+    """
+    Returns a list of documents whose words follow a Zipf distribution
+    :param vocab_size: Number of distinct words
+    :param s: Zipf exponent
+    """
+    rng = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, vocab_size + 1):
+        total += 1.0 / rank ** s
+        cumulative.append(total)
+    words = ['w%d' % i for i in range(vocab_size)]
+
+    def word():
+        return words[bisect.bisect_left(cumulative, rng.random() * total)]
+
+    return ['\n'.join(' '.join(word() for _ in range(line_len)) for _ in range(doc_lines))
+            for _ in range(n_docs)]
+
+
+def write_corpus(docs, dirr):
+    """Writes docs to .txt files in dirr"""
+    for i, doc in enumerate(docs):
+        with open(os.path.join(dirr, 'doc_%05d.txt' % i), 'w') as f:
+            f.write(doc)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#
+# Benchmarks
+#
+
+def bench_ingestion(name, corpus_dir, n_tokens, results):
+    serial = best_time(lambda: rw.RandomWords(corpus_dir=corpus_dir))
+    results.append(dict(bench='add_to_model', corpus=name, tokens=n_tokens, seconds=serial,
+                        tokens_per_sec=n_tokens / serial))
+    parallel = best_time(lambda: rw.RandomWords().add_to_model(corpus_dir, workers=4))
+    results.append(dict(bench='add_to_model_workers_4', corpus=name, tokens=n_tokens, seconds=parallel,
+                        tokens_per_sec=n_tokens / parallel))
+
+
+def bench_pair_counting(name, corpus_dir, results):
+    """Times merging already tokenized documents into each backend, pair by pair and in bulk"""
+    model = rw.RandomWords()
+    sequences = [seq for doc in rw.DocGen(corpus_dir)
+                 for seq in model._line_sequences(model._doc_token_lines(doc))]
+    counts = [Counter(zip(seq, seq[1:])) for seq in sequences]
+    n_tokens = sum(len(seq) - 1 for seq in sequences)
+
+    def per_pair(prob_dict):
+        for seq in sequences:
+            prev = seq[0]
+            for t in seq[1:]:
+                prob_dict.add(prev, t)
+                prev = t
+
+    def by_sequence(prob_dict):
+        for seq in sequences:
+            prob_dict.add_sequence(seq)
+
+    def by_counts(prob_dict):
+        for c in counts:
+            prob_dict.add_counts(c)
+
+    for backend in (rw.ProbDict, rw.CompactProbDict):
+        for method, func in (('add', per_pair), ('add_sequence', by_sequence), ('add_counts', by_counts)):
+            seconds = best_time(lambda: func(backend()))
+            results.append(dict(bench='pair_counting', corpus=name, backend=backend.__name__, method=method,
+                                tokens=n_tokens, seconds=seconds, tokens_per_sec=n_tokens / seconds))
+
+
+def bench_sampling(name, model, n_calls, results):
+    for backend, prob_dict in (('ProbDict', model.prob_dict), ('CompactProbDict', model.prob_dict.compact())):
+        rng = random.Random(0)
+        tokens = [t for t in prob_dict.keys() if prob_dict.successors(t)]
+        queries = [rng.choice(tokens) for _ in range(n_calls)]
+        # Warm any lazily built tables first
+        for t in tokens:
+            prob_dict.get(t, rng)
+
+        def run():
+            get = prob_dict.get
+            for t in queries:
+                get(t, rng)
+
+        seconds = best_time(run)
+        results.append(dict(bench='ProbDict.get', corpus=name, backend=backend, calls=n_calls,
+                            seconds=seconds, calls_per_sec=n_calls / seconds))
+
+
+def bench_generation(name, model, n_sequences, lenn, results):
+    n_tokens = n_sequences * lenn
+    seconds = best_time(lambda: [model.make_words(lenn) for _ in range(n_sequences)])
+    results.append(dict(bench='make_words', corpus=name, tokens=n_tokens, seconds=seconds,
+                        tokens_per_sec=n_tokens / seconds))
+    seconds = best_time(lambda: model.make_words_batch(n_sequences, lenn))
+    results.append(dict(bench='make_words_batch', corpus=name, tokens=n_tokens, seconds=seconds,
+                        tokens_per_sec=n_tokens / seconds))
+
+
+def bench_load(tmp_dir, results):
+    seconds = best_time(lambda: rw.RandomWords().load(SHIPPED_MODEL), repeat=5)
+    results.append(dict(bench='load', format='pickle', seconds=seconds))
+    binary_path = os.path.join(tmp_dir, 'kanye.bin')
+    bm.convert_model(SHIPPED_MODEL, binary_path)
+    seconds = best_time(lambda: rw.RandomWords().load(binary_path), repeat=5)
+    results.append(dict(bench='load', format='binary', seconds=seconds))
+
+
+def bench_poems(n_poems, results):
+    try:
+        import random_words.random_poem as rp
+    except ImportError as e:
+        results.append(dict(bench='RandomPoem.run', skipped=str(e)))
+        return
+    for scheme_name, scheme in sorted(POEM_SCHEMES.items()):
+        for search in ('dfs', 'beam', 'best'):
+            poem = rp.RandomPoem(scheme, SHIPPED_MODEL, search=search, max_nodes=5000)
+            # Build the phonetic keys and rhyme index outside the timing
+            poem.run(0)
+            times = []
+            nodes = 0
+            for seed in range(n_poems):
+                t = time.time()
+                poem.run(seed)
+                times.append(time.time() - t)
+                nodes += poem.nodes_expanded
+            times.sort()
+            results.append(dict(bench='RandomPoem.run', scheme=scheme_name, search=search, poems=n_poems,
+                                median_seconds=times[len(times) // 2],
+                                p95_seconds=times[int(len(times) * 0.95)],
+                                max_seconds=times[-1], nodes=nodes))
+
+
+def run_all(quick=False):
+    """Runs every benchmark, returns the results document"""
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        corpora = [('kanye', KANYE_DIR)]
+        vocab_sizes = [1000, 10000] if quick else [1000, 10000, 100000]
+        for vocab_size in vocab_sizes:
+            dirr = os.path.join(tmp_dir, 'zipf_%d' % vocab_size)
+            os.mkdir(dirr)
+            write_corpus(zipf_corpus(vocab_size, n_docs=vocab_size // 20), dirr)
+            corpora.append(('zipf_%d' % vocab_size, dirr))
+
+        for name, corpus_dir in corpora:
+            n_tokens = sum(len(open(f).read().split()) for f in rw.FileGen(corpus_dir))
+            bench_ingestion(name, corpus_dir, n_tokens, results)
+            bench_pair_counting(name, corpus_dir, results)
+            model = rw.RandomWords(corpus_dir=corpus_dir)
+            bench_sampling(name, model, 20000 if quick else 100000, results)
+            bench_generation(name, model, 200 if quick else 1000, 20, results)
+
+        bench_load(tmp_dir, results)
+        bench_poems(5 if quick else 20, results)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return dict(revision=git_revision(), python=platform.python_version(), platform=platform.platform(),
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'), quick=quick, results=results)
+
+
+#
+# Comparison
+#
+
+def _result_key(result):
+    return tuple(sorted((k, v) for k, v in result.items()
+                        if not isinstance(v, float) and k not in ('tokens', 'calls', 'nodes')))
+
+
+def _result_time(result):
+    for k in ('seconds', 'median_seconds'):
+        if k in result:
+            return result[k]
+    return None
+
+
+def compare(old, new):
+    """
+    Prints the change in time of every benchmark in both result documents
+    :return: Number of regressions
+    """
+    old_results = dict((_result_key(r), r) for r in old['results'])
+    regressions = 0
+    for r in new['results']:
+        before = old_results.get(_result_key(r))
+        if before is None or _result_time(before) is None or _result_time(r) is None:
+            continue
+        ratio = _result_time(r) / max(_result_time(before), 1e-9)
+        flag = ''
+        if ratio > REGRESSION_RATIO:
+            regressions += 1
+            flag = '  REGRESSION'
+        label = ' '.join('%s=%s' % kv for kv in _result_key(r))
+        print "%-80s %6.2fx%s" % (label, ratio, flag)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Random_Words benchmarks")
+    parser.add_argument('--quick', action='store_true', help="smaller corpora and fewer repeats")
+    parser.add_argument('--output', help="file to write JSON results to, default stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = [json.load(open(p)) for p in args.compare]
+        sys.exit(1 if compare(old, new) else 0)
+
+    doc = run_all(args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(doc, indent=2, sort_keys=True)
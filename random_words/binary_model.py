@@ -0,0 +1,291 @@
+#!/usr/bin/env python2
+
+"""
+Binary model format for Random_Words.
+
+A model file is a fixed header followed by flat little-endian arrays, so
+it can be opened with mmap and sampled from directly without unpickling
+anything.  Layout (all integers little-endian):
+
+    header          magic, version, n_tokens, n_edges, blob_size, n_starts
+    vocab_offsets   (n_tokens + 1) x uint64, byte offsets into the blob
+    offsets         (n_tokens + 1) x uint64, CSR row offsets
+    successor_ids   n_edges x uint32
+    cum_counts      n_edges x uint64, row-local cumulative frequencies
+    start_ids       n_starts x uint32, tokens seen starting a line
+    start_counts    n_starts x uint64, how often each did
+    blob            the token strings, concatenated in sorted order
+
+Tokens are stored sorted so a token's id can be found with a binary search
+over the mapped vocabulary.
+
+Can be run as a script to upgrade a pickled model:
+    python -m random_words.binary_model old.model new.model
+"""
+
+__author__ = 'eric'
+
+import random_words as rw
+import utils
+
+import itertools
+import mmap
+import os
+import struct
+import sys
+import cPickle as pickle
+
+
+#
+# Globals
+#
+
+MAGIC = 'RWMODEL\x00'
+VERSION = 1
+PREFIX = struct.Struct('<8sI')
+HEADER = struct.Struct('<8sIQQQQ')
+# Items per struct.pack call when writing arrays
+CHUNK = 65536
+
+
+#
+# Helpers
+#
+
+class MappedArray(object):
+    """Read-only sequence of fixed width integers inside a buffer"""
+    def __init__(self, buf, start, typecode, length):
+        self.buf = buf
+        self.start = start
+        self.item = struct.Struct('<' + typecode)
+        # Bytes per item, as for array.array
+        self.itemsize = self.item.size
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return self.item.unpack_from(self.buf, self.start + i * self.item.size)[0]
+
+    def __iter__(self):
+        for i in xrange(self.length):
+            yield self[i]
+
+
+class MappedStrings(object):
+    """Read-only sequence of the token strings in a buffer, i.e. id2token"""
+    def __init__(self, buf, start, offsets):
+        self.buf = buf
+        self.start = start
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.buf[self.start + self.offsets[i]:self.start + self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+class MappedTokenIndex(object):
+    """
+    Read-only token2id mapping over sorted MappedStrings.
+    Lookups are a binary search.
+    """
+    def __init__(self, strings):
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def get(self, token, default=None):
+        lo, hi = 0, len(self.strings)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.strings[mid] < token:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.strings) and self.strings[lo] == token:
+            return lo
+        return default
+
+    def keys(self):
+        return list(self.strings)
+
+
+class MappedDictionary(object):
+    """Stands in for Dictionary on a mapped model"""
+    def __init__(self, strings):
+        self.id2token = strings
+        self.token2id = MappedTokenIndex(strings)
+
+    def __len__(self):
+        return len(self.id2token)
+
+
+#
+# Main classes
+#
+
+class MappedProbDict(rw.CompactProbDict):
+    """
+    CompactProbDict whose arrays live in a memory mapped model file.
+    Read-only; convert with to_compact() to add more transitions.
+    """
+    def __init__(self, path):
+        super(MappedProbDict, self).__init__()
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise Exception("Not a binary model file!\n %s" % path)
+        if version != VERSION:
+            raise Exception("Unsupported model version %d!\n %s" % (version, path))
+        _, _, n_tokens, n_edges, _, n_starts = HEADER.unpack_from(self._mmap, 0)
+
+        pos = HEADER.size
+        vocab_offsets = MappedArray(self._mmap, pos, 'Q', n_tokens + 1)
+        pos += 8 * (n_tokens + 1)
+        self.offsets = MappedArray(self._mmap, pos, 'Q', n_tokens + 1)
+        pos += 8 * (n_tokens + 1)
+        self.successor_ids = MappedArray(self._mmap, pos, 'I', n_edges)
+        pos += 4 * n_edges
+        self.cum_counts = MappedArray(self._mmap, pos, 'Q', n_edges)
+        pos += 8 * n_edges
+        start_ids = MappedArray(self._mmap, pos, 'I', n_starts)
+        pos += 4 * n_starts
+        start_counts = MappedArray(self._mmap, pos, 'Q', n_starts)
+        pos += 8 * n_starts
+        self.dictionary = MappedDictionary(MappedStrings(self._mmap, pos, vocab_offsets))
+        self.starts = rw.StartDist(itertools.izip((self.dictionary.id2token[i] for i in start_ids), start_counts))
+
+    def __getstate__(self):
+        raise TypeError("MappedProbDict can't be pickled, use to_compact() first")
+
+    def add(self, curr, nxt):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def add_sequence(self, tokens):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def add_counts(self, counts):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def to_compact(self):
+        """Copies this model into memory as a CompactProbDict"""
+        compact = rw.CompactProbDict()
+        for token in self.dictionary.id2token:
+            compact.dictionary.add_token(token)
+        compact.offsets.extend(self.offsets[i] for i in xrange(1, len(self.offsets)))
+        compact.successor_ids.extend(self.successor_ids)
+        compact.cum_counts.extend(self.cum_counts)
+        compact.starts = rw.StartDist(self.starts.counts)
+        return compact
+
+
+#
+# Main functions
+#
+
+def is_binary_model(path):
+    """Returns True if the file at path starts with the binary model magic"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _write_ints(f, typecode, values):
+    """Writes an iterable of ints as little-endian typecode items"""
+    buf = []
+    for v in values:
+        buf.append(v)
+        if len(buf) >= CHUNK:
+            f.write(struct.pack('<%d%s' % (len(buf), typecode), *buf))
+            buf = []
+    if buf:
+        f.write(struct.pack('<%d%s' % (len(buf), typecode), *buf))
+
+
+def save_model(prob_dict, path):
+    """
+    Writes a ProbDict (or CompactProbDict) to path in the binary format
+    :param prob_dict: Model to save
+    :param path: File to write
+    :return: None
+    """
+    tokens = sorted(prob_dict.keys())
+    token2id = dict((t, i) for i, t in enumerate(tokens))
+
+    vocab_offsets = [0]
+    for t in tokens:
+        vocab_offsets.append(vocab_offsets[-1] + len(t))
+
+    offsets = [0]
+    successor_ids = []
+    cum_counts = []
+    for t in tokens:
+        summ = 0
+        for nxt, f in prob_dict.successors(t).iteritems():
+            summ += f
+            successor_ids.append(token2id[nxt])
+            cum_counts.append(summ)
+        offsets.append(len(successor_ids))
+
+    # Only starts that can be sampled from
+    starts = getattr(prob_dict, 'starts', None)
+    starts = sorted((token2id[t], c) for t, c in starts.counts.iteritems()
+                    if t in token2id and offsets[token2id[t] + 1] > offsets[token2id[t]]) if starts else []
+
+    # A new file rather than rewriting this one, which may be mapped
+    with utils.atomic_write(path) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(tokens), len(successor_ids), vocab_offsets[-1], len(starts)))
+        _write_ints(f, 'Q', vocab_offsets)
+        _write_ints(f, 'Q', offsets)
+        _write_ints(f, 'I', successor_ids)
+        _write_ints(f, 'Q', cum_counts)
+        _write_ints(f, 'I', (i for i, _ in starts))
+        _write_ints(f, 'Q', (c for _, c in starts))
+        for t in tokens:
+            f.write(t)
+
+
+def load_model(path):
+    """
+    Opens a binary model file with mmap
+    :rtype: MappedProbDict
+    """
+    if not os.path.exists(path) or not os.path.isfile(path):
+        raise Exception("Given file doesn't exist!\n %s" % path)
+    return MappedProbDict(path)
+
+
+def convert_model(src, dst):
+    """Upgrades a pickled model file at src to a binary model at dst"""
+    save_model(pickle.load(open(src, 'rb')), dst)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print "Usage: %s <pickled model> <binary model>" % sys.argv[0]
+        sys.exit(1)
+    convert_model(sys.argv[1], sys.argv[2])
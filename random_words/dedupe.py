@@ -0,0 +1,104 @@
+"""
+Corpus wide duplicate line detection for uniq_lines mode.
+
+Lines are reduced to 64 bit fingerprints of their tokens, so remembering
+a line costs the same whatever its length and the line itself is never
+kept.  SeenLines remembers every fingerprint exactly.  BloomLines keeps a
+fixed size Bloom filter instead: its memory doesn't grow with the corpus,
+at the cost of treating a small fraction of new lines as repeats.
+"""
+
+__author__ = 'eric'
+
+
+import hashlib
+import math
+import string
+import struct
+
+
+#
+# Globals
+#
+
+FINGERPRINT = struct.Struct('<Q')
+# Trimmed from the ends of a joined line: whitespace tokens and their separators
+TRIM = '\x00' + string.whitespace
+# Chance that BloomLines mistakes a new line for a repeat when full
+ERROR_RATE = 0.001
+
+
+#
+# Helpers
+#
+
+def fingerprint(tokens):
+    """
+    Returns a 64 bit fingerprint of a tokenized line, stable across
+    processes and runs
+    :param tokens: [str]
+    :rtype: int
+    """
+    # Trim so a final line without its newline matches the same line elsewhere
+    return FINGERPRINT.unpack_from(hashlib.md5('\x00'.join(tokens).strip(TRIM)).digest())[0]
+
+
+#
+# Main classes
+#
+
+class SeenLines(object):
+    """Exact set of line fingerprints"""
+    def __init__(self):
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, fp):
+        """
+        Records a line fingerprint
+        :return: True if it hadn't been seen before
+        """
+        if fp in self._seen:
+            return False
+        self._seen.add(fp)
+        return True
+
+
+class BloomLines(object):
+    """Bloom filter of line fingerprints with a fixed memory budget"""
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        """
+        :param capacity: Number of distinct lines the filter is sized for.
+            More can be added, but the error rate climbs past error_rate.
+        :param error_rate: Chance of a new line being taken for a repeat
+            once capacity lines have been added
+        """
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, fp):
+        """
+        Records a line fingerprint
+        :return: True if it hadn't been seen before, as far as the filter knows
+        """
+        # Double hashing: k bit positions from the two halves of the fingerprint
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        bits = self.bits
+        new = False
+        for i in xrange(self.n_hashes):
+            bit = (h1 + i * h2) % self.n_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
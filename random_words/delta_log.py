@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+
+"""
+Append-only delta logs for growing a saved Random_Words model.
+
+A delta log sits next to a saved model, the base snapshot, at
+path + '.delta'.  Each checkpoint appends one record holding the
+transition and start counts added since the last one, so saving a few
+new documents costs their counts rather than the whole model.  Loading
+the base replays the log on top of it; compacting writes a new snapshot
+with everything folded in and drops the log.
+
+Layout (all integers little-endian):
+    header      magic, version, base size, base mtime
+    records     each a length, a crc32 and a zlib compressed, pickled
+                (pairs, starts) pair of {(token, next token): count} and
+                {token: count} dicts
+
+The header records the base file's size and modification time when the
+log was started.  A log whose base has since been rewritten, e.g. by a
+compaction that was interrupted before the log was removed, is refused
+rather than counted twice.  A record cut short by a crash mid-append is
+dropped on replay and written over by the next append.
+
+Can be run as a script to compact a saved model:
+    python -m random_words.delta_log kanye.model
+"""
+
+__author__ = 'eric'
+
+import random_words as rw
+
+import logging
+import os
+import struct
+import sys
+import zlib
+import cPickle as pickle
+
+
+#
+# Globals
+#
+
+MAGIC = 'RWDELTA\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIQd')
+RECORD = struct.Struct('<II')
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Helpers
+#
+
+def log_path(path):
+    """Returns the path of the delta log for the model saved at path"""
+    return path + '.delta'
+
+
+def base_stamp(path):
+    """Returns the (size, mtime) a delta log records for its base model"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def writable(prob_dict):
+    """Returns prob_dict, or an in memory copy if it's a read only memory mapped or sharded model"""
+    import binary_model
+    import sharded_model
+    if isinstance(prob_dict, binary_model.MappedProbDict):
+        return prob_dict.to_compact()
+    if isinstance(prob_dict, sharded_model.ShardedProbDict):
+        return prob_dict.compact()
+    return prob_dict
+
+
+def snapshot_format(path):
+    """Returns the RandomWords.save arguments that rewrite the model at path in its own format"""
+    import binary_model
+    import sharded_model
+    if sharded_model.is_sharded_model(path):
+        return dict(shards=sharded_model.load_sharded(path).n_shards)
+    return dict(binary=binary_model.is_binary_model(path))
+
+
+#
+# Main classes
+#
+
+class DeltaLog(object):
+    """The delta log of the model saved at base_path, see module docstring"""
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.path = log_path(base_path)
+        # Byte offset just past the last whole record, None until read or started
+        self.end = None
+        # Byte offsets of the records whose counts the model in memory holds,
+        # replayed or appended by it
+        self.applied = set()
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def records(self):
+        """
+        Yields the (pairs, starts) count dicts of each whole record in order,
+        and leaves self.end just past the last one
+        """
+        for _, pairs, starts in self._records():
+            yield pairs, starts
+
+    def _records(self):
+        """Yields (byte offset, pairs, starts) for each whole record, see records"""
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise Exception("Not a delta log!\n %s" % self.path)
+            magic, version, size, mtime = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise Exception("Not a delta log!\n %s" % self.path)
+            if version != VERSION:
+                raise Exception("Unsupported delta log version %d!\n %s" % (version, self.path))
+            if (size, mtime) != base_stamp(self.base_path):
+                raise Exception("Delta log doesn't match its base model, which was rewritten after "
+                                "the log was started.  Delete the log to load the base alone.\n %s" % self.path)
+            self.end = HEADER.size
+            while True:
+                head = f.read(RECORD.size)
+                if not head:
+                    break
+                payload = None
+                if len(head) == RECORD.size:
+                    length, crc = RECORD.unpack(head)
+                    payload = f.read(length)
+                    if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc:
+                        payload = None
+                if payload is None:
+                    logger.warning("Dropping incomplete record at byte %d of %s", self.end, self.path)
+                    break
+                offset = self.end
+                self.end += RECORD.size + length
+                pairs, starts = pickle.loads(zlib.decompress(payload))
+                yield offset, pairs, starts
+
+    def replay(self, prob_dict):
+        """
+        Adds the counts of every record not already applied to prob_dict
+        :param prob_dict: ProbDict or CompactProbDict
+        :return: Number of records replayed
+        """
+        n = 0
+        for offset, pairs, starts in self._records():
+            if offset in self.applied:
+                continue
+            self.applied.add(offset)
+            prob_dict.add_counts(pairs)
+            for token, count in starts.iteritems():
+                prob_dict.add_start(token, count)
+            n += 1
+        return n
+
+    def append(self, pairs, starts):
+        """
+        Appends one record, starting the log if there isn't one
+        :param pairs: {(token, next token): count}
+        :param starts: {token: count}
+        """
+        payload = zlib.compress(pickle.dumps((dict(pairs), dict(starts)), pickle.HIGHEST_PROTOCOL))
+        if self.end is None:
+            if self.exists():
+                # Finds the end of the last whole record
+                for _ in self.records():
+                    pass
+            else:
+                self._start()
+        with open(self.path, 'r+b') as f:
+            # Writes over any partial record a crash left behind
+            f.seek(self.end)
+            f.truncate()
+            f.write(RECORD.pack(len(payload), zlib.crc32(payload) & 0xffffffff))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.applied.add(self.end)
+        self.end += RECORD.size + len(payload)
+
+    def remove(self):
+        """Deletes the log, once its counts are in a new base snapshot"""
+        if self.exists():
+            os.remove(self.path)
+        self.end = None
+        self.applied = set()
+
+    def _start(self):
+        size, mtime = base_stamp(self.base_path)
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, size, mtime))
+        self.end = HEADER.size
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print "Usage: %s <saved model>" % sys.argv[0]
+        sys.exit(1)
+    model = rw.RandomWords()
+    model.load(sys.argv[1])
+    model.compact_deltas()
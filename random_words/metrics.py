@@ -0,0 +1,140 @@
+"""
+Optional instrumentation for Random_Words.
+
+Models hold a metrics object and report counters and timings to it.  By
+default that's NULL_METRICS, whose methods do nothing, so instrumentation
+costs next to nothing until a Metrics instance is attached.
+"""
+
+__author__ = 'Eric'
+
+
+from collections import Counter
+import bisect
+import threading
+import time
+
+
+#
+# Globals
+#
+
+# Histogram bucket upper bounds in seconds: 1us to ~67s in powers of 4
+BUCKETS = [1e-6 * 4 ** i for i in range(14)]
+
+
+#
+# Helpers
+#
+
+class Histogram(object):
+    """Counts observed values in fixed buckets, with count, sum, min and max"""
+    def __init__(self):
+        # Last bucket counts everything above the largest bound
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.total, min=self.min, max=self.max,
+                    buckets=dict(zip([str(b) for b in BUCKETS] + ['inf'], self.buckets)))
+
+
+class _Timer(object):
+    """Context manager that records its duration in a histogram"""
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.time() - self.start)
+        return False
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+#
+# Main classes
+#
+
+class Metrics(object):
+    """Thread-safe counters and latency histograms"""
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = {}
+
+    def incr(self, name, n=1):
+        """Adds n to the counter name"""
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        """Records value, in seconds, in the histogram name"""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def timer(self, name):
+        """Returns a context manager that records how long its block takes"""
+        return _Timer(self, name)
+
+    def snapshot(self):
+        """Returns a plain dict copy of every counter and histogram"""
+        with self._lock:
+            return dict(counters=dict(self.counters),
+                        histograms=dict((k, h.snapshot()) for k, h in self.histograms.iteritems()))
+
+    def reset(self):
+        with self._lock:
+            self.counters = Counter()
+            self.histograms = {}
+
+
+class NullMetrics(object):
+    """Metrics that records nothing"""
+    enabled = False
+
+    def incr(self, name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def snapshot(self):
+        return dict(counters={}, histograms={})
+
+    def reset(self):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,216 @@
+"""
+Search strategies for finding a line of a RandomPoem.
+
+Each strategy starts from an empty Line and a queue of candidate first
+words and looks for a valid line, scoring candidates with Line.score.
+Every strategy can be given a budget of nodes (candidate lines scored)
+and a wall clock timeout, after which it gives up and the poem falls back
+to the best line seen.
+
+Strategies keep no state between calls so one instance can be shared by
+concurrent poems.
+"""
+
+__author__ = 'Eric'
+
+
+import heapq
+import itertools
+import time
+
+
+#
+# Helpers
+#
+
+class SearchResult(object):
+    """What a search found: a valid line or None, the best line seen and the work done"""
+    def __init__(self, line, best, nodes, exhausted):
+        """
+        :param line: A valid line, or None if none was found
+        :param best: Lowest scoring line seen
+        :param nodes: Number of candidate lines scored
+        :param exhausted: True if the search ran out of budget or time
+        """
+        self.line = line
+        self.best = best
+        self.nodes = nodes
+        self.exhausted = exhausted
+
+
+#
+# Strategies
+#
+
+class LineSearch(object):
+    """
+    Base class for line search strategies.
+    Subclasses implement _search.
+    """
+    def __init__(self, max_nodes=None, timeout=None):
+        """
+        :param max_nodes: Give up after scoring this many candidate lines
+        :param timeout: Give up after this many seconds
+        """
+        self.max_nodes = max_nodes
+        self.timeout = timeout
+
+    def search(self, queue, line, make_queue):
+        """
+        Searches for a valid line
+        :param queue: Candidates for the first word to add to line
+        :param line: Line to extend
+        :type line: Line
+        :param make_queue: Callable (word, line) returning the candidates
+            for the word after word in line
+        :rtype: SearchResult
+        """
+        deadline = time.time() + self.timeout if self.timeout is not None else None
+        return self._search(queue, line, make_queue, Budget(self.max_nodes, deadline))
+
+    def _search(self, queue, line, make_queue, budget):
+        raise NotImplementedError
+
+
+class Budget(object):
+    """Counts nodes and tells a search when to stop"""
+    def __init__(self, max_nodes, deadline):
+        self.max_nodes = max_nodes
+        self.deadline = deadline
+        self.nodes = 0
+        self.best = None
+
+    def visit(self, line):
+        """Records a scored candidate line, returns False once the budget is spent"""
+        self.nodes += 1
+        if line.better(self.best):
+            self.best = line
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return False
+        if self.deadline is not None and time.time() >= self.deadline:
+            return False
+        return True
+
+    def result(self, line, exhausted=False):
+        return SearchResult(line, self.best, self.nodes, exhausted)
+
+
+class DepthFirstSearch(LineSearch):
+    """
+    Tries words in queue order, going as deep as possible before
+    backtracking.  Same order as the original recursive search, but
+    iterative so long lines can't hit the recursion limit.
+    """
+    def _search(self, queue, line, make_queue, budget):
+        end = object()
+        stack = [(iter(queue), line)]
+        while stack:
+            words, parent = stack[-1]
+            word = next(words, end)
+            # Exhausted queue
+            if word is end:
+                stack.pop()
+                continue
+            l = parent.add(word)
+            more = budget.visit(l)
+            # We got it!
+            if l.valid():
+                return budget.result(l)
+            if not more:
+                return budget.result(None, exhausted=True)
+            # Too long, try the next word
+            if l.over():
+                continue
+            # Keep going down the line
+            stack.append((iter(make_queue(word, l)), l))
+        return budget.result(None)
+
+
+class BeamSearch(LineSearch):
+    """
+    Extends lines a word at a time, keeping only the beam_width lowest
+    scoring lines at each length.  Lines with the same score keep queue
+    order, so the beam still follows the model's frequencies.
+    """
+    def __init__(self, beam_width=10, branching=None, max_nodes=None, timeout=None):
+        """
+        :param beam_width: Lines kept per step
+        :param branching: Optional cap on the words tried after each line
+        """
+        super(BeamSearch, self).__init__(max_nodes, timeout)
+        self.beam_width = beam_width
+        self.branching = branching
+
+    def _search(self, queue, line, make_queue, budget):
+        beam = [(line, queue)]
+        while beam:
+            children = []
+            for parent, words in beam:
+                for word in itertools.islice(words, self.branching):
+                    l = parent.add(word)
+                    more = budget.visit(l)
+                    if l.valid():
+                        return budget.result(l)
+                    if not more:
+                        return budget.result(None, exhausted=True)
+                    if not l.over():
+                        children.append(l)
+            # sorted is stable so ties keep their queue order
+            children = sorted(children, key=lambda c: c.score())[:self.beam_width]
+            beam = [(c, make_queue(c[-1], c)) for c in children]
+        return budget.result(None)
+
+
+class BestFirstSearch(LineSearch):
+    """
+    Always extends the lowest scoring line found so far.  Ties go to the
+    line found first.
+    """
+    def __init__(self, branching=None, max_nodes=None, timeout=None):
+        """
+        :param branching: Optional cap on the words tried after each line
+        """
+        super(BestFirstSearch, self).__init__(max_nodes, timeout)
+        self.branching = branching
+
+    def _search(self, queue, line, make_queue, budget):
+        counter = itertools.count()
+        # Heap of (score, tie breaker, line, candidate words)
+        heap = [(line.score(), next(counter), line, queue)]
+        while heap:
+            _, _, parent, words = heapq.heappop(heap)
+            for word in itertools.islice(words, self.branching):
+                l = parent.add(word)
+                more = budget.visit(l)
+                if l.valid():
+                    return budget.result(l)
+                if not more:
+                    return budget.result(None, exhausted=True)
+                if not l.over():
+                    heapq.heappush(heap, (l.score(), next(counter), l, make_queue(word, l)))
+        return budget.result(None)
+
+
+#
+# Main functions
+#
+
+STRATEGIES = {
+    'dfs': DepthFirstSearch,
+    'beam': BeamSearch,
+    'best': BestFirstSearch,
+}
+
+
+def get_search(search, **kwargs):
+    """
+    Returns a LineSearch
+    :param search: A LineSearch, or one of the names in STRATEGIES
+    :param kwargs: Passed to the strategy when search is a name
+    :rtype: LineSearch
+    """
+    if isinstance(search, LineSearch):
+        return search
+    if search not in STRATEGIES:
+        raise Exception("Unknown search strategy: %s" % search)
+    return STRATEGIES[search](**kwargs)
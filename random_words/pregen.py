@@ -0,0 +1,110 @@
+"""
+Pre-generation buffer for serving make_words requests with low latency.
+
+A PregenBuffer keeps a queue of ready-made sequences for each requested
+(length, init_token) bucket, filled by a background thread.  A request
+for a bucket with sequences waiting is answered straight from memory;
+once a bucket drops to its low watermark the thread tops it back up to
+capacity.  Requests for other buckets, or for empty ones, are generated
+on the spot.
+"""
+
+__author__ = 'eric'
+
+
+from collections import deque
+import random
+import threading
+
+
+#
+# Main classes
+#
+
+class PregenBuffer(object):
+    """Buffer of pre-generated sequences around a RandomWords, see module docstring"""
+    def __init__(self, model, buckets, capacity=64, low_watermark=None, seed=None):
+        """
+        :param model: RandomWords to generate from
+        :type model: RandomWords
+        :param buckets: Lengths, or (length, init_token) pairs, to keep sequences for
+        :param capacity: Sequences kept per bucket
+        :param low_watermark: Refill a bucket once it holds this many or fewer,
+            half of capacity by default
+        :param seed: Optional seed for the buffer's random streams
+        """
+        self.model = model
+        self.capacity = capacity
+        self.low_watermark = capacity // 2 if low_watermark is None else low_watermark
+        self._buffers = {}
+        for bucket in buckets:
+            key = bucket if isinstance(bucket, tuple) else (bucket, None)
+            self._buffers[key] = deque()
+        # The filler and the request path each get their own stream
+        self._fill_rng = random.Random(seed)
+        self._miss_rng = random.Random(None if seed is None else seed + 1)
+        self._lock = threading.Lock()
+        self._miss_lock = threading.Lock()
+        self._fill_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._wake = threading.Event()
+        self._wake.set()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self, lenn, init_token=None):
+        """
+        Returns a string of lenn tokens, from the buffer when one is waiting
+        :param init_token: Optional token to start from, see RandomWords.make_words
+        :rtype: str
+        """
+        buf = self._buffers.get((lenn, init_token))
+        if buf is not None:
+            try:
+                words = buf.popleft()
+            except IndexError:
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                self.model.metrics.incr('pregen_hits')
+                if len(buf) <= self.low_watermark:
+                    self._wake.set()
+                return words
+        with self._lock:
+            self.misses += 1
+        with self._miss_lock:
+            words = self.model._make_words(lenn, init_token, self._miss_rng)
+        self.model.metrics.incr('pregen_misses')
+        return words
+
+    def fill(self):
+        """Tops every bucket up to capacity, returns once they're full"""
+        with self._fill_lock:
+            for (lenn, init_token), buf in self._buffers.iteritems():
+                while len(buf) < self.capacity and not self._stopped:
+                    buf.append(self.model._make_words(lenn, init_token, self._fill_rng))
+
+    def stats(self):
+        """Returns hits, misses and the number of sequences waiting per bucket"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return dict(hits=hits, misses=misses,
+                    buffered=dict(('%d:%s' % (lenn, init_token or ''), len(buf))
+                                  for (lenn, init_token), buf in self._buffers.iteritems()))
+
+    def close(self):
+        """Stops the filler thread"""
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait()
+            self._wake.clear()
+            self.fill()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python2
+
+"""
+Pruning and count quantization for Random_Words models.
+
+prune() copies a model into a CompactProbDict, dropping rare transitions,
+capping the successors kept per token and optionally the vocabulary, and
+rescaling counts so every row's total fits in a given number of bits.
+The compact arrays are stored in the narrowest integer type their values
+fit, so quantized counts take one or two bytes each in memory.  The binary
+format always writes 64 bit counts, so quantizing doesn't shrink saved
+files.
+
+prune_report() compares two models: tokens, transitions, memory, file
+sizes and how far each token's successor distribution moved.
+
+Can be run as a script on a saved model:
+    python -m random_words.pruning old.model new.model --min-count 2 --top-k 50
+"""
+
+__author__ = 'eric'
+
+import random_words as rw
+import binary_model
+import sharded_model
+
+from collections import defaultdict
+import argparse
+import heapq
+import json
+import os
+import sys
+import cPickle as pickle
+
+
+#
+# Helpers
+#
+
+def token_frequencies(prob_dict):
+    """
+    Returns how often each token was seen: the larger of the counts of
+    transitions into and out of it, so tokens that only start lines count too
+    :rtype: {str: int}
+    """
+    incoming = defaultdict(int)
+    outgoing = {}
+    for token in prob_dict.keys():
+        successors = prob_dict.successors(token)
+        outgoing[token] = sum(successors.itervalues())
+        for nxt, f in successors.iteritems():
+            incoming[nxt] += f
+    return dict((t, max(incoming.get(t, 0), f)) for t, f in outgoing.iteritems())
+
+
+def quantize_row(row, max_total):
+    """
+    Rescales a row's counts so they sum to at most max_total, keeping every
+    count at least 1.  Rows that already fit are returned unchanged.
+    :param row: [(count, token)] sorted by count, largest first
+    :param max_total: Largest allowed row total
+    :rtype: [(int, str)]
+    """
+    total = sum(f for f, _ in row)
+    if total <= max_total:
+        return row
+    # Only max_total successors can have a count of at least 1
+    row = row[:max_total]
+    total = sum(f for f, _ in row)
+    # Floor of f * scale, plus 1, sums to at most max_total
+    scale = (max_total - len(row)) / float(total)
+    return [(int(f * scale) + 1, t) for f, t in row]
+
+
+def model_bytes(prob_dict):
+    """
+    Estimates the memory held by a model, in bytes.  Memory mapped models
+    count their mapped files, a sharded model all of its shards as they're
+    each mapped in turn while the whole model is read.
+    """
+    if isinstance(prob_dict, binary_model.MappedProbDict):
+        return os.path.getsize(prob_dict.path)
+    if isinstance(prob_dict, sharded_model.ShardedProbDict):
+        return sum(os.path.getsize(sharded_model.shard_path(prob_dict.path, i))
+                   for i in xrange(prob_dict.n_shards))
+    if isinstance(prob_dict, rw.ProbDict):
+        size = sys.getsizeof(prob_dict.map)
+        for token, successors in prob_dict.map.iteritems():
+            size += sys.getsizeof(token) + sys.getsizeof(successors)
+            size += sum(sys.getsizeof(f) for f in successors.itervalues())
+        return size
+    prob_dict._freeze()
+    dictionary = prob_dict.dictionary
+    size = sys.getsizeof(dictionary.token2id) + sys.getsizeof(dictionary.id2token)
+    size += sum(sys.getsizeof(t) for t in dictionary.id2token)
+    for arr in (prob_dict.offsets, prob_dict.successor_ids, prob_dict.cum_counts):
+        size += len(arr) * arr.itemsize
+    return size
+
+
+def pickle_bytes(prob_dict):
+    """Returns the size of the pickled model, or None if it can't be pickled"""
+    try:
+        return len(pickle.dumps(prob_dict, pickle.HIGHEST_PROTOCOL))
+    except TypeError:
+        return None
+
+
+def binary_bytes(prob_dict):
+    """
+    Returns the size of the model in the binary_model format, which always
+    writes counts as 64 bit whatever their type in memory
+    """
+    keys = prob_dict.keys()
+    n_edges = sum(len(prob_dict.successors(t)) for t in keys)
+    n_starts = len(getattr(prob_dict, 'starts', ()))
+    return (binary_model.HEADER.size + 16 * (len(keys) + 1) + 12 * (n_edges + n_starts) +
+            sum(len(t) for t in keys))
+
+
+def distribution_change(before, after):
+    """
+    Measures how far pruning moved the model's sampling distributions: the
+    total variation distance between each token's successor distributions,
+    averaged over tokens weighted by how often they were seen.  0 means no
+    change, 1 means every token now picks entirely different successors.
+    :rtype: float
+    """
+    weighted = 0.0
+    weight = 0
+    for token in before.keys():
+        p = before.successors(token)
+        p_total = sum(p.itervalues())
+        if not p_total:
+            continue
+        q = after.successors(token)
+        q_total = float(sum(q.itervalues()))
+        dist = 0.0
+        for t in set(p) | set(q):
+            dist += abs(p.get(t, 0) / float(p_total) - (q.get(t, 0) / q_total if q_total else 0))
+        weighted += p_total * dist / 2
+        weight += p_total
+    return weighted / weight if weight else 0.0
+
+
+#
+# Main functions
+#
+
+def prune(prob_dict, min_count=1, top_k=None, max_vocab=None, count_bits=None):
+    """
+    Returns a smaller copy of a model.  Each token's most frequent successor
+    is always kept so pruning never turns a token into a dead end.
+    :param prob_dict: ProbDict, CompactProbDict or MappedProbDict to prune
+    :param min_count: Drop transitions seen fewer times than this
+    :param top_k: Keep at most this many successors per token
+    :param max_vocab: Keep only this many of the most frequent tokens
+    :param count_bits: Rescale counts so every row's total fits in this many
+        bits, e.g. 8 or 16
+    :rtype: CompactProbDict
+    """
+    if top_k is not None and top_k < 1:
+        raise Exception("top_k must be at least 1, got %d" % top_k)
+    keep = None
+    if max_vocab is not None:
+        freqs = token_frequencies(prob_dict)
+        keep = set(heapq.nlargest(max_vocab, freqs, key=freqs.get))
+    max_total = (1 << count_bits) - 1 if count_bits else None
+
+    pruned = rw.CompactProbDict()
+    for token in prob_dict.keys():
+        if keep is not None and token not in keep:
+            continue
+        row = sorted(((f, nxt) for nxt, f in prob_dict.successors(token).iteritems()
+                      if keep is None or nxt in keep), reverse=True)
+        if not row:
+            continue
+        row = row[:1] + [r for r in row[1:top_k] if r[0] >= min_count]
+        if max_total:
+            row = quantize_row(row, max_total)
+        for f, nxt in row:
+            pruned.add(token, nxt, f)
+    # Only keep starts that can still be sampled from
+    for token, count in getattr(prob_dict, 'starts', rw.StartDist()).counts.iteritems():
+        if pruned.dictionary.token2id.get(token) is not None:
+            pruned.add_start(token, count)
+    pruned._freeze()
+    return pruned
+
+
+def prune_report(before, after):
+    """
+    Compares a model with its pruned copy
+    :rtype: dict
+    """
+    report = {}
+    for name, model in (('before', before), ('after', after)):
+        keys = model.keys()
+        report[name] = dict(tokens=len(keys),
+                            transitions=sum(len(model.successors(t)) for t in keys),
+                            memory_bytes=model_bytes(model),
+                            pickle_bytes=pickle_bytes(model),
+                            binary_bytes=binary_bytes(model))
+    report['distribution_change'] = distribution_change(before, after)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prune a saved Random_Words model")
+    parser.add_argument('src', help="saved model, pickled or binary")
+    parser.add_argument('dst', help="file to write the pruned binary model to")
+    parser.add_argument('--min-count', type=int, default=1)
+    parser.add_argument('--top-k', type=int)
+    parser.add_argument('--max-vocab', type=int)
+    parser.add_argument('--count-bits', type=int)
+    args = parser.parse_args()
+
+    model = rw.RandomWords()
+    model.load(args.src)
+    report = model.prune(args.min_count, args.top_k, args.max_vocab, args.count_bits)
+    model.save(args.dst)
+    print json.dumps(report, indent=2, sort_keys=True)
@@ -17,17 +17,54 @@ __author__ = 'Eric'
 
 
 from random_words import RandomWords
+import poem_search
+import utils
 
 import re
+import os
+import itertools
+import heapq
+import math
 import fuzzy
-from copy import deepcopy
+import cPickle as pickle
+from copy import copy
 import random
+from multiprocessing.pool import ThreadPool
 
 
 #
 # Globals
 #
 DMETA = fuzzy.DMetaphone()
+# Phonetic keys are saved next to the model with this extension
+PHONETICS_EXT = '.phonetics'
+# Number of sounds at the end of a word compared for rhymes
+RHYME_SOUNDS = 2
+
+
+#
+# Helpers
+#
+
+def rhyme_dist(goal, actual):
+    """
+    Returns the number of differing sounds between the ends of two
+    reversed phonetic keys.  Only the last RHYME_SOUNDS sounds count.
+    Keys that are empty (e.g. numbers) can't rhyme.
+    :type goal: str
+    :type actual: str
+    :rtype: int
+    """
+    if not goal or not actual:
+        return RHYME_SOUNDS
+    l = min(RHYME_SOUNDS, len(goal), len(actual))
+    dist = 0
+
+    for i in range(l):
+        if goal[i] != actual[i]:
+            dist += 1
+
+    return dist
 
 
 #
@@ -38,9 +75,29 @@ class RandomPoem(RandomWords):
     """
     Expects to be instantiated with a model for now.
     """
-    def __init__(self, scheme, model=None):
-        super(RandomPoem, self).__init__()
+    def __init__(self, scheme, model=None, targeted=True, search='dfs', metrics=None, **search_args):
+        """
+        :param scheme: List of line representations, e.g. ['5a', '7b', '5a']
+        :param model: Optional path of a saved model to load
+        :param targeted: Use the rhyme index to steer lines towards their
+            rhyme goal and prune words that can't reach one in time
+        :param search: How to search for each line, a LineSearch or one of
+            'dfs', 'beam' or 'best'
+        :param metrics: Optional metrics.Metrics to record search counters
+            and timings in, see RandomWords
+        :param search_args: Passed to the search strategy when given by name,
+            e.g. max_nodes and timeout to bound the work per line
+        """
+        super(RandomPoem, self).__init__(metrics=metrics)
         self.scheme = scheme
+        self.targeted = targeted
+        self.search = poem_search.get_search(search, **search_args)
+        # Search stats for the last run
+        self.nodes_expanded = 0
+        self.line_nodes = []
+        # Phonetic keys and rhyme index for the model, built on first use
+        self.phonetics = None
+        self.rhyme_index = None
         if type(model) == str:
             self.load(model)
         # Poem properties
@@ -73,8 +130,34 @@ class RandomPoem(RandomWords):
         t = self._get_itoken(None)
         return [t]
 
-    def __make_queue(self, root_word=None):
-        return WordQueue(root_word, self.prob_dict)
+    def __make_queue(self, root_word=None, line=None):
+        """
+        Returns the candidates for the word after root_word in line.
+        When targeting rhymes, words that can't lead to a rhyme before the
+        line runs over are dropped, and once the line is long enough
+        words that rhyme are tried first.
+        """
+        if not self.targeted or line is None or not line.r_goal:
+            return WordQueue(root_word, self.prob_dict, self.random)
+
+        index = self._get_rhyme_index()
+        rhymes = index.rhymes(line.r_goal, line.r_tolerance)
+        # Position in the line of the word being chosen
+        pos = len(line) + 1
+        last = line.s_goal + line.s_tolerance
+        if pos >= last:
+            # Last chance, only rhymes can make this line valid
+            return WordQueue(root_word, self.prob_dict, self.random, only=rhymes)
+
+        if pos == last - 1:
+            others = index.reaching(line.r_goal, line.r_tolerance)
+        else:
+            others = None
+        if pos >= line.s_goal - line.s_tolerance:
+            return itertools.chain(
+                WordQueue(root_word, self.prob_dict, self.random, only=rhymes),
+                WordQueue(root_word, self.prob_dict, self.random, only=others, exclude=rhymes))
+        return WordQueue(root_word, self.prob_dict, self.random, only=others)
 
     def __add_line(self, new_line, line_rep):
         # Add to array
@@ -82,6 +165,7 @@ class RandomPoem(RandomWords):
             self.lines.append(new_line)
         # If the line is Nil, use best
         elif self.best:
+            self.metrics.incr('line_fallbacks')
             self.lines.append(self.best)
         else:
             raise Exception("No valid poems!")
@@ -93,93 +177,225 @@ class RandomPoem(RandomWords):
 
     def __get_line(self, queue, line):
         """
-        Returns either None or a valid line
-        :param queue:
-        :param line:
-        :return:
-        """
-        # Queue lets us iterate through possible word choices for each word.
-        # Each level of recursion is a word
-        for word in queue:
-            # Add new token to the line
-            l = line.add(word)
-            # Update Best
-            if l.better(self.best):
-                self.best = l
-            # TODO: Could refactor to use ints? 0, -1, 1
-            # BC1: We Got it!
-            if l.valid():
-                return l
-            # BC2: Too long, try next word
-            if l.over():
-                continue
-            # Recursive Case: Keep going down the line
-            new_l = self.__get_line(self.__make_queue(word), l)
-            # If it's a valid line, return it, otherwise got to the next word
-            if new_l:
-                return new_l
-        # BC: 3 Exhausted queue
-        return None
+        Returns either None or a valid line, updating self.best and the
+        search stats
+        :param queue: Candidates for the first word
+        :param line: Line to extend
+        :return: Line|None
+        """
+        with self.metrics.timer('line_search'):
+            result = self.search.search(queue, line, self.__make_queue)
+        if result.best is not None and result.best.better(self.best):
+            self.best = result.best
+        self.nodes_expanded += result.nodes
+        self.line_nodes.append(result.nodes)
+        self.metrics.incr('search_nodes', result.nodes)
+        if result.exhausted:
+            self.metrics.incr('search_budget_exhausted')
+        return result.line
+
+    def save(self, path, *args, **kwargs):
+        """
+        Saves the model, and its phonetic keys next to it if they've been built.
+        Takes the arguments of RandomWords.save.
+        """
+        super(RandomPoem, self).save(path, *args, **kwargs)
+        if self.phonetics:
+            self.phonetics.save(path + PHONETICS_EXT)
+
+    def load(self, path, *args, **kwargs):
+        """
+        Loads a model, and its phonetic keys if they were saved with it.
+        Takes the arguments of RandomWords.load.
+        """
+        super(RandomPoem, self).load(path, *args, **kwargs)
+        if os.path.isfile(path + PHONETICS_EXT):
+            self.phonetics = PhoneticKeys.load(path + PHONETICS_EXT)
+
+    def _model_changed(self):
+        """The vocabulary may have changed, rebuild the phonetic keys and rhyme index on next use"""
+        super(RandomPoem, self)._model_changed()
+        self.phonetics = None
+        self.rhyme_index = None
+
+    def _get_phonetics(self):
+        """Returns the phonetic keys for this model, encoding the vocabulary the first time"""
+        if self.phonetics is None:
+            self.phonetics = PhoneticKeys(self.prob_dict.keys())
+        return self.phonetics
+
+    def _get_rhyme_index(self):
+        """Returns the rhyme index for this model, building it the first time"""
+        if self.rhyme_index is None:
+            self.rhyme_index = RhymeIndex(self.prob_dict, self._get_phonetics())
+        return self.rhyme_index
 
     def clear(self):
         self.best = None
         self.lines = []
         self. rhymes = {}
+        self.nodes_expanded = 0
+        self.line_nodes = []
+
+    def run(self, seed=None):
+        """
+        Generates a poem following self.scheme
+        :param seed: Optional seed for this poem's random stream
+        :rtype: str
+        """
+        with self.metrics.timer('poem'):
+            return self._run(seed)
 
-    def run(self):
+    def _run(self, seed):
+        if seed is not None:
+            self.random.seed(seed)
         self.clear()
+        phonetics = self._get_phonetics()
         queue = self.__make_init_queue()
         line = Line(self.__get_s_count(self.scheme[0]),
-                    self.__get_r_goal(None))
+                    self.__get_r_goal(None),
+                    phonetics=phonetics)
         for i, l in enumerate(self.scheme):
             self.__add_line(self.__get_line(queue, line), l)
             # Break if we're at the end
             if i >= len(self.scheme) - 1:
                 break
             # Make the next line
-            queue = self.__make_queue(self.lines[-1][-1])
             line = Line(self.__get_s_count(self.scheme[i+1]),
-                        self.__get_r_goal(self.scheme[i+1]))
+                        self.__get_r_goal(self.scheme[i+1]),
+                        phonetics=phonetics)
+            queue = self.__make_queue(self.lines[-1][-1], line)
             self.best = None
 
         return '\n'.join(str(l) for l in self.lines)
 
+    def run_many(self, seeds, workers=4):
+        """
+        Generates one poem per seed concurrently from a thread pool.
+        Each poem runs on its own copy of the search state and its own
+        random stream while sharing this model read-only.
+        :param seeds: Iterable of seeds
+        :param workers: Number of threads
+        :return: [str] in the same order as seeds
+        """
+        # Build the shared phonetic keys and index before the threads start
+        self._get_phonetics()
+        if self.targeted:
+            self._get_rhyme_index()
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self._run_seed, seeds)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _run_seed(self, seed):
+        poem = copy(self)
+        poem.random = random.Random()
+        return poem.run(seed)
+
+
+class LineGoal(object):
+    """Goals and tolerances shared by every version of a Line"""
+    __slots__ = ('s_goal', 'r_goal', 'i_tolerance', 'r_tolerance', 's_tolerance',
+                 'phonetics', 'r_key')
+
+    def __init__(self, s_goal, r_goal, tolerance, phonetics):
+        self.s_goal = s_goal
+        self.r_goal = r_goal
+        self.i_tolerance = tolerance
+        self.r_tolerance = 1
+        self.s_tolerance = tolerance
+        self.phonetics = phonetics
+        # Reversed phonetic key of the rhyme goal
+        self.r_key = phonetics[r_goal] if r_goal else None
+
 
 class Line(object):
-    """Wrapper for a line of text"""
-    def __init__(self, s_goal, r_goal, tolerance=2, tokens=None):
+    """
+    Wrapper for a line of text.
+
+    Lines are immutable and linked: add returns a new Line pointing back
+    at this one, so lines that share a prefix share its nodes.  Each node
+    carries its syllable count and score, so adding a word and scoring
+    the result is O(1).
+    """
+    __slots__ = ('goal', 'parent', 'word', 'length', 's_count', 'r_dist', '_score')
+
+    def __init__(self, s_goal, r_goal, tolerance=2, tokens=None, phonetics=None):
         """
         :param s_goal: Syllable count goal for the line
         :param r_goal: Rhyme goal for the line
         :type r_goal: str
         :param tolerance: +- goal for syllable count and rhyme distance
-        :param tokens: Used for copying this line
+        :param tokens: Optional words to start the line with
+        :param phonetics: Phonetic key table to score rhymes with
+        :type phonetics: PhoneticKeys
         :return: None
         """
-        self.s_goal = s_goal
-        self.r_goal = r_goal
-        self.i_tolerance = tolerance
-        self.r_tolerance = 1
-        self.s_tolerance = tolerance
+        phonetics = phonetics if phonetics is not None else PhoneticKeys()
+        self.goal = LineGoal(s_goal, r_goal, tolerance, phonetics)
+        self.parent = None
+        self.word = None
+        self.length = 0
+        self.s_count = 0
+        self.r_dist = 0
+        self._score = 0
         if tokens:
-            self.tokens = tokens
-        else:
-            self.tokens = []
+            # Build the links from a fresh empty line and take on the last one
+            line = Line(s_goal, r_goal, tolerance, phonetics=phonetics)
+            for t in tokens:
+                line = line.add(t)
+            for attr in Line.__slots__:
+                setattr(self, attr, getattr(line, attr))
+
+    # Goals
+    s_goal = property(lambda self: self.goal.s_goal)
+    r_goal = property(lambda self: self.goal.r_goal)
+    i_tolerance = property(lambda self: self.goal.i_tolerance)
+    r_tolerance = property(lambda self: self.goal.r_tolerance)
+    s_tolerance = property(lambda self: self.goal.s_tolerance)
+    phonetics = property(lambda self: self.goal.phonetics)
+
+    @property
+    def tokens(self):
+        """The words of this line, rebuilt from the links"""
+        tokens = []
+        line = self
+        while line.parent is not None:
+            tokens.append(line.word)
+            line = line.parent
+        tokens.reverse()
+        return tokens
 
     def __len__(self):
-        return len(self.tokens)
+        return self.length
 
     def __getitem__(self, key):
+        # The last word is what the poem search keeps asking for
+        if key == -1 and self.length:
+            return self.word
         return self.tokens[key]
 
     def __str__(self):
         return ' '.join(t for t in self.tokens)
 
     def add(self, word):
-        """Adds a word to this line and returns a copy of this line"""
-        return Line(self.s_goal, self.r_goal,
-                    tolerance=self.i_tolerance,
-                    tokens=self.tokens + [word])
+        """Returns a new line that is this line followed by word"""
+        goal = self.goal
+        line = Line.__new__(Line)
+        line.goal = goal
+        line.parent = self
+        line.word = word
+        line.length = self.length + 1
+        # For now, every word counts as one syllable
+        line.s_count = self.s_count + 1
+        if goal.r_goal:
+            line.r_dist = rhyme_dist(goal.r_key, goal.phonetics[word])
+        else:
+            line.r_dist = 0
+        line._score = abs(goal.s_goal - line.s_count) + line.r_dist
+        return line
 
     #
     # Scoring functions
@@ -190,17 +406,15 @@ class Line(object):
         Lower score is better.
         :rtype int
         """
-        # Maybe sum the difference between actual and goal for both
-        # s_count and rhyme?
-        if len(self.tokens) == 0:
-            return 0
-        return self.__get_s_dist() + self.__rhyme_dist()
+        # Sum of the difference between actual and goal for both
+        # s_count and rhyme, computed when the line was made
+        return self._score
 
     def better(self, l):
         """Returns true if this line has a better score than the given line"""
         if not l:
             return True
-        return self.score() < l.score()
+        return self._score < l._score
 
     def valid(self):
         """
@@ -210,80 +424,165 @@ class Line(object):
         # TODO: Make this a bit smarter
         # if self.score() <= sum([self.r_tolerance, self.s_tolerance]):
         #     return True
-        if self.__get_s_dist() <= self.s_tolerance and self.__rhyme_dist() <= self.r_tolerance:
-            return True
-        else:
-            return False
+        goal = self.goal
+        return abs(goal.s_goal - self.s_count) <= goal.s_tolerance and self.r_dist <= goal.r_tolerance
 
     def over(self):
         """Returns True if this line is well over the required token/syllable count."""
         # TODO: Maybe have a configurable threshold?
-        return (self.__get_s_count() - self.s_goal) > self.s_tolerance
+        return (self.s_count - self.goal.s_goal) > self.goal.s_tolerance
 
-    def __get_s_dist(self):
-        return abs(self.s_goal - self.__get_s_count())
 
-    def __get_s_count(self):
-        """Returns the current syllable count.
-        For now, just returns the number of words"""
-        return len(self.tokens)
+class PhoneticKeys(object):
+    """
+    Table of reversed Double Metaphone keys, so rhyme scoring is a lookup
+    rather than a call to DMETA.  Tokens missing from the table are
+    encoded on first lookup and remembered.
+    """
+    def __init__(self, tokens=()):
+        """
+        :param tokens: Vocabulary to encode up front
+        :type tokens: iterable of str
+        """
+        # {str: str}
+        self.keys = dict((t, self.encode(t)) for t in tokens)
 
-    def __rhyme_dist(self):
-        """Returns the distance of the current word from the rhyme_goal.
+    def __len__(self):
+        return len(self.keys)
 
-        """
-        # Could use levenshtien, but just doing basic for now
-        # Could also experiment with weighting sounds at the end more highly?
+    def __getitem__(self, token):
+        key = self.keys.get(token)
+        if key is None:
+            key = self.keys[token] = self.encode(token)
+        return key
 
-        # No goal
-        if not self.r_goal:
-            return 0
+    @staticmethod
+    def encode(token):
+        """Returns the reversed primary metaphone key for token, '' if it has none"""
+        return (DMETA(token)[0] or '')[::-1]
 
-        # Get the phonetic structure and reverse the strings
-        # goal = fuzzy.nysiis(self.r_goal)[::-1]
-        # actual = fuzzy.nysiis(self.tokens[-1])[::-1]
-        goal = DMETA(self.r_goal)[0][::-1]
-        try:
-            actual = DMETA(self.tokens[-1])[0][::-1]
-        except:
-            print self.tokens
-            raise
-        l = min(2, len(goal), len(actual))
-        dist = 0
+    def save(self, path):
+        """Pickle the key table"""
+        utils.ensure_directories_exist(path)
+        pickle.dump(self.keys, open(path, 'wb'), pickle.HIGHEST_PROTOCOL)
 
-        for i in range(l):
-            if goal[i] != actual[i]:
-                dist += 1
+    @classmethod
+    def load(cls, path):
+        """Loads a key table saved with save"""
+        phonetics = cls()
+        phonetics.keys = pickle.load(open(path, 'rb'))
+        return phonetics
 
-        return dist
+
+class RhymeIndex(object):
+    """
+    Index from the last sounds of a word to the vocabulary tokens ending
+    in them, for steering lines towards a rhyme goal.
+
+    Tokens are bucketed by the first RHYME_SOUNDS characters of their
+    reversed phonetic key, which is all rhyme_dist looks at, so the rhymes
+    for a goal are found by scoring buckets rather than every token.
+    """
+    def __init__(self, prob_dict, phonetics):
+        """
+        :param prob_dict: Model whose vocabulary and transitions are indexed
+        :param phonetics: Phonetic keys for the vocabulary
+        :type phonetics: PhoneticKeys
+        """
+        self.prob_dict = prob_dict
+        self.phonetics = phonetics
+        # {str: set(str)} reversed key prefix => tokens
+        self.suffixes = {}
+        for t in prob_dict.keys():
+            self.suffixes.setdefault(phonetics[t][:RHYME_SOUNDS], set()).add(t)
+        # {str: set(str)} token => tokens that precede it, built on first use
+        self.predecessors = None
+        # Caches keyed by (goal suffix, tolerance)
+        self._rhymes = {}
+        self._reaching = {}
+
+    def rhymes(self, goal, tolerance=1):
+        """
+        Returns the tokens within tolerance of rhyming with goal
+        :param goal: Word to rhyme with
+        :rtype: frozenset
+        """
+        suffix = self.phonetics[goal][:RHYME_SOUNDS]
+        key = (suffix, tolerance)
+        if key not in self._rhymes:
+            found = set()
+            for s, tokens in self.suffixes.iteritems():
+                if rhyme_dist(suffix, s) <= tolerance:
+                    found.update(tokens)
+            self._rhymes[key] = frozenset(found)
+        return self._rhymes[key]
+
+    def reaching(self, goal, tolerance=1):
+        """
+        Returns the tokens that can be followed by a rhyme for goal
+        :param goal: Word to rhyme with
+        :rtype: frozenset
+        """
+        suffix = self.phonetics[goal][:RHYME_SOUNDS]
+        key = (suffix, tolerance)
+        if key not in self._reaching:
+            predecessors = self._get_predecessors()
+            found = set()
+            for t in self.rhymes(goal, tolerance):
+                found.update(predecessors.get(t, ()))
+            self._reaching[key] = frozenset(found)
+        return self._reaching[key]
+
+    def _get_predecessors(self):
+        if self.predecessors is None:
+            predecessors = {}
+            for t in self.prob_dict.keys():
+                for nxt in self.prob_dict.successors(t):
+                    predecessors.setdefault(nxt, set()).add(t)
+            self.predecessors = predecessors
+        return self.predecessors
 
 
 # WordQueue
 class WordQueue(object):
-    """Generates queue of words"""
-    def __init__(self, root_word, prob_dict):
+    """
+    Generates queue of words: the successors of root_word in a random
+    order where each next word is chosen with probability weighted by its
+    observed frequency among the words not yet yielded.
+
+    Uses exponential keys (Efraimidis & Spirakis): each word gets the key
+    log(u) / f for a uniform u, and yielding words by descending key is
+    the same as repeatedly drawing without replacement.  Keys go in a heap
+    so words are only ordered as they're consumed, and the model's
+    successor map is read but never copied.
+    """
+    def __init__(self, root_word, prob_dict, rng=random, only=None, exclude=None):
+        """
+        :param root_word: Word whose successors are queued
+        :param prob_dict: Model to get successors from
+        :param rng: Random stream to sample with
+        :param only: Optional set, queue only successors in it
+        :param exclude: Optional set, skip successors in it
+        """
         # str
         self.root_word = root_word
-        # {str: int}
-        self.map = deepcopy(prob_dict.map[root_word])
+        # {str: int}, shared with the model so don't modify
+        self.map = prob_dict.successors(root_word)
+        self.only = only
+        self.exclude = exclude
+        # random.Random
+        self.rng = rng
 
     def __iter__(self):
-        while len(self.map) > 0:
-            # New random number and sum
-            rnd = random.randint(1, sum(self.map.values()))
-            summ = 0
-            choice = None
-
-            # Select token with probability weighted by
-            # observed frequency in model
-            for t, f in deepcopy(self.map).iteritems():
-                summ += f
-                if summ >= rnd:
-                    choice = t
-                    break
-
-            # Yield the token
-            yield choice
-
-            # Pop term from map so that it doesn't get chosen again
-            self.map.pop(choice, None)
+        rnd = self.rng.random
+        only = self.only
+        exclude = self.exclude
+        # Min heap of negated keys
+        heap = []
+        for t, f in self.map.iteritems():
+            if (only is None or t in only) and (exclude is None or t not in exclude):
+                # 1 - random() is in (0, 1] so the log is defined
+                heap.append((-math.log(1.0 - rnd()) / f, t))
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[1]
@@ -10,12 +10,27 @@ of a simple markov chain.
 __author__ = 'eric'
 
 import utils
+from tokenizer import get_tokenizer, tokenize_parallel
+from token_cache import TokenCache
+from metrics import Metrics, NULL_METRICS
+from dedupe import SeenLines, BloomLines, fingerprint
+from delta_log import DeltaLog, writable, snapshot_format
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 import random
+import bisect
+from array import array
 import cPickle as pickle
 import os
+import sys
+import gzip
+import bz2
+import tarfile
 import itertools
+import logging
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
 from six import PY3, iteritems, iterkeys, itervalues, string_types
 
 
@@ -24,6 +39,25 @@ from six import PY3, iteritems, iterkeys, itervalues, string_types
 #      - Translate html characters/accents to ASCII
 
 
+#
+# Globals
+#
+
+# Guards merging staged additions into a CompactProbDict
+_FREEZE_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# Unsigned array typecodes, narrowest first
+UINT_TYPECODES = ('B', 'H', 'I', 'L')
+# Tokens handed to add_sequence at a time when reading a document
+SEQUENCE_CHUNK = 4096
+# Documents per worker sent to the pool at a time by add_to_model
+DOCS_PER_WORKER = 4
+# Seen line fingerprints are saved next to the model with this extension
+SEEN_EXT = '.seen'
+
+
 #
 # Helpers
 #
@@ -35,14 +69,122 @@ class FileGen(object):
         if not os.path.exists(dirr):
             raise Exception("Given directory doesn't exist!\n %s" % dirr)
         self.dirr = dirr
-        if len([f for f in os.listdir(self.dirr) if os.path.splitext(f)[1] == '.txt']) == 0:
-            raise Exception("No text files in given directory!")
 
     def __iter__(self):
+        found = False
         for f in os.listdir(self.dirr):
             f_path = os.path.join(self.dirr, f)
             if os.path.isfile(f_path) and os.path.splitext(f_path)[1] == '.txt':
+                found = True
                 yield f_path
+        if not found:
+            raise Exception("No text files in given directory!")
+
+
+class DocGen(object):
+    """
+    Generator to yield documents from any supported corpus source.
+
+    A source can be:
+        - A directory of .txt files
+        - A path to a .txt, .gz or .bz2 file, or a tar archive of .txt files
+        - '-' for stdin
+        - An open file object
+        - An iterable whose items are documents, either as a string or
+          as an iterable of lines
+
+    Documents on disk are yielded as paths (see open_lines), everything
+    else as an iterable of lines.  Nothing is read ahead, so each source
+    is streamed in a single pass.
+    """
+    def __init__(self, source):
+        if isinstance(source, string_types) and source != '-' and not os.path.exists(source):
+            raise Exception("Given path doesn't exist!\n %s" % source)
+        self.source = source
+
+    def __iter__(self):
+        source = self.source
+        if isinstance(source, string_types):
+            if source == '-':
+                yield sys.stdin
+            elif os.path.isdir(source):
+                for f in FileGen(source):
+                    yield f
+            elif tarfile.is_tarfile(source):
+                for lines in self._tar_members(source):
+                    yield lines
+            else:
+                yield source
+        elif hasattr(source, 'read'):
+            yield source
+        else:
+            for doc in source:
+                if isinstance(doc, string_types):
+                    yield doc.splitlines(True)
+                else:
+                    yield doc
+
+    @staticmethod
+    def _tar_members(path):
+        # Stream mode so compressed archives are never seeked or unpacked
+        archive = tarfile.open(path, 'r|*')
+        try:
+            for member in archive:
+                if member.isfile() and os.path.splitext(member.name)[1] == '.txt':
+                    yield archive.extractfile(member)
+        finally:
+            archive.close()
+
+
+def open_lines(path):
+    """
+    Opens the text file at path for reading line by line,
+    decompressing .gz and .bz2 files on the fly.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.gz':
+        return gzip.open(path, 'rb')
+    if ext == '.bz2':
+        return bz2.BZ2File(path, 'r')
+    return open(path, 'r')
+
+
+def _count_doc(args):
+    """
+    Counts the token pairs and line starts in one document.  Module level
+    so it can be sent to a multiprocessing pool.
+    :param args: (document, settings), where document is a path or a list
+        of lines and settings are RandomWords keyword arguments
+    :return: (Counter of pairs, Counter of start tokens)
+    """
+    doc, settings = args
+    starts = Counter()
+    return Counter(RandomWords(**settings)._doc_pairs(doc, starts)), starts
+
+
+def _tokenize_doc(args):
+    """
+    Returns the token lines of one document, for uniq_lines mode where
+    repeats are filtered against the whole corpus before counting.
+    Module level so it can be sent to a multiprocessing pool.
+    :param args: As for _count_doc
+    :rtype: [[str]]
+    """
+    doc, settings = args
+    return list(RandomWords(**settings)._doc_token_lines(doc))
+
+
+def narrow_array(values, max_value):
+    """
+    Returns values in an array of the narrowest unsigned type that can hold max_value
+    :param values: Iterable of ints
+    :param max_value: Largest value that will be stored
+    :rtype: array
+    """
+    for typecode in UINT_TYPECODES:
+        if max_value < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, values)
+    raise OverflowError("%d doesn't fit in an unsigned array" % max_value)
 
 
 #
@@ -55,90 +197,570 @@ class RandomWords(object):
     Builds a probability model for words from a corpus and can
     generate new words from that model.
     """
-    def __init__(self, corpus_dir=None, newlines=False, uniq_lines=False):
+    def __init__(self, corpus_dir=None, newlines=False, uniq_lines=False, compact=False, tokenizer=None,
+                 cache_dir=None, metrics=None, uniq_capacity=None):
         """
-        Expects a string path to a directory containing .txt files to build a model from.
+        Expects a string path to a directory containing .txt files to build a model from,
+        or any other source accepted by add_to_model.
         If no path is given, the model can be added to later wit add_to_model
-        :param corpus_dir: Path to get corpus from
+        :param corpus_dir: Path or source to get corpus from
+        :param compact: Use the array backed CompactProbDict instead of ProbDict
+        :param tokenizer: None to split lines on whitespace, or the name of a
+            tokenizer.Tokenizer backend ('regex' or 'spacy') to tokenize them with
+        :param cache_dir: Optional directory to cache tokenized files in, so
+            files that haven't changed aren't tokenized again
+        :param metrics: Optional metrics.Metrics to record counters and timings
+            in, shared with the model.  Nothing is recorded without one.
+        :param uniq_lines: Skip lines already seen anywhere in the corpus,
+            including in earlier add_to_model calls.  The lines seen are
+            saved with the model, at path + SEEN_EXT, and loaded with it.
+        :param uniq_capacity: Remember seen lines in a fixed size Bloom filter
+            sized for this many lines rather than exactly, see dedupe
         :return: None
         """
-        if corpus_dir and not os.path.exists(corpus_dir):
+        if isinstance(corpus_dir, string_types) and corpus_dir != '-' and not os.path.exists(corpus_dir):
             raise Exception("Given directory doesn't exist!\n %s" % corpus_dir)
         self.newlines = newlines
         self.uniq_lines = uniq_lines
+        self.uniq_capacity = uniq_capacity
+        # Fingerprints of the lines added so far in uniq_lines mode
+        self.seen_lines = None
+        if uniq_lines:
+            self.seen_lines = BloomLines(uniq_capacity) if uniq_capacity else SeenLines()
+        self.tokenizer = tokenizer
+        self._tokenizer_cls = tokenizer and get_tokenizer(tokenizer)
+        self.cache_dir = cache_dir
+        self.token_cache = TokenCache(cache_dir) if cache_dir else None
         self.seed = None
+        # Each model has its own random stream
+        self.random = random.Random()
         self.init_corpus_dir = corpus_dir
+        self.metrics = metrics or NULL_METRICS
+        # Delta log of the last saved or loaded snapshot, and the counts
+        # added since the last checkpoint to it
+        self.delta_log = None
+        self.pending_pairs = Counter()
+        self.pending_starts = Counter()
+        # Array backed copy of a dict model for make_words_batch, as
+        # (prob_dict it was made from, copy)
+        self._batch_model = None
 
-        self.prob_dict = ProbDict()
+        self.prob_dict = CompactProbDict() if compact else ProbDict()
+        self._attach_metrics()
         if corpus_dir:
             self.add_to_model(corpus_dir)
 
-    def add_to_model(self, corpus_dir):
-        """Add all txt files in given dir to the model"""
-        for f in FileGen(corpus_dir):
-            prev = self.__get_first_token(f)
-            seen_lines = set()
-            for line in open(f, 'r'):
-                # Make sure there's content
-                if not line.strip():
-                    continue
-                # Check uniqe lines
-                if self.uniq_lines:
-                    if line.strip() in seen_lines:
-                        continue
-                    else:
-                        seen_lines.add(line.strip)
-                # Tokenize and add to model
-                tokens = self.__tokenize(line)
-                for t in tokens[1:]:
-                    self.prob_dict.add(prev, t)
-                    prev = t
-
-    def __get_first_token(self, path):
-        # Iterate so that we don't start with a whitespace token
-        for line in open(path, 'r'):
-            for t in self.__tokenize(line):
-                if t.strip():
-                    return t
+    def add_to_model(self, source, workers=1):
+        """
+        Add all documents from the given source to the model.
+        See DocGen for the kinds of source accepted.
+        :param source: Directory, file path, '-', file object or iterable of documents
+        :param workers: Number of processes to count documents with.  With more
+            than one worker each document's pairs are counted in a separate
+            process and the counts are merged into the model.  Documents that
+            aren't files on disk are read into memory to send them to a worker.
+        """
+        self._ensure_writable()
+        with self.metrics.timer('add_to_model'):
+            self._add_to_model(source, workers)
+        self._model_changed()
+
+    def _add_to_model(self, source, workers):
+        metrics = self.metrics
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                settings = dict(newlines=self.newlines, tokenizer=self.tokenizer, cache_dir=self.cache_dir)
+                # Repeats are filtered here, against every document seen
+                count = _tokenize_doc if self.uniq_lines else _count_doc
+                # The source is read here rather than in the pool's threads,
+                # so its errors reach the caller.  The next batch is read
+                # while the last one is counted.
+                counting = None
+                for batch in self._doc_batches(source, settings, workers * DOCS_PER_WORKER):
+                    submitted = pool.map_async(count, batch)
+                    if counting is not None:
+                        self._merge_results(counting.get())
+                    counting = submitted
+                if counting is not None:
+                    self._merge_results(counting.get())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for doc in DocGen(source):
+                n = 0
+                starts = Counter()
+                for tokens in self._line_sequences(self._doc_token_lines(doc), starts):
+                    self.prob_dict.add_sequence(tokens)
+                    if self.delta_log is not None:
+                        self.pending_pairs.update(itertools.izip(tokens, itertools.islice(tokens, 1, None)))
+                    n += len(tokens) - 1
+                for token, count in starts.iteritems():
+                    self.prob_dict.add_start(token, count)
+                if self.delta_log is not None:
+                    self.pending_starts.update(starts)
+                metrics.incr('documents')
+                metrics.incr('tokens_ingested', n)
+
+    @staticmethod
+    def _doc_batches(source, settings, batch_size):
+        """Yields lists of up to batch_size (document, settings) arguments for the worker pool"""
+        batch = []
+        for doc in DocGen(source):
+            batch.append((doc if isinstance(doc, string_types) else list(doc), settings))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _merge_results(self, results):
+        """Merges a batch of _count_doc, or in uniq_lines mode _tokenize_doc, results"""
+        for result in results:
+            if self.uniq_lines:
+                result = self._count_lines(result)
+            self._merge_counts(*result)
+
+    def _merge_counts(self, counts, starts):
+        """
+        Adds one document's counted pairs and start tokens to the model
+        :param counts: Counter of (token, next token) pairs
+        :param starts: Counter of start tokens
+        """
+        self.prob_dict.add_counts(counts)
+        for token, count in starts.iteritems():
+            self.prob_dict.add_start(token, count)
+        if self.delta_log is not None:
+            self.pending_pairs.update(counts)
+            self.pending_starts.update(starts)
+        self.metrics.incr('documents')
+        self.metrics.incr('tokens_ingested', sum(counts.itervalues()))
+
+    def add_tokenized(self, source, workers=1, batch_size=64, chunk_size=256):
+        """
+        Tokenizes whole documents with this model's tokenizer backend and
+        adds them to the model.  Unlike add_to_model, which tokenizes line
+        by line, documents are parsed in batches and, with more than one
+        worker, across processes, with the token lists streamed straight
+        into the model.
+        :param source: Any source accepted by add_to_model
+        :param workers: Number of tokenizer processes
+        :param batch_size: Documents per parser batch
+        :param chunk_size: Documents sent to a worker at a time
+        """
+        if not self.tokenizer:
+            raise Exception("add_tokenized needs a tokenizer backend, e.g. tokenizer='spacy'")
+        self._ensure_writable()
+        docs = (self._read_doc(doc) for doc in DocGen(source))
+        for tokens in tokenize_parallel(docs, self.tokenizer, workers, batch_size, chunk_size,
+                                        replace_whitespace=not self.newlines):
+            self.add_tokens([t.encode('utf-8') for t in tokens])
+
+    def add_tokens(self, tokens):
+        """
+        Adds the pairs of consecutive tokens in a sequence to the model,
+        and its first token as a start token
+        :param tokens: List of tokens
+        """
+        self._ensure_writable()
+        if tokens and tokens[0]:
+            self.prob_dict.add_start(tokens[0])
+            if self.delta_log is not None:
+                self.pending_starts[tokens[0]] += 1
+        self.prob_dict.add_sequence(tokens)
+        if self.delta_log is not None:
+            self.pending_pairs.update(itertools.izip(tokens, itertools.islice(tokens, 1, None)))
+        self.metrics.incr('tokens_ingested', max(len(tokens) - 1, 0))
+        self._model_changed()
+
+    def _ensure_writable(self):
+        """Copies a read only model, memory mapped or sharded, into memory so it can grow"""
+        prob_dict = writable(self.prob_dict)
+        if prob_dict is not self.prob_dict:
+            self.prob_dict = prob_dict
+            self._attach_metrics()
+
+    def _model_changed(self):
+        """Called whenever prob_dict changes or is replaced, to drop anything derived from it"""
+        self._batch_model = None
+
+    @staticmethod
+    def _read_doc(doc):
+        """Returns the text of a document from DocGen as unicode"""
+        lines = open_lines(doc) if isinstance(doc, string_types) else doc
+        text = ''.join(lines)
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        return text
+
+    def _count_lines(self, token_lines):
+        """Returns (Counter of pairs, Counter of start tokens) for a document's token lines"""
+        starts = Counter()
+        return Counter(self._line_pairs(token_lines, starts)), starts
+
+    def _doc_pairs(self, doc, starts=None):
+        """
+        Yields (token, next token) pairs from a document, in one pass.
+        Pairs run across lines, starting from the first non-whitespace token.
+        :param doc: Path to a file or an iterable of lines
+        :param starts: Optional Counter to count each line's first
+            non-whitespace token in
+        """
+        return self._line_pairs(self._doc_token_lines(doc), starts)
+
+    def _line_pairs(self, token_lines, starts=None):
+        """
+        Yields the pairs of _doc_pairs from a document's token lines,
+        skipping lines seen before in uniq_lines mode
+        """
+        for tokens in self._line_sequences(token_lines, starts):
+            for pair in itertools.izip(tokens, itertools.islice(tokens, 1, None)):
+                yield pair
+
+    def _line_sequences(self, token_lines, starts=None, chunk_size=SEQUENCE_CHUNK):
+        """
+        Yields a document's token lines joined into token lists whose
+        consecutive tokens are the pairs of _doc_pairs.  Each list holds
+        about chunk_size tokens and starts with the last token of the one
+        before, so no pair is lost between them.
+        """
+        seq = None
+        for tokens in token_lines:
+            if self.seen_lines is not None and not self.seen_lines.add(fingerprint(tokens)):
+                self.metrics.incr('duplicate_lines')
+                continue
+            # Don't start with a whitespace token
+            start = next((t for t in tokens if t.strip()), None)
+            if start is not None and starts is not None:
+                starts[start] += 1
+            if seq is None:
+                if start is None:
+                    return
+                seq = [start]
+            seq.extend(itertools.islice(tokens, 1, None))
+            if len(seq) >= chunk_size:
+                yield seq
+                seq = [seq[-1]]
+        if seq is not None and len(seq) > 1:
+            yield seq
+
+    def _doc_token_lines(self, doc):
+        """
+        Returns the tokens of each line of a document that has content,
+        from the token cache for files when there is one.
+        :param doc: Path to a file or an iterable of lines
+        :return: Iterable of token lists
+        """
+        if self.token_cache is None or not isinstance(doc, string_types):
+            return self._token_lines(open_lines(doc) if isinstance(doc, string_types) else doc)
+        # Repeated lines are cached too, they're filtered afterwards
+        key = self.token_cache.key(doc, (self.newlines, self.tokenizer))
+        token_lines = self.token_cache.get(key)
+        if token_lines is None:
+            token_lines = list(self._token_lines(open_lines(doc)))
+            self.token_cache.put(key, token_lines)
+        return token_lines
+
+    def _token_lines(self, lines):
+        """Yields the tokens of each line with content"""
+        for line in lines:
+            # Make sure there's content
+            if not line.strip():
+                continue
+            # The model stores utf-8, like the tokenizers' output
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            yield self.__tokenize(line)
 
     def __tokenize(self, string):
-        """Just splits on spaces for now."""
+        """Splits on spaces unless a tokenizer backend was chosen."""
         # TODO: normalize case and whitespace?
+        if self._tokenizer_cls:
+            # Tokenizers work in unicode, the model stores utf-8
+            if isinstance(string, str):
+                string = string.decode('utf-8', 'replace')
+            return [t.encode('utf-8') for t in
+                    self._tokenizer_cls(string, replace_whitespace=not self.newlines)]
         if self.newlines:
             return string.split(" ")
         return string.split()
 
-    def save(self, path):
-        """Pickle probability model for later"""
-        utils.ensure_directories_exist(path)
-        pickle.dump(self.prob_dict, open(path, 'wb'))
-        print "Saved to: %s" % path
+    def save(self, path, binary=True, shards=None):
+        """
+        Save probability model for later.  The saved model becomes the base
+        snapshot for checkpoint, and any delta log it had is dropped.
+        :param binary: Write the mmap-able binary format, otherwise pickle
+        :param shards: Split the model into this many binary shards, opened
+            on demand by load.  See sharded_model.
+        """
+        if shards:
+            import sharded_model
+            sharded_model.save_sharded(self.prob_dict, path, shards)
+        elif binary:
+            import binary_model
+            binary_model.save_model(self.prob_dict, path)
+        else:
+            utils.ensure_directories_exist(path)
+            pickle.dump(self.prob_dict, open(path, 'wb'))
+        self._save_seen(path)
+        self._start_deltas(path).remove()
+        logger.info("Saved to: %s", path)
 
-    def load(self, path):
-        """Loads pickled probDict to replace self.prob_dict"""
+    def load(self, path, max_resident_shards=None, replay=True):
+        """
+        Loads a saved model to replace self.prob_dict.
+        Binary models are memory mapped, pickled models are loaded into
+        memory.  Sharded models only open their index, shards are opened
+        as tokens in them are looked up.  Binary and sharded models are
+        read only until documents are added, which copies them into memory.
+        A model with a delta log is copied into memory and the log replayed,
+        one without is copied on the first checkpointed addition.  In
+        uniq_lines mode the lines seen are loaded with the model.
+        :param max_resident_shards: Most shards of a sharded model kept open
+        :param replay: Replay the model's delta log, see checkpoint
+        """
         if not os.path.exists(path) or not os.path.isfile(path):
             raise Exception("Given file doesn't exist!\n %s" % path)
-        self.prob_dict = pickle.load(open(path, 'rb'))
+        import binary_model
+        import sharded_model
+        if sharded_model.is_sharded_model(path):
+            self.prob_dict = sharded_model.load_sharded(path, max_resident_shards or sharded_model.MAX_RESIDENT)
+        elif binary_model.is_binary_model(path):
+            self.prob_dict = binary_model.load_model(path)
+        else:
+            self.prob_dict = pickle.load(open(path, 'rb'))
+        if self.uniq_lines:
+            self.seen_lines = self._load_seen(path)
+        deltas = self._start_deltas(path)
+        self._attach_metrics()
+        if replay and deltas.exists():
+            self._ensure_writable()
+            n = deltas.replay(self.prob_dict)
+            logger.info("Replayed %d checkpoints from: %s", n, deltas.path)
+        self._model_changed()
+
+    def checkpoint(self):
+        """
+        Appends the counts added since the last save, load or checkpoint to
+        the delta log of the saved model, rather than saving it all again.
+        See delta_log.
+        """
+        if self.delta_log is None:
+            raise Exception("No saved model to checkpoint against, save the model first")
+        if self.pending_pairs or self.pending_starts:
+            self.delta_log.append(self.pending_pairs, self.pending_starts)
+            self.pending_pairs = Counter()
+            self.pending_starts = Counter()
+            self._save_seen(self.delta_log.base_path)
+
+    def compact_deltas(self):
+        """
+        Saves the model over its base snapshot, in the same format, with
+        every checkpoint and any counts added since folded in, and drops
+        the delta log.  Checkpoints the model doesn't hold yet, because it
+        was loaded without replaying or another writer appended them, are
+        replayed first.
+        """
+        if self.delta_log is None:
+            raise Exception("No saved model to compact, save the model first")
+        if not self.delta_log.exists() and not self.pending_pairs and not self.pending_starts:
+            return
+        if self.delta_log.exists():
+            self._ensure_writable()
+            if self.delta_log.replay(self.prob_dict):
+                self._model_changed()
+        self.save(self.delta_log.base_path, **snapshot_format(self.delta_log.base_path))
+
+    def _save_seen(self, path):
+        """Saves the fingerprints of the lines seen in uniq_lines mode next to the model at path"""
+        seen_path = path + SEEN_EXT
+        if self.seen_lines is None:
+            # Don't leave an older model's lines behind
+            if os.path.isfile(seen_path):
+                os.remove(seen_path)
+            return
+        with utils.atomic_write(seen_path) as f:
+            pickle.dump(self.seen_lines, f, pickle.HIGHEST_PROTOCOL)
+
+    def _load_seen(self, path):
+        """Returns the seen lines saved with the model at path, or none seen yet"""
+        seen_path = path + SEEN_EXT
+        if os.path.isfile(seen_path):
+            with open(seen_path, 'rb') as f:
+                return pickle.load(f)
+        return BloomLines(self.uniq_capacity) if self.uniq_capacity else SeenLines()
+
+    def _start_deltas(self, path):
+        """Makes the model at path the base for checkpoints"""
+        self.delta_log = DeltaLog(path)
+        self.pending_pairs = Counter()
+        self.pending_starts = Counter()
+        return self.delta_log
+
+    def prune(self, min_count=1, top_k=None, max_vocab=None, count_bits=None, report=True):
+        """
+        Replaces the model with a pruned, array backed copy.
+        See pruning.prune for the options.
+        :param report: Compare the old and new models, see pruning.prune_report
+        :return: The report dict, or None
+        """
+        import pruning
+        pruned = pruning.prune(self.prob_dict, min_count, top_k, max_vocab, count_bits)
+        # Reported before the model is replaced, so a failure leaves it as it was
+        result = pruning.prune_report(self.prob_dict, pruned) if report else None
+        self.prob_dict = pruned
+        self._attach_metrics()
+        self._model_changed()
+        # The pruned model no longer grows from the saved one
+        self.delta_log = None
+        return result
+
+    def enable_metrics(self, metrics=None):
+        """
+        Starts recording counters and timings for this model
+        :param metrics: Metrics to record in, a new one by default
+        :rtype: metrics.Metrics
+        """
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self._attach_metrics()
+        return metrics
+
+    def _attach_metrics(self):
+        """Shares this model's metrics with its prob_dict"""
+        if self.metrics.enabled:
+            self.prob_dict.metrics = self.metrics
+        else:
+            # Fall back to the class default
+            self.prob_dict.__dict__.pop('metrics', None)
 
     def make_words(self, lenn, init_token=None, seed=123):
         """Returns a string of lenn tokens"""
         # Only set seed once so that the model can be used multiple times in one session
         if not self.seed:
             self.seed = seed
-            random.seed(seed)
+            self.random.seed(seed)
+        return self._make_words(lenn, init_token, self.random)
+
+    def _make_words(self, lenn, init_token, rng):
+        """Returns a string of lenn tokens drawn with the given random.Random"""
         # Get an initial token to start with
-        if not init_token:
-            init_token = self._get_itoken(init_token)
-        return ' '.join(w for w in GenWords(init_token, self.prob_dict, lenn))
+        with self.metrics.timer('make_words'):
+            if not init_token:
+                init_token = self._get_itoken(init_token, rng)
+            words = ' '.join(w for w in GenWords(init_token, self.prob_dict, lenn, rng))
+        self.metrics.incr('tokens_generated', lenn)
+        return words
+
+    def pregenerate(self, buckets, capacity=64, low_watermark=None, seed=None):
+        """
+        Starts generating sequences in the background so requests for them
+        are answered from memory.  See pregen.PregenBuffer.
+        :param buckets: Lengths, or (length, init_token) pairs, to keep sequences for
+        :rtype: pregen.PregenBuffer
+        """
+        import pregen
+        return pregen.PregenBuffer(self, buckets, capacity, low_watermark, seed)
+
+    def generate_many(self, requests, workers=4):
+        """
+        Serves many make_words requests concurrently from a thread pool.
+        The model is shared read-only and every request gets its own random
+        stream, so each result depends only on its own seed.
+        :param requests: Iterable of (lenn, init_token, seed) tuples
+        :param workers: Number of threads
+        :return: [str] in the same order as requests
+        """
+        # Merge any staged additions before the threads start reading
+        if isinstance(self.prob_dict, CompactProbDict):
+            self.prob_dict._freeze()
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self._make_request, requests)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _make_request(self, request):
+        lenn, init_token, seed = request
+        return self._make_words(lenn, init_token, random.Random(seed))
+
+    def make_words_batch(self, n_sequences, lenn, init_tokens=None, seed=123, as_ids=False):
+        """
+        Generates many sequences at once.  All sequences are advanced a
+        step at a time from the array backed transition table, with the
+        random numbers for each step drawn up front, which is much cheaper
+        per token than calling make_words in a loop.  A dict model is
+        copied into arrays on the first call, and again after it changes.
+        :param n_sequences: Number of sequences to generate
+        :param lenn: Length of each sequence in tokens
+        :param init_tokens: Optional list of n_sequences start tokens
+        :param seed: Seed for the random generator, see make_words
+        :param as_ids: Return rows of token ids rather than strings.  Ids refer
+            to self.prob_dict.dictionary, so this needs an array backed model.
+            Sequences that reach a token with no successors continue with -1.
+        :return: [str] or [array]
+        """
+        if not self.seed:
+            self.seed = seed
+            self.random.seed(seed)
+        if init_tokens is None:
+            init_tokens = [self._get_itoken(None) for _ in xrange(n_sequences)]
+        if len(init_tokens) != n_sequences:
+            raise Exception("Expected %d init tokens, got %d" % (n_sequences, len(init_tokens)))
 
-    def _get_itoken(self, itoken):
-        """Chooses a random token from the dictionary with uniform probability"""
-        return random.choice(self.prob_dict.keys())
+        if isinstance(self.prob_dict, CompactProbDict):
+            model = self.prob_dict
+        elif as_ids:
+            raise Exception("Token ids need an array backed model, use compact=True")
+        else:
+            model = self._get_batch_model()
+
+        token2id = model.dictionary.token2id
+        ids = [token2id.get(t, -1) for t in init_tokens]
+        rnd = self.random.random
+        # One column of ids per step
+        steps = []
+        with self.metrics.timer('make_words_batch'):
+            for _ in xrange(lenn):
+                draws = [rnd() for _ in xrange(n_sequences)]
+                ids = model.get_ids(ids, draws)
+                steps.append(ids)
+        self.metrics.incr('tokens_generated', n_sequences * lenn)
+        rows = zip(*steps) if steps else [() for _ in xrange(n_sequences)]
+
+        if as_ids:
+            return [array('i', row) for row in rows]
+        id2token = model.dictionary.id2token
+        return [' '.join(id2token[i] if i >= 0 else "<UNK>" for i in row) for row in rows]
+
+    def _get_batch_model(self):
+        """
+        Returns an array backed copy of a dict model, made on first use and
+        kept until documents are added or the model is replaced
+        """
+        if self._batch_model is None or self._batch_model[0] is not self.prob_dict:
+            self._batch_model = (self.prob_dict, self.prob_dict.compact())
+        return self._batch_model[1]
+
+    def _get_itoken(self, itoken, rng=None):
+        """
+        Chooses a token to start from, weighted by how often each token
+        started a line.  Models saved before start tokens were recorded
+        fall back to a uniform choice over the dictionary.
+        """
+        rng = rng or self.random
+        token = self.prob_dict.get_start(rng)
+        if token is None:
+            token = rng.choice(self.prob_dict.keys())
+        return token
 
 
 class GenWords(object):
     """Iterator object that can produce a random string from a ProbDict"""
-    def __init__(self, init_token, prob_dict, lenn):
+    def __init__(self, init_token, prob_dict, lenn, rng=random):
         """
         :param init_token: First token in the string
         :type init_token: str
@@ -146,18 +768,21 @@ class GenWords(object):
         :type prob_dict: ProbDict
         :param lenn: Length of the string to product in tokens
         :type lenn: int
+        :param rng: Random stream to sample with
+        :type rng: random.Random
         :return:
         """
         self.prev = init_token
         self.prob_dict = prob_dict
         self.lenn = lenn
+        self.rng = rng
 
     def __len__(self):
         return self.lenn
 
     def __iter__(self):
         for i in xrange(self.lenn):
-            self.prev = self.prob_dict.get(self.prev)
+            self.prev = self.prob_dict.get(self.prev, self.rng)
             yield self.prev
 
 
@@ -170,8 +795,28 @@ class ProbDict(object):
     Can also be used to retrieve a random word given the preceding token.
     """
 
+    # Replaced per instance by RandomWords when metrics are enabled
+    metrics = NULL_METRICS
+
     def __init__(self):
         self.map = {}
+        # Lazily built sampling tables: {str: ([str], [int])}
+        self._tables = {}
+        # Tokens seen starting a line
+        self.starts = StartDist()
+
+    def __getstate__(self):
+        # Sampling tables are a cache, don't pickle them
+        state = self.__dict__.copy()
+        state.pop('_tables', None)
+        state.pop('metrics', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tables = {}
+        # Older models have no start tokens
+        self.__dict__.setdefault('starts', StartDist())
 
     def keys(self):
         return self.map.keys()
@@ -179,57 +824,445 @@ class ProbDict(object):
     def values(self):
         return self.map.values()
 
-    def add(self, curr, nxt):
+    def successors(self, token):
+        """
+        Returns the observed successors of the given token and their frequencies.
+        :param token: The current word
+        :rtype: {str: int}
+        """
+        return self.map.get(token, {})
+
+    def compact(self):
+        """Returns a CompactProbDict holding the same transitions as this one"""
+        return CompactProbDict.from_prob_dict(self)
+
+    def add_start(self, token, count=1):
+        """Records that token started a line count times"""
+        self.starts.add(token, count)
+
+    def get_start(self, rng=random):
+        """
+        Retrieve a random start token, weighted by how often it started a line.
+        Only tokens with successors are chosen.
+        :return: str, or None if no starts were recorded
+        """
+        return self.starts.sample(rng, self.map.get)
+
+    def add(self, curr, nxt, count=1):
         """
         Add a token and it's following neighbor to the dictionary
         :param curr: The current token
         :type curr: str
         :param nxt: The next token
         :type nxt: str
+        :param count: Number of times the pair was observed
+        :type count: int
         :return: None
         """
         if not curr or not nxt:
-            print "Bad token given: %s\t%s" % (curr, nxt)
+            self.metrics.incr('bad_tokens')
+            logger.debug("Bad token given: %s\t%s", curr, nxt)
             return
         if curr not in self.map:
             self.map[curr] = defaultdict(int)
         if nxt not in self.map:
             self.map[nxt] = defaultdict(int)
+        if not self.map[curr]:
+            # curr can be sampled from now, it may be a start token
+            self.starts.invalidate()
         # Incf curr.next
-        self.map[curr][nxt] += 1
+        self.map[curr][nxt] += count
+        # Sampling table for curr is stale now
+        self._tables.pop(curr, None)
 
-    def get(self, token):
+    def add_sequence(self, tokens):
+        """
+        Adds each pair of consecutive tokens in a sequence, as add would
+        one pair at a time, in a single pass
+        :param tokens: List of tokens
+        :return: None
+        """
+        if len(tokens) < 2:
+            return
+        m = self.map
+        bad = 0
+        new_row = False
+        prev = tokens[0]
+        prev_row = m.get(prev) if prev else None
+        for t in itertools.islice(tokens, 1, None):
+            if not prev or not t:
+                bad += 1
+                logger.debug("Bad token given: %s\t%s", prev, t)
+                prev = t
+                prev_row = m.get(t) if t else None
+                continue
+            if prev_row is None:
+                prev_row = m[prev] = defaultdict(int)
+            if not prev_row:
+                new_row = True
+            prev_row[t] += 1
+            row = m.get(t)
+            if row is None:
+                row = m[t] = defaultdict(int)
+            prev, prev_row = t, row
+        self._added(tokens, new_row, bad)
+
+    def add_counts(self, counts):
+        """
+        Adds pre-aggregated pair counts, as add would one pair at a time
+        :param counts: {(curr, nxt): count}, e.g. a Counter of pairs
+        :return: None
+        """
+        m = self.map
+        bad = 0
+        new_row = False
+        for (curr, nxt), count in counts.iteritems():
+            if not curr or not nxt:
+                bad += 1
+                logger.debug("Bad token given: %s\t%s", curr, nxt)
+                continue
+            row = m.get(curr)
+            if row is None:
+                row = m[curr] = defaultdict(int)
+            if not row:
+                new_row = True
+            row[nxt] += count
+            if nxt not in m:
+                m[nxt] = defaultdict(int)
+        self._added((curr for curr, _ in counts), new_row, bad)
+
+    def _added(self, currs, new_row, bad):
+        """Bookkeeping after a bulk add: stale tables, start tokens and bad token counts"""
+        if self._tables:
+            for curr in currs:
+                self._tables.pop(curr, None)
+        if new_row:
+            # Tokens that can be sampled from now may be start tokens
+            self.starts.invalidate()
+        if bad:
+            self.metrics.incr('bad_tokens', bad)
+
+    def _get_table(self, token):
+        """
+        Returns the sampling table for the given token, building it if needed.
+        The table is a list of successor tokens and a matching list of
+        cumulative frequencies, in the same order as the successor dict.
+        :param token: The current word
+        :return: ([str], [int])
+        """
+        table = self._tables.get(token)
+        if table is None:
+            tokens = []
+            cumulative = []
+            summ = 0
+            for t, f in self.map[token].iteritems():
+                summ += f
+                tokens.append(t)
+                cumulative.append(summ)
+            table = (tokens, cumulative)
+            self._tables[token] = table
+        return table
+
+    def get(self, token, rng=random):
         """
         Retrieve a random word following the given word,
         weighted by the previously observed frequency
         :param token: The current word
+        :param rng: Random stream to sample with, defaults to the random module
         :return: str
         """
         # Check that token is in dictionary
+        if self.metrics.enabled:
+            self.metrics.incr('sampling_calls')
         if token not in self.map or not self.map[token]:
-            print "Unknown token:  %s" % token
+            self.metrics.incr('unknown_tokens')
+            logger.debug("Unknown token:  %s", token)
             return "<UNK>"
 
-        # Choose a token
-        freqs = self.map[token]
-        rnd = random.randint(1, sum(freqs.values()))
-        summ = 0
-
         # Select a random token with probability weighted by the
         # observed frequency by choosing a random integer between
-        # 1 and the sum of all frequencies and then summing the
-        # frequencies until the sum is greater or equal to the
-        # random number and choosing the word at that point in the
-        # iteration.
+        # 1 and the sum of all frequencies and then finding the first
+        # token whose cumulative frequency is greater or equal to the
+        # random number.  The cumulative table is cached per token so
+        # each call is a binary search rather than a walk of every
+        # successor.
+        tokens, cumulative = self._get_table(token)
+        rnd = rng.randint(1, cumulative[-1])
+        return tokens[bisect.bisect_left(cumulative, rnd)]
+
+
+class CompactProbDict(object):
+    """
+    Array backed version of ProbDict with the same add/get/keys API.
+
+    Tokens are interned to integer ids by a Dictionary and transitions are
+    stored in compressed sparse row form: the successors of token id i are
+    successor_ids[offsets[i]:offsets[i + 1]] and cum_counts holds the running
+    total of their frequencies within that row, so a row can be sampled
+    with a binary search and no per-token dicts are kept.
+
+    Calls to add are staged and merged into the arrays the next time the
+    model is read, so it's cheapest to add everything before sampling.
+    """
+
+    # Replaced per instance by RandomWords when metrics are enabled
+    metrics = NULL_METRICS
+
+    def __init__(self):
+        self.dictionary = Dictionary()
+        # Row i covers offsets[i]:offsets[i + 1]
+        self.offsets = array('L', [0])
+        # Successor token ids
+        self.successor_ids = array('I')
+        # Cumulative frequencies, restarting at each row
+        self.cum_counts = array('L')
+        # Staged additions: {int: {int: int}}
+        self._pending = {}
+        # Tokens seen starting a line
+        self.starts = StartDist()
+
+    @classmethod
+    def from_prob_dict(cls, prob_dict):
+        """
+        Builds a CompactProbDict from a dict backed ProbDict
+        :type prob_dict: ProbDict
+        :rtype: CompactProbDict
+        """
+        compact = cls()
+        for token in prob_dict.keys():
+            compact.dictionary.add_token(token)
+        for token, freqs in prob_dict.map.iteritems():
+            if freqs:
+                compact._pending[compact.dictionary.token2id[token]] = dict(
+                    (compact.dictionary.token2id[t], f) for t, f in freqs.iteritems())
+        compact.starts = StartDist(prob_dict.starts.counts)
+        compact._freeze()
+        return compact
 
-        for t, f in freqs.iteritems():
-            summ += f
-            if summ >= rnd:
-                return t
+    def __getstate__(self):
+        self._freeze()
+        state = self.__dict__.copy()
+        state.pop('metrics', None)
+        return state
 
-        # Error catch
-        print "Something wrong here!"
-        return "<UNK>"
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Older models have no start tokens
+        self.__dict__.setdefault('starts', StartDist())
+
+    def keys(self):
+        return self.dictionary.token2id.keys()
+
+    def values(self):
+        return [self.successors(t) for t in self.dictionary.id2token]
+
+    def successors(self, token):
+        """
+        Returns the observed successors of the given token and their frequencies.
+        :param token: The current word
+        :rtype: {str: int}
+        """
+        self._freeze()
+        row = self._row(token)
+        if row is None:
+            return {}
+        lo, hi = row
+        id2token = self.dictionary.id2token
+        freqs = {}
+        prev = 0
+        for i in xrange(lo, hi):
+            freqs[id2token[self.successor_ids[i]]] = self.cum_counts[i] - prev
+            prev = self.cum_counts[i]
+        return freqs
+
+    def add(self, curr, nxt, count=1):
+        """
+        Add a token and it's following neighbor to the dictionary
+        :param curr: The current token
+        :type curr: str
+        :param nxt: The next token
+        :type nxt: str
+        :param count: Number of times the pair was observed
+        :type count: int
+        :return: None
+        """
+        if not curr or not nxt:
+            self.metrics.incr('bad_tokens')
+            logger.debug("Bad token given: %s\t%s", curr, nxt)
+            return
+        curr_id = self.dictionary.add_token(curr)
+        nxt_id = self.dictionary.add_token(nxt)
+        row = self._pending.get(curr_id)
+        if row is None:
+            row = self._pending[curr_id] = {}
+        row[nxt_id] = row.get(nxt_id, 0) + count
+
+    def add_sequence(self, tokens):
+        """
+        Adds each pair of consecutive tokens in a sequence, as add would
+        one pair at a time, looking each token up once
+        :param tokens: List of tokens
+        :return: None
+        """
+        add_token = self.dictionary.add_token
+        pending = self._pending
+        bad = 0
+        prev = tokens[0] if tokens else None
+        prev_id = None
+        for t in itertools.islice(tokens, 1, None):
+            if not prev or not t:
+                bad += 1
+                logger.debug("Bad token given: %s\t%s", prev, t)
+                prev, prev_id = t, None
+                continue
+            if prev_id is None:
+                prev_id = add_token(prev)
+            t_id = add_token(t)
+            row = pending.get(prev_id)
+            if row is None:
+                row = pending[prev_id] = {}
+            row[t_id] = row.get(t_id, 0) + 1
+            prev, prev_id = t, t_id
+        if bad:
+            self.metrics.incr('bad_tokens', bad)
+
+    def add_counts(self, counts):
+        """
+        Adds pre-aggregated pair counts, as add would one pair at a time
+        :param counts: {(curr, nxt): count}, e.g. a Counter of pairs
+        :return: None
+        """
+        add_token = self.dictionary.add_token
+        pending = self._pending
+        bad = 0
+        for (curr, nxt), count in counts.iteritems():
+            if not curr or not nxt:
+                bad += 1
+                logger.debug("Bad token given: %s\t%s", curr, nxt)
+                continue
+            curr_id = add_token(curr)
+            nxt_id = add_token(nxt)
+            row = pending.get(curr_id)
+            if row is None:
+                row = pending[curr_id] = {}
+            row[nxt_id] = row.get(nxt_id, 0) + count
+        if bad:
+            self.metrics.incr('bad_tokens', bad)
+
+    def add_start(self, token, count=1):
+        """Records that token started a line count times"""
+        self.starts.add(token, count)
+
+    def get_start(self, rng=random):
+        """
+        Retrieve a random start token, weighted by how often it started a line.
+        Only tokens with successors are chosen.
+        :return: str, or None if no starts were recorded
+        """
+        self._freeze()
+        return self.starts.sample(rng, self._row)
+
+    def get(self, token, rng=random):
+        """
+        Retrieve a random word following the given word,
+        weighted by the previously observed frequency
+        :param token: The current word
+        :param rng: Random stream to sample with, defaults to the random module
+        :return: str
+        """
+        if self.metrics.enabled:
+            self.metrics.incr('sampling_calls')
+        self._freeze()
+        row = self._row(token)
+        if row is None:
+            self.metrics.incr('unknown_tokens')
+            logger.debug("Unknown token:  %s", token)
+            return "<UNK>"
+        lo, hi = row
+        rnd = rng.randint(1, self.cum_counts[hi - 1])
+        return self.dictionary.id2token[self.successor_ids[bisect.bisect_left(self.cum_counts, rnd, lo, hi)]]
+
+    def get_ids(self, token_ids, draws):
+        """
+        Samples a successor for each of many tokens at once.
+        :param token_ids: Current token ids, -1 for unknown
+        :param draws: One random float in [0, 1) per token
+        :return: [int] next token ids, -1 where a token has no successors
+        """
+        self._freeze()
+        offsets = self.offsets
+        cum_counts = self.cum_counts
+        successor_ids = self.successor_ids
+        n_rows = len(offsets) - 1
+        bisect_left = bisect.bisect_left
+        nxt = []
+        for token_id, draw in itertools.izip(token_ids, draws):
+            if token_id < 0 or token_id >= n_rows:
+                nxt.append(-1)
+                continue
+            lo = offsets[token_id]
+            hi = offsets[token_id + 1]
+            if lo == hi:
+                nxt.append(-1)
+                continue
+            # Same as randint(1, total)
+            rnd = int(draw * cum_counts[hi - 1]) + 1
+            nxt.append(successor_ids[bisect_left(cum_counts, rnd, lo, hi)])
+        return nxt
+
+    def _row(self, token):
+        """Returns the (start, end) slice for token's successors, or None if it has none"""
+        token_id = self.dictionary.token2id.get(token)
+        if token_id is None or token_id + 1 >= len(self.offsets):
+            return None
+        lo = self.offsets[token_id]
+        hi = self.offsets[token_id + 1]
+        if lo == hi:
+            return None
+        return lo, hi
+
+    def _freeze(self):
+        """Merges staged additions into the arrays"""
+        if not self._pending:
+            return
+        with _FREEZE_LOCK:
+            # Another thread may have merged them while we waited
+            if self._pending:
+                self._merge_pending()
+
+    def _merge_pending(self):
+        """Rebuilds the arrays with the staged additions folded in"""
+        offsets = array('L', [0])
+        successors = array('I')
+        cum_counts = array('L')
+        max_total = 0
+        n_rows = len(self.offsets) - 1
+        for token_id in xrange(len(self.dictionary)):
+            # Existing successors keep their position, new ones are appended
+            pending = self._pending.get(token_id, {})
+            summ = 0
+            if token_id < n_rows:
+                prev = 0
+                for i in xrange(self.offsets[token_id], self.offsets[token_id + 1]):
+                    nxt_id = self.successor_ids[i]
+                    f = self.cum_counts[i] - prev
+                    prev = self.cum_counts[i]
+                    summ += f + pending.pop(nxt_id, 0)
+                    successors.append(nxt_id)
+                    cum_counts.append(summ)
+            for nxt_id, f in pending.iteritems():
+                summ += f
+                successors.append(nxt_id)
+                cum_counts.append(summ)
+            offsets.append(len(successors))
+            max_total = max(max_total, summ)
+        # Store each array in the narrowest type its values fit
+        self.offsets = narrow_array(offsets, offsets[-1])
+        self.successor_ids = narrow_array(successors, len(self.dictionary))
+        self.cum_counts = narrow_array(cum_counts, max_total)
+        self._pending = {}
+        # Start tokens may have gained successors
+        self.starts.invalidate()
 
 
 class Dictionary(object):
@@ -240,7 +1273,8 @@ class Dictionary(object):
     """
     def __init__(self):
         self.token2id = {}
-        self.id2token = {}
+        # Ids are dense so a list is enough for the reverse mapping
+        self.id2token = []
 
     def __len__(self):
         """
@@ -260,3 +1294,88 @@ class Dictionary(object):
         """Return a list of all token ids."""
         return list(self.token2id.values())
 
+    def add_token(self, token):
+        """
+        Returns the id for the given token, assigning the next free id if it's new.
+        :param token: str
+        :return: int
+        """
+        token_id = self.token2id.get(token)
+        if token_id is None:
+            token_id = len(self.id2token)
+            self.token2id[token] = token_id
+            self.id2token.append(token)
+        return token_id
+
+
+class StartDist(object):
+    """
+    Frequencies of the tokens seen starting a line or document, sampled
+    in O(1) with an alias table built on first use.
+    """
+    def __init__(self, counts=None):
+        # {str: int}
+        self.counts = dict(counts or {})
+        # Alias table: ([str], [float], [int]), None when stale, empty when
+        # no token can be sampled
+        self._table = None
+
+    def __getstate__(self):
+        return dict(counts=self.counts)
+
+    def __setstate__(self, state):
+        self.counts = state['counts']
+        self._table = None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, token, count=1):
+        self.counts[token] = self.counts.get(token, 0) + count
+        self._table = None
+
+    def invalidate(self):
+        """Rebuilds the table on the next sample, e.g. once more tokens are valid"""
+        self._table = None
+
+    def _build(self, valid):
+        """Builds the alias table with Vose's method"""
+        tokens = [t for t in self.counts if valid is None or valid(t)]
+        if not tokens:
+            self._table = ()
+            return self._table
+        n = len(tokens)
+        total = float(sum(self.counts[t] for t in tokens))
+        scaled = [self.counts[t] * n / total for t in tokens]
+        prob = [1.0] * n
+        alias = range(n)
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Whatever is left is 1 up to rounding
+        self._table = (tokens, prob, alias)
+        return self._table
+
+    def sample(self, rng=random, valid=None):
+        """
+        Returns a start token with probability proportional to its count
+        :param valid: Optional predicate, only tokens it accepts are sampled.
+            It's applied when the table is built, call invalidate() when
+            its answers change.
+        :return: str, or None if there's no start token to choose
+        """
+        table = self._table
+        if table is None:
+            table = self._build(valid)
+        if not table:
+            return None
+        tokens, prob, alias = table
+        u = rng.random() * len(tokens)
+        i = int(u)
+        return tokens[i] if u - i < prob[i] else tokens[alias[i]]
@@ -0,0 +1,430 @@
+#!/usr/bin/env python2
+
+"""
+Generation server for Random_Words.
+
+Loads a model once and answers requests from many clients over a Unix
+socket or TCP.  The protocol is one JSON object per line each way:
+
+    {"id": 1, "type": "words", "length": 20, "init_token": "I", "seed": 5}
+    {"id": 2, "type": "poem", "scheme": ["5a", "7b", "5a", "7b"], "seed": 5}
+    {"id": 3, "type": "stats"}
+
+init_token and seed are optional, length is at most MAX_LENGTH.  Every
+response carries the request's id and either a "result" or an "error".
+Requests on one connection are served concurrently, so responses can come
+back in a different order.
+
+Word requests without a seed are collected for a few milliseconds and
+generated together with make_words_batch.  Seeded requests are generated
+on their own so their results stay reproducible.  Poems are searched in a
+separate pool of processes, each with its own copy of the model, and
+don't hold a request thread while they wait, so a slow poem never holds
+up word requests.  Each connection writes its own responses, so a slow
+client only holds up itself.
+
+Run with:
+    python -m random_words.server model.model --socket /tmp/random_words.sock
+"""
+
+__author__ = 'eric'
+
+from random_words import RandomWords, ProbDict, CompactProbDict
+from metrics import Metrics
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+import argparse
+import json
+import multiprocessing
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+
+
+#
+# Globals
+#
+
+# Word requests generated together at most
+MAX_BATCH = 256
+# Seconds to wait for more word requests before generating a batch
+MAX_WAIT = 0.005
+# Threads serving requests, also caps how many word requests can share a batch
+THREADS = 64
+# Most tokens a word request can ask for
+MAX_LENGTH = 10000
+
+# Poem search state of a poem worker process
+_POEM = None
+
+
+#
+# Helpers
+#
+
+class _Pending(object):
+    """A word request waiting for its batch"""
+    def __init__(self, lenn, init_token, seed):
+        self.lenn = lenn
+        self.init_token = init_token
+        self.seed = seed
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WordBatcher(object):
+    """
+    Generates word requests submitted from many threads in batches, from
+    one background thread that owns the model's random stream.
+    """
+    def __init__(self, model, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        """
+        :param model: RandomWords to generate from
+        :param max_batch: Most requests generated in one batch
+        :param max_wait: Seconds to wait for more requests after the first
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, lenn, init_token=None, seed=None):
+        """Generates lenn tokens, waiting for the batch the request lands in"""
+        pending = _Pending(lenn, init_token, seed)
+        self._queue.put(pending)
+        return pending.wait()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if pending is None:
+                    # Finish this batch, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(pending)
+            self._generate(batch)
+
+    def _generate(self, batch):
+        model = self.model
+        model.metrics.incr('batches')
+        model.metrics.incr('batched_requests', len(batch))
+        # make_words_batch needs the array backed model to be cheap
+        batchable = isinstance(model.prob_dict, CompactProbDict)
+        by_len = defaultdict(list)
+        for pending in batch:
+            if batchable and pending.seed is None:
+                by_len[pending.lenn].append(pending)
+                continue
+            try:
+                pending.finish(model._make_request((pending.lenn, pending.init_token, pending.seed)))
+            except Exception as e:
+                pending.finish(error=e)
+        for lenn, group in by_len.iteritems():
+            try:
+                init_tokens = [p.init_token or model._get_itoken(None) for p in group]
+                results = model.make_words_batch(len(group), lenn, init_tokens)
+            except Exception as e:
+                for pending in group:
+                    pending.finish(error=e)
+                continue
+            for pending, words in zip(group, results):
+                pending.finish(words)
+
+
+def _init_poem_worker(model_path, search, search_args):
+    """Loads the model once in each poem worker process"""
+    global _POEM
+    import random_poem
+    _POEM = random_poem.RandomPoem([], model_path, search=search, **search_args)
+
+
+def _run_poem(args):
+    """
+    Searches for one poem in a poem worker
+    :return: (poem, None), or (None, error message) as apply_async has no
+        error callback
+    """
+    scheme, seed = args
+    try:
+        _POEM.scheme = scheme
+        return _POEM.run(seed), None
+    except Exception as e:
+        return None, str(e)
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Reads request lines from a client on a thread of its own, and writes
+    the responses from this one as they finish
+    """
+    def handle(self):
+        responses = Queue.Queue()
+        reader = threading.Thread(target=self._read, args=(responses,))
+        reader.daemon = True
+        reader.start()
+        # Number of requests read, known once the client stops sending
+        n_requests = None
+        n_responses = 0
+        connected = True
+        # Answer everything before hanging up
+        while n_requests is None or n_responses < n_requests:
+            response_line = responses.get()
+            if isinstance(response_line, int):
+                n_requests = response_line
+                continue
+            n_responses += 1
+            if not connected:
+                continue
+            try:
+                self.wfile.write(response_line)
+                self.wfile.flush()
+            except socket.error:
+                # Client went away, nothing to tell it
+                connected = False
+
+    def _read(self, responses):
+        """Submits each request line, then puts the number of requests on responses"""
+        n = 0
+        try:
+            for line in iter(self.rfile.readline, ''):
+                if not line.strip():
+                    continue
+                self.server.app.submit_line(line, responses.put)
+                n += 1
+        except socket.error:
+            pass
+        finally:
+            responses.put(n)
+
+
+class _ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+#
+# Main classes
+#
+
+class GenerationServer(object):
+    """Serves word and poem requests from one loaded model, see module docstring"""
+    def __init__(self, model_path, poem_workers=2, max_batch=MAX_BATCH, max_wait=MAX_WAIT,
+                 threads=THREADS, max_length=MAX_LENGTH, search='dfs', **search_args):
+        """
+        :param model_path: Saved model to serve
+        :param poem_workers: Processes searching for poems, 0 to refuse poem requests
+        :param max_batch: Most word requests generated together
+        :param max_wait: Seconds to wait for more word requests before generating
+        :param threads: Word and stats requests handled at once
+        :param max_length: Most tokens a word request can ask for
+        :param search: Poem line search strategy, see RandomPoem
+        :param search_args: Passed to the poem search strategy
+        """
+        self.metrics = Metrics()
+        self.model = RandomWords(metrics=self.metrics)
+        self.model.load(model_path)
+        # Batches are sampled from the array backed model, convert pickles once
+        if isinstance(self.model.prob_dict, ProbDict):
+            self.model.prob_dict = self.model.prob_dict.compact()
+            self.model.enable_metrics(self.metrics)
+        # Start from an unpredictable seed, make_words_batch won't reseed
+        self.model.seed = int(time.time() * 1000) ^ os.getpid()
+        self.model.random.seed(self.model.seed)
+
+        self.max_length = max_length
+        self.batcher = WordBatcher(self.model, max_batch, max_wait)
+        self.pool = ThreadPool(threads)
+        self.poem_pool = None
+        if poem_workers:
+            self.poem_pool = multiprocessing.Pool(poem_workers, _init_poem_worker,
+                                                  (model_path, search, search_args))
+        self._server = None
+
+    def handle(self, request):
+        """
+        Answers one request, waiting for it
+        :param request: Request dict, see module docstring
+        :rtype: dict
+        """
+        responses = Queue.Queue()
+        self.submit(request, responses.put)
+        return responses.get()
+
+    def submit(self, request, callback):
+        """
+        Answers one request without waiting for it.  Poems are handed to the
+        poem processes, everything else to the request threads.
+        :param request: Request dict, see module docstring
+        :param callback: Called with the response dict, from a pool thread,
+            so it shouldn't block
+        """
+        self.metrics.incr('requests')
+        if request.get('type') == 'poem' and self.poem_pool is not None:
+            self._submit_poem(request, callback)
+        else:
+            self.pool.apply_async(self._answer, (request, callback))
+
+    def _answer(self, request, callback):
+        """Answers a word or stats request, or any request with an error"""
+        response = dict(id=request.get('id'))
+        kind = request.get('type', 'words')
+        try:
+            if kind not in ('words', 'poem', 'stats'):
+                raise Exception("Unknown request type: %s" % kind)
+            with self.metrics.timer('request_%s' % kind):
+                if kind == 'words':
+                    lenn = int(request.get('length', 20))
+                    if not 0 < lenn <= self.max_length:
+                        raise Exception("length must be between 1 and %d, got %d" % (self.max_length, lenn))
+                    response['result'] = self.batcher.submit(lenn, request.get('init_token'), request.get('seed'))
+                elif kind == 'poem':
+                    raise Exception("Poem requests are disabled")
+                else:
+                    response['result'] = self.metrics.snapshot()
+        except Exception as e:
+            self.metrics.incr('request_errors')
+            response['error'] = str(e)
+        callback(response)
+
+    def _submit_poem(self, request, callback):
+        """Searches for a poem in the poem processes and calls callback with the response"""
+        response = dict(id=request.get('id'))
+        if 'scheme' not in request:
+            self.metrics.incr('request_errors')
+            response['error'] = "Poem requests need a scheme"
+            callback(response)
+            return
+        start = time.time()
+
+        def finish(outcome):
+            self.metrics.observe('request_poem', time.time() - start)
+            response['result'], error = outcome
+            if error is not None:
+                self.metrics.incr('request_errors')
+                del response['result']
+                response['error'] = error
+            callback(response)
+
+        self.poem_pool.apply_async(_run_poem, ((request['scheme'], request.get('seed')),), callback=finish)
+
+    def submit_line(self, line, callback):
+        """
+        Answers one JSON request line without waiting for it
+        :param callback: Called with the JSON response line, see submit
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            callback(self._dump(dict(id=None, error="Bad request: %s" % e)))
+            return
+        if not isinstance(request, dict):
+            callback(self._dump(dict(id=None, error="Bad request: expected an object")))
+            return
+        self.submit(request, lambda response: callback(self._dump(response)))
+
+    def handle_line(self, line):
+        """Answers one JSON request line with a JSON response line, waiting for it"""
+        responses = Queue.Queue()
+        self.submit_line(line, responses.put)
+        return responses.get()
+
+    @staticmethod
+    def _dump(response):
+        try:
+            return json.dumps(response) + '\n'
+        except UnicodeDecodeError:
+            # Tokens are bytes from the corpus, which needn't be utf-8
+            return json.dumps(response, encoding='latin-1') + '\n'
+
+    def serve(self, socket_path=None, host=None, port=None):
+        """
+        Listens on a Unix socket, or on host:port, until shutdown() is called
+        """
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = _ThreadingUnixServer(socket_path, _RequestHandler)
+        else:
+            self._server = _ThreadingTCPServer((host or 'localhost', port), _RequestHandler)
+        self._server.app = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    def shutdown(self):
+        """Stops serve() and the worker pools"""
+        if self._server is not None:
+            self._server.shutdown()
+        self.batcher.close()
+        self.pool.close()
+        if self.poem_pool is not None:
+            self.poem_pool.terminate()
+            self.poem_pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Random_Words generation server")
+    parser.add_argument('model', help="saved model to serve")
+    parser.add_argument('--socket', help="Unix socket to listen on")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, help="TCP port to listen on instead of a Unix socket")
+    parser.add_argument('--poem-workers', type=int, default=2)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-wait', type=float, default=MAX_WAIT)
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH)
+    parser.add_argument('--search', default='dfs')
+    parser.add_argument('--max-nodes', type=int, help="node budget per poem line")
+    args = parser.parse_args()
+    if not args.socket and not args.port:
+        parser.error("give --socket or --port")
+
+    server = GenerationServer(args.model, args.poem_workers, args.max_batch, args.max_wait,
+                              max_length=args.max_length, search=args.search, max_nodes=args.max_nodes)
+    try:
+        server.serve(args.socket, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
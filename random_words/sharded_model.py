@@ -0,0 +1,263 @@
+#!/usr/bin/env python2
+
+"""
+Sharded binary models for Random_Words.
+
+A sharded model is a small index file plus n_shards binary model files
+next to it.  Each token's successors live in the shard picked by a hash
+of the token, so sampling a successor only needs that one shard.  Shards
+are opened the first time a token in them is looked up and at most
+max_resident are kept open, least recently used first out, so memory
+follows the tokens actually being generated rather than the vocabulary.
+
+Layout:
+    path            header: magic, version, n_shards, n_starts, then for
+                    each start token its length, count and bytes
+    path.shard0000  binary_model file with the rows of shard 0
+    ...
+
+The start tokens are kept in the index so a start can be chosen without
+opening any shard.
+"""
+
+__author__ = 'eric'
+
+import random_words as rw
+import binary_model
+import utils
+from metrics import NULL_METRICS
+
+from collections import OrderedDict
+import os
+import random
+import struct
+import threading
+import zlib
+
+
+#
+# Globals
+#
+
+MAGIC = 'RWSHARDS'
+VERSION = 1
+PREFIX = struct.Struct('<8sI')
+HEADER = struct.Struct('<8sIIQ')
+START = struct.Struct('<IQ')
+# Shards kept open by default
+MAX_RESIDENT = 4
+
+
+#
+# Helpers
+#
+
+def shard_of(token, n_shards):
+    """Returns the shard holding token's successors, stable across processes"""
+    return (zlib.crc32(token) & 0xffffffff) % n_shards
+
+
+def shard_path(path, i):
+    return '%s.shard%04d' % (path, i)
+
+
+class _ShardView(object):
+    """
+    The part of a model save_model needs for one shard: the rows of the
+    tokens the shard owns, plus their successors as tokens with no rows
+    so ids can be assigned to them.
+    """
+    def __init__(self, prob_dict, owned):
+        self.prob_dict = prob_dict
+        self.owned = owned
+
+    def keys(self):
+        tokens = set(self.owned)
+        for t in self.owned:
+            tokens.update(self.prob_dict.successors(t))
+        return list(tokens)
+
+    def successors(self, token):
+        if token in self.owned:
+            return self.prob_dict.successors(token)
+        return {}
+
+
+#
+# Main classes
+#
+
+class ShardedProbDict(object):
+    """
+    Read-only model whose rows are spread over binary model shards,
+    opened on demand.  Same get/successors/keys API as ProbDict.
+    """
+    metrics = NULL_METRICS
+
+    def __init__(self, path, max_resident=MAX_RESIDENT):
+        """
+        :param path: Index file written by save_sharded
+        :param max_resident: Most shards kept open at once
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version = PREFIX.unpack_from(data)
+        if magic != MAGIC:
+            raise Exception("Not a sharded model file!\n %s" % path)
+        if version != VERSION:
+            raise Exception("Unsupported sharded model version %d!\n %s" % (version, path))
+        _, _, n_shards, n_starts = HEADER.unpack_from(data)
+        self.starts = rw.StartDist()
+        pos = HEADER.size
+        for _ in xrange(n_starts):
+            length, count = START.unpack_from(data, pos)
+            pos += START.size
+            self.starts.add(data[pos:pos + length], count)
+            pos += length
+        self.path = path
+        self.n_shards = n_shards
+        self.max_resident = max(1, max_resident)
+        # {int: MappedProbDict} in least recently used order
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self._keys = None
+
+    def __getstate__(self):
+        raise TypeError("ShardedProbDict can't be pickled, use compact() first")
+
+    def _shard(self, token):
+        """Returns the shard holding token's successors, opening it if needed"""
+        i = shard_of(token, self.n_shards)
+        with self._lock:
+            shard = self._resident.pop(i, None)
+            if shard is None:
+                shard = binary_model.load_model(shard_path(self.path, i))
+                shard.metrics = self.metrics
+                self.metrics.incr('shard_loads')
+            self._resident[i] = shard
+            if len(self._resident) > self.max_resident:
+                # Not closed explicitly, a thread may still be sampling from
+                # it.  The mapping is released once nothing refers to it.
+                self._resident.popitem(last=False)
+                self.metrics.incr('shard_evictions')
+        return shard
+
+    def resident_shards(self):
+        """Returns the ids of the shards currently open, least recently used first"""
+        with self._lock:
+            return list(self._resident)
+
+    def keys(self):
+        """
+        Returns every token.  The first call opens every shard in turn, the
+        list of tokens is then kept.
+        """
+        if self._keys is None:
+            tokens = set()
+            for i in xrange(self.n_shards):
+                tokens.update(binary_model.load_model(shard_path(self.path, i)).keys())
+            self._keys = list(tokens)
+        return self._keys
+
+    def values(self):
+        return [self.successors(t) for t in self.keys()]
+
+    def successors(self, token):
+        """
+        Returns the observed successors of the given token and their frequencies.
+        :rtype: {str: int}
+        """
+        return self._shard(token).successors(token)
+
+    def add(self, curr, nxt, count=1):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def add_sequence(self, tokens):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def add_counts(self, counts):
+        raise Exception("Model is read only: %s" % self.path)
+
+    def get_start(self, rng=random):
+        """
+        Retrieve a random start token, weighted by how often it started a line
+        :return: str, or None if no starts were recorded
+        """
+        return self.starts.sample(rng)
+
+    def get(self, token, rng=random):
+        """
+        Retrieve a random word following the given word,
+        weighted by the previously observed frequency
+        :param token: The current word
+        :param rng: Random stream to sample with, defaults to the random module
+        :return: str
+        """
+        return self._shard(token).get(token, rng)
+
+    def compact(self):
+        """Copies the whole model into memory as a CompactProbDict"""
+        compact = rw.CompactProbDict()
+        for token in self.keys():
+            for nxt, f in self.successors(token).iteritems():
+                compact.add(token, nxt, f)
+        compact.starts = rw.StartDist(self.starts.counts)
+        compact._freeze()
+        return compact
+
+    def close(self):
+        """Drops every open shard"""
+        with self._lock:
+            self._resident.clear()
+
+
+#
+# Main functions
+#
+
+def is_sharded_model(path):
+    """Returns True if the file at path starts with the sharded model magic"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_sharded(prob_dict, path, n_shards):
+    """
+    Writes a model as an index at path and n_shards binary model shards
+    :param prob_dict: Any model with keys() and successors()
+    :param n_shards: Number of shards to split the rows over
+    :return: None
+    """
+    if n_shards < 1:
+        raise Exception("Need at least one shard, got %d" % n_shards)
+    owned = [set() for _ in xrange(n_shards)]
+    for token in prob_dict.keys():
+        owned[shard_of(token, n_shards)].add(token)
+    # Shards and the index are each written to a temp file and renamed into
+    # place, so shards already open keep their old contents
+    for i in xrange(n_shards):
+        binary_model.save_model(_ShardView(prob_dict, owned[i]), shard_path(path, i))
+    # Only starts that can be sampled from
+    starts = getattr(prob_dict, 'starts', None)
+    starts = dict((t, c) for t, c in starts.counts.iteritems() if prob_dict.successors(t)) if starts else {}
+    # Index last, so a model is only visible once all its shards are written
+    with utils.atomic_write(path) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n_shards, len(starts)))
+        for token, count in starts.iteritems():
+            f.write(START.pack(len(token), count))
+            f.write(token)
+    # Shards left over from a model with more of them
+    i = n_shards
+    while os.path.exists(shard_path(path, i)):
+        os.remove(shard_path(path, i))
+        i += 1
+
+
+def load_sharded(path, max_resident=MAX_RESIDENT):
+    """
+    Opens a sharded model's index.  Shards are opened as they're needed.
+    :rtype: ShardedProbDict
+    """
+    if not os.path.exists(path) or not os.path.isfile(path):
+        raise Exception("Given file doesn't exist!\n %s" % path)
+    return ShardedProbDict(path, max_resident)
@@ -0,0 +1,113 @@
+"""
+Content addressed cache of tokenized corpus files.
+
+Entries are keyed by a hash of a file's bytes plus the options that
+affect tokenization, so a file is only tokenized again when its content
+or the options change, whatever its path.  Each entry stores the file's
+tokenized lines compactly: the distinct tokens once, and the lines as
+arrays of ids into them.
+"""
+
+__author__ = 'eric'
+
+
+import utils
+
+from array import array
+import hashlib
+import os
+import tempfile
+import cPickle as pickle
+
+
+#
+# Globals
+#
+
+# Bump when the entry layout or tokenization changes to orphan old entries
+CACHE_VERSION = 1
+# Bytes read at a time when hashing
+HASH_CHUNK = 1 << 20
+
+
+#
+# Main classes
+#
+
+class TokenCache(object):
+    """On disk cache of token lines, see module docstring"""
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: Directory to keep entries in, created if needed
+        """
+        self.cache_dir = cache_dir
+        utils.ensure_directories_exist(os.path.join(cache_dir, ''))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path, options):
+        """
+        Returns the cache key for a file
+        :param path: File to hash
+        :param options: Tokenization options, anything with a stable repr
+        :rtype: str
+        """
+        h = hashlib.sha1()
+        h.update(repr((CACHE_VERSION, options)))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), ''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.tok')
+
+    def get(self, key):
+        """
+        Returns the cached token lines for key, or None on a miss
+        :rtype: [[str]]|None
+        """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            self.misses += 1
+            return None
+        with open(path, 'rb') as f:
+            vocab, ids_bytes, lens_bytes = pickle.load(f)
+        ids = array('I')
+        ids.fromstring(ids_bytes)
+        lens = array('I')
+        lens.fromstring(lens_bytes)
+        lines = []
+        pos = 0
+        for n in lens:
+            lines.append([vocab[i] for i in ids[pos:pos + n]])
+            pos += n
+        self.hits += 1
+        return lines
+
+    def put(self, key, lines):
+        """
+        Stores token lines under key
+        :param lines: [[str]]
+        """
+        token2id = {}
+        vocab = []
+        ids = array('I')
+        lens = array('I')
+        for tokens in lines:
+            lens.append(len(tokens))
+            for t in tokens:
+                token_id = token2id.get(t)
+                if token_id is None:
+                    token_id = token2id[t] = len(vocab)
+                    vocab.append(t)
+                ids.append(token_id)
+
+        path = self._path(key)
+        utils.ensure_directories_exist(path)
+        # Write then rename so concurrent workers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((vocab, ids.tostring(), lens.tostring()), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
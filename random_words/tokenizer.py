@@ -1,13 +1,17 @@
 """
 Tokenizer class for project.  Generator class instantiated with a string
 that will then yield tokens one at a time.
+
+Tokenizer parses with spaCy, which is only loaded the first time it's
+needed.  RegexTokenizer is a pure regex stand in that applies the same
+merging and sentence markers without loading a parser.
 """
 
 from __future__ import unicode_literals
-import string
 import re
 import itertools
-from spacy.en import English
+import multiprocessing
+from collections import deque
 
 
 __author__ = 'eric'
@@ -21,8 +25,40 @@ RE_WHITESPACE = re.compile(r"(\s)+", re.UNICODE)
 RE_MULTINEWLINE = re.compile(r"([\n]+)", re.UNICODE)
 RE_MULTISPACE = re.compile(r"( )+", re.UNICODE)
 RE_NEWLINE = re.compile(r"(\n)", re.UNICODE)
-# Parser
-NLP = English()
+# Regex tokenizer patterns: newlines, words with an optional leading
+# apostrophe, or single punctuation characters
+RE_TOKEN = re.compile(r"\n|'?\w+|[^\w\s]", re.UNICODE)
+RE_SENTENCE_END = re.compile(r"^[.!?]+$", re.UNICODE)
+# Parser, loaded by get_nlp
+NLP = None
+
+
+#
+# Helpers
+#
+
+def get_nlp():
+    """Returns the spaCy English pipeline, loading it on first use"""
+    global NLP
+    if NLP is None:
+        from spacy.en import English
+        NLP = English()
+    return NLP
+
+
+class RegexDoc(object):
+    """Minimal stand in for a parsed spaCy doc: sentences of token strings"""
+    def __init__(self, doc):
+        self.sents = []
+        sentence = []
+        for m in RE_TOKEN.finditer(doc):
+            t = m.group(0)
+            sentence.append(t)
+            if RE_SENTENCE_END.match(t):
+                self.sents.append(sentence)
+                sentence = []
+        if sentence:
+            self.sents.append(sentence)
 
 
 # Tokenizer
@@ -69,17 +105,37 @@ class Tokenizer(object):
 
     @staticmethod
     def _tokenize(doc):
-        return NLP(doc)
+        return get_nlp()(doc)
 
     @staticmethod
     def _get_token_string(t):
-        if isinstance(t, unicode):
+        if isinstance(t, basestring):
             return t
         else:
             return t.orth_
 
+    @classmethod
+    def tokenize_batch(cls, docs, batch_size=64, replace_whitespace=True, merge_apostrophes=False):
+        """
+        Tokenizes many documents, parsing them batch_size at a time
+        :param docs: List of strings
+        :return: Generator of token lists, one per document
+        """
+        tokenizers = [cls(d, replace_whitespace, merge_apostrophes) for d in docs]
+        parsed = cls._parse_batch([t._preprocess(t.doc) for t in tokenizers], batch_size)
+        for t, p in itertools.izip(tokenizers, parsed):
+            yield list(t._merge(p))
+
+    @staticmethod
+    def _parse_batch(docs, batch_size):
+        return get_nlp().pipe(docs, batch_size=batch_size)
+
     def __iter__(self):
-        sentences = self._tokenize(self.doc).sents
+        return self._merge(self._tokenize(self._preprocess(self.doc)))
+
+    def _merge(self, parsed):
+        """Yields the tokens of a parsed doc with merging and sentence markers applied"""
+        sentences = parsed.sents
         prev_token = None
 
         for sentence in sentences:
@@ -107,3 +163,98 @@ class Tokenizer(object):
             # Yield the last token
             if prev_token:
                 yield prev_token
+
+
+class RegexTokenizer(Tokenizer):
+    """
+    Tokenizer that splits with regular expressions instead of spaCy.
+    Words, punctuation and newlines become tokens, sentences end at
+    runs of . ! or ?, and the hyphen/apostrophe merging and sentence
+    markers are the same as Tokenizer's.
+    """
+
+    @staticmethod
+    def _tokenize(doc):
+        return RegexDoc(doc)
+
+    @staticmethod
+    def _parse_batch(docs, batch_size):
+        return (RegexDoc(d) for d in docs)
+
+
+#
+# Main functions
+#
+
+TOKENIZERS = {
+    'spacy': Tokenizer,
+    'regex': RegexTokenizer,
+}
+
+
+def get_tokenizer(name):
+    """
+    Returns the Tokenizer class with the given name
+    :param name: One of the names in TOKENIZERS
+    """
+    if name not in TOKENIZERS:
+        raise Exception("Unknown tokenizer: %s" % name)
+    return TOKENIZERS[name]
+
+
+def _tokenize_chunk(args):
+    """
+    Tokenizes a chunk of documents in a worker process.  Module level
+    so it can be sent to a multiprocessing pool.
+    :param args: (tokenizer name, docs, batch_size, tokenizer kwargs)
+    :rtype: [[unicode]]
+    """
+    name, docs, batch_size, kwargs = args
+    return list(get_tokenizer(name).tokenize_batch(docs, batch_size, **kwargs))
+
+
+def _chunks(iterable, size):
+    """Yields lists of up to size items from iterable"""
+    it = iter(iterable)
+    chunk = list(itertools.islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(it, size))
+
+
+def tokenize_parallel(docs, name='spacy', n_process=1, batch_size=64, chunk_size=256, **kwargs):
+    """
+    Tokenizes a stream of documents across worker processes.
+
+    Documents are grouped into chunks of chunk_size and each worker parses
+    its chunk batch_size documents at a time, loading its own parser once.
+    At most two chunks per worker are in flight, so memory stays bounded
+    however long docs is, and results come back in the order of docs.
+    :param docs: Iterable of strings
+    :param name: Tokenizer backend, see TOKENIZERS
+    :param n_process: Number of worker processes, 1 to tokenize in this process
+    :param kwargs: Passed to the tokenizer, e.g. replace_whitespace
+    :return: Generator of token lists, one per document
+    """
+    cls = get_tokenizer(name)
+    chunks = _chunks(docs, chunk_size)
+    if n_process <= 1:
+        for chunk in chunks:
+            for tokens in cls.tokenize_batch(chunk, batch_size, **kwargs):
+                yield tokens
+        return
+
+    pool = multiprocessing.Pool(n_process)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_tokenize_chunk, ((name, chunk, batch_size, kwargs),)))
+            if len(pending) >= 2 * n_process:
+                for tokens in pending.popleft().get():
+                    yield tokens
+        while pending:
+            for tokens in pending.popleft().get():
+                yield tokens
+    finally:
+        pool.terminate()
+        pool.join()
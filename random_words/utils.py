@@ -6,7 +6,9 @@ Uitilities file for Random_Words  project
 __author__ = 'Eric'
 
 
+from contextlib import contextmanager
 import os
+import tempfile
 
 
 def ensure_directories_exist(path):
@@ -21,3 +23,22 @@ def ensure_directories_exist(path):
     if directory:
         if not os.path.exists(directory):
             os.makedirs(directory)
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Opens a temporary file next to path for writing, and renames it over
+    path once the block finishes.  Readers only ever see a whole file, and
+    any that have the old one open or memory mapped keep reading it.
+    :param path: str - File to write
+    """
+    ensure_directories_exist(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
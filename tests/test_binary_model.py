@@ -0,0 +1,123 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the binary model format.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+
+import random_words.random_words as rw
+import random_words.binary_model as bm
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+PICKLED_MODEL = 'kanye_1_NewLines-F_Uniq-F.model'
+
+
+#
+# Tests
+#
+
+class TestBinaryModel(object):
+    def __init__(self):
+        self.tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rw = rw.RandomWords(corpus_dir=DATA_DIR)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        bm.save_model(self.rw.prob_dict, path)
+        nosey.assert_true(bm.is_binary_model(path))
+        mapped = bm.load_model(path)
+        nosey.assert_is_instance(mapped, bm.MappedProbDict)
+        nosey.assert_items_equal(self.rw.prob_dict.keys(), mapped.keys())
+        for t in self.rw.prob_dict.keys():
+            nosey.assert_dict_equal(dict(self.rw.prob_dict.map[t]), mapped.successors(t))
+        nosey.assert_in(mapped.get('I'), self.rw.prob_dict.map['I'])
+        nosey.assert_equal("<UNK>", mapped.get('not a token'))
+        # Only start tokens with successors are saved
+        starts = self.rw.prob_dict.starts.counts
+        nosey.assert_dict_equal(dict((t, c) for t, c in starts.iteritems() if self.rw.prob_dict.map.get(t)),
+                                mapped.starts.counts)
+        nosey.assert_in(mapped.get_start(), mapped.starts.counts)
+        mapped.close()
+
+    def test_mapped_is_read_only(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        bm.save_model(self.rw.prob_dict, path)
+        mapped = bm.load_model(path)
+        nosey.assert_raises(Exception, mapped.add, 'I', 'am')
+        # Copying to memory lets it grow again
+        compact = mapped.to_compact()
+        compact.add('I', 'am')
+        nosey.assert_equal(self.rw.prob_dict.map['I']['am'] + 1, compact.successors('I')['am'])
+        mapped.close()
+
+    def test_rw_save_load(self):
+        path = os.path.join(self.tmp_dir, 'models', 'kanye.model')
+        self.rw.save(path)
+        rw2 = rw.RandomWords()
+        rw2.load(path)
+        nosey.assert_is_instance(rw2.prob_dict, bm.MappedProbDict)
+        nosey.assert_equal(25, len(rw2.make_words(25).split()))
+        rw2.prob_dict.close()
+
+    def test_rw_add_after_load(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        self.rw.save(path)
+        rw2 = rw.RandomWords()
+        rw2.load(path)
+        rw2.add_to_model(["I am a god"])
+        rw2.add_tokens(['I', 'am'])
+        nosey.assert_is_instance(rw2.prob_dict, rw.CompactProbDict)
+        nosey.assert_not_is_instance(rw2.prob_dict, bm.MappedProbDict)
+        nosey.assert_equal(self.rw.prob_dict.map['I']['am'] + 2, rw2.prob_dict.successors('I')['am'])
+
+    def test_save_over_mapped(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        self.rw.save(path)
+        mapped = rw.RandomWords()
+        mapped.load(path)
+        # A smaller model over the mapped file doesn't pull it from under the reader
+        rw.RandomWords(corpus_dir=[["I am a god"]]).save(path)
+        nosey.assert_equal(25, len(mapped.make_words(25).split()))
+        nosey.assert_items_equal(self.rw.prob_dict.keys(), mapped.prob_dict.keys())
+        reloaded = rw.RandomWords()
+        reloaded.load(path)
+        nosey.assert_items_equal(['I', 'am', 'a', 'god'], reloaded.prob_dict.keys())
+        nosey.assert_equal(['kanye.model'], os.listdir(self.tmp_dir))
+
+    def test_rw_load_pickle(self):
+        rw2 = rw.RandomWords()
+        rw2.load(PICKLED_MODEL)
+        nosey.assert_is_instance(rw2.prob_dict, rw.ProbDict)
+        nosey.assert_equal(25, len(rw2.make_words(25).split()))
+
+    def test_convert_model(self):
+        path = os.path.join(self.tmp_dir, 'converted.model')
+        bm.convert_model(PICKLED_MODEL, path)
+        original = pickle.load(open(PICKLED_MODEL, 'rb'))
+        mapped = bm.load_model(path)
+        nosey.assert_items_equal(original.keys(), mapped.keys())
+        for t in original.keys():
+            nosey.assert_dict_equal(dict(original.map[t]), mapped.successors(t))
+        mapped.close()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+
+"""
+Tests for duplicate line detection.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+
+import random_words.random_words as rw
+import random_words.dedupe as dd
+from random_words.metrics import Metrics
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+DOC = "I am a god\nI am a god\nSo hurry up with my damn croissants\n"
+
+
+#
+# Tests
+#
+
+class TestDedupe(object):
+    def test_fingerprint(self):
+        nosey.assert_equal(dd.fingerprint(['I', ' ', 'am']), dd.fingerprint(['I', ' ', 'am']))
+        nosey.assert_not_equal(dd.fingerprint(['I', ' ', 'am']), dd.fingerprint(['I', ' ', 'was']))
+        # A last line missing its newline matches the same line elsewhere
+        nosey.assert_equal(dd.fingerprint(['god', '\n']), dd.fingerprint(['god']))
+
+    def test_seen_lines(self):
+        seen = dd.SeenLines()
+        nosey.assert_true(seen.add(1))
+        nosey.assert_false(seen.add(1))
+        nosey.assert_true(seen.add(2))
+        nosey.assert_equal(2, len(seen))
+
+    def test_bloom_lines(self):
+        bloom = dd.BloomLines(2000)
+        fps = [dd.fingerprint(['line', str(i)]) for i in range(2000)]
+        nosey.assert_true(all(bloom.add(fp) for fp in fps[:1000]))
+        # No false negatives
+        nosey.assert_false(any(bloom.add(fp) for fp in fps[:1000]))
+        false_positives = sum(not bloom.add(fp) for fp in fps[1000:])
+        nosey.assert_less(false_positives, 10)
+
+    def test_across_calls(self):
+        model = rw.RandomWords(uniq_lines=True)
+        model.add_to_model([DOC])
+        counts = dict(model.prob_dict.map['god'])
+        nosey.assert_equal(1, sum(counts.values()))
+        model.add_to_model([DOC, DOC])
+        nosey.assert_equal(counts, dict(model.prob_dict.map['god']))
+
+    def test_across_files(self):
+        metrics = Metrics()
+        model = rw.RandomWords(corpus_dir=[DOC, DOC.upper(), DOC], uniq_lines=True, metrics=metrics)
+        # One repeat in each copy, plus all of the third copy
+        nosey.assert_equal(5, metrics.snapshot()['counters']['duplicate_lines'])
+        # Lines kept: two from each of the first two copies
+        nosey.assert_equal(4, sum(model.prob_dict.starts.counts.values()))
+
+    def test_bloom_matches_exact(self):
+        exact = rw.RandomWords(corpus_dir=DATA_DIR, uniq_lines=True)
+        bloom = rw.RandomWords(corpus_dir=DATA_DIR, uniq_lines=True, uniq_capacity=10000)
+        nosey.assert_is_instance(bloom.seen_lines, dd.BloomLines)
+        nosey.assert_equal(len(exact.seen_lines), len(bloom.seen_lines))
+        nosey.assert_dict_equal(exact.prob_dict.map, bloom.prob_dict.map)
+
+    def test_saved_with_model(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'kanye.model')
+            for uniq_capacity in (None, 1000):
+                model = rw.RandomWords(corpus_dir=[DOC], uniq_lines=True, uniq_capacity=uniq_capacity)
+                model.save(path)
+                loaded = rw.RandomWords(uniq_lines=True)
+                loaded.load(path)
+                nosey.assert_is_instance(loaded.seen_lines, type(model.seen_lines))
+                nosey.assert_equal(len(model.seen_lines), len(loaded.seen_lines))
+                # Lines from before the reload are still repeats
+                loaded.add_to_model([DOC])
+                nosey.assert_equal(dict(model.prob_dict.successors('god')), dict(loaded.prob_dict.successors('god')))
+                # And so are lines checkpointed since
+                loaded.add_to_model(["Feeling like Pac\n"])
+                loaded.checkpoint()
+                reloaded = rw.RandomWords(uniq_lines=True)
+                reloaded.load(path)
+                reloaded.add_to_model(["Feeling like Pac\n"])
+                nosey.assert_equal(1, reloaded.prob_dict.successors('Feeling')['like'])
+            # A model saved without uniq_lines leaves none behind
+            rw.RandomWords(corpus_dir=[DOC]).save(path)
+            nosey.assert_false(os.path.exists(path + rw.SEEN_EXT))
+        finally:
+            shutil.rmtree(tmp_dir)
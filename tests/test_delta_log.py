@@ -0,0 +1,189 @@
+#!/usr/bin/env python2
+
+"""
+Tests for delta logs.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+
+import random_words.random_words as rw
+import random_words.delta_log as dl
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Helpers
+#
+
+def read_docs():
+    return [open(os.path.join(DATA_DIR, f)).read() for f in sorted(os.listdir(DATA_DIR))]
+
+
+def assert_same_model(expected, actual):
+    nosey.assert_items_equal(expected.keys(), actual.keys())
+    for t in expected.keys():
+        nosey.assert_dict_equal(dict(expected.successors(t)), dict(actual.successors(t)))
+    # Binary models only keep starts that can be sampled from
+    starts = lambda model: dict((t, c) for t, c in model.starts.counts.iteritems() if model.successors(t))
+    nosey.assert_dict_equal(starts(expected), starts(actual))
+
+
+#
+# Tests
+#
+
+class TestDeltaLog(object):
+    def __init__(self):
+        self.tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.docs = read_docs()
+        cls.full = rw.RandomWords(corpus_dir=cls.docs)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def grow(self, path, **save_args):
+        """Saves a model of most of the docs, then checkpoints the rest one at a time"""
+        model = rw.RandomWords(corpus_dir=self.docs[:7])
+        model.save(path, **save_args)
+        for doc in self.docs[7:]:
+            model.add_to_model([doc])
+            model.checkpoint()
+        return model
+
+    def expected(self, path):
+        """Returns the base at path with the checkpointed docs added directly"""
+        model = rw.RandomWords()
+        model.load(path, replay=False)
+        model.prob_dict = dl.writable(model.prob_dict)
+        model.add_to_model(self.docs[7:])
+        return model.prob_dict
+
+    def test_replay(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        model = self.grow(path, binary=False)
+        nosey.assert_true(os.path.exists(dl.log_path(path)))
+        nosey.assert_less(os.path.getsize(dl.log_path(path)), os.path.getsize(path))
+        loaded = rw.RandomWords()
+        loaded.load(path)
+        assert_same_model(self.full.prob_dict, loaded.prob_dict)
+        assert_same_model(model.prob_dict, loaded.prob_dict)
+        # Without replaying only the base is loaded
+        base = rw.RandomWords()
+        base.load(path, replay=False)
+        nosey.assert_less(len(base.prob_dict.keys()), len(loaded.prob_dict.keys()))
+
+    def test_read_only_bases(self):
+        for save_args in (dict(binary=True), dict(shards=3)):
+            path = os.path.join(self.tmp_dir, 'kanye.model')
+            self.grow(path, **save_args)
+            loaded = rw.RandomWords()
+            loaded.load(path)
+            nosey.assert_is_instance(loaded.prob_dict, rw.CompactProbDict)
+            assert_same_model(self.expected(path), loaded.prob_dict)
+            # Checkpoints keep appending after a replay
+            loaded.add_to_model(self.docs[:1])
+            loaded.checkpoint()
+            reloaded = rw.RandomWords()
+            reloaded.load(path)
+            assert_same_model(loaded.prob_dict, reloaded.prob_dict)
+
+    def test_checkpoint_without_log(self):
+        for save_args in (dict(binary=True), dict(shards=3)):
+            path = os.path.join(self.tmp_dir, 'kanye.model')
+            rw.RandomWords(corpus_dir=self.docs[:7]).save(path, **save_args)
+            # A later run loads the base, which has no log yet, and grows it
+            model = rw.RandomWords()
+            model.load(path)
+            model.add_to_model(self.docs[7:])
+            model.checkpoint()
+            nosey.assert_true(os.path.exists(dl.log_path(path)))
+            loaded = rw.RandomWords()
+            loaded.load(path)
+            assert_same_model(self.expected(path), loaded.prob_dict)
+            # And after compacting, it keeps growing
+            loaded.compact_deltas()
+            compacted = rw.RandomWords()
+            compacted.load(path)
+            compacted.add_to_model(self.docs[:1])
+            compacted.checkpoint()
+            reloaded = rw.RandomWords()
+            reloaded.load(path)
+            assert_same_model(compacted.prob_dict, reloaded.prob_dict)
+
+    def test_compact_deltas(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        self.grow(path, shards=3)
+        expected = self.expected(path)
+        loaded = rw.RandomWords()
+        loaded.load(path)
+        loaded.compact_deltas()
+        nosey.assert_false(os.path.exists(dl.log_path(path)))
+        nosey.assert_equal(dict(shards=3), dl.snapshot_format(path))
+        compacted = rw.RandomWords()
+        compacted.load(path)
+        assert_same_model(expected, compacted.prob_dict.compact())
+
+    def test_compact_unreplayed(self):
+        for save_args in (dict(binary=False), dict(binary=True), dict(shards=3)):
+            path = os.path.join(self.tmp_dir, 'kanye.model')
+            first = rw.RandomWords(corpus_dir=[["x y z"]])
+            first.save(path, **save_args)
+            first.add_to_model([["x q r"]])
+            first.checkpoint()
+            # A second writer that didn't replay the first one's checkpoint
+            second = rw.RandomWords()
+            second.load(path, replay=False)
+            second.add_to_model([["x w v"]])
+            second.checkpoint()
+            second.compact_deltas()
+            nosey.assert_false(os.path.exists(dl.log_path(path)))
+            compacted = rw.RandomWords()
+            compacted.load(path)
+            nosey.assert_dict_equal({'q': 1, 'w': 1, 'y': 1}, dict(compacted.prob_dict.successors('x')))
+            nosey.assert_dict_equal(dict(compacted.prob_dict.successors('x')), dict(second.prob_dict.successors('x')))
+
+    def test_torn_record(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        model = self.grow(path, binary=False)
+        with open(dl.log_path(path), 'ab') as f:
+            f.write('\x10\x00\x00')
+        loaded = rw.RandomWords()
+        loaded.load(path)
+        assert_same_model(model.prob_dict, loaded.prob_dict)
+        # The next checkpoint writes over the partial record
+        loaded.add_to_model(self.docs[:1])
+        loaded.checkpoint()
+        reloaded = rw.RandomWords()
+        reloaded.load(path)
+        assert_same_model(loaded.prob_dict, reloaded.prob_dict)
+
+    def test_errors(self):
+        nosey.assert_raises(Exception, rw.RandomWords().checkpoint)
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        self.grow(path, binary=False)
+        # A log left behind by a rewritten base isn't replayed on top of it
+        with open(path, 'ab') as f:
+            f.write('\n')
+        nosey.assert_raises(Exception, rw.RandomWords().load, path)
+        # Saving drops the log
+        model = rw.RandomWords(corpus_dir=self.docs)
+        model.save(path, binary=False)
+        nosey.assert_false(os.path.exists(dl.log_path(path)))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the metrics hooks.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import cPickle as pickle
+
+import random_words.random_words as rw
+from random_words.metrics import Metrics, NULL_METRICS
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Tests
+#
+
+class TestMetrics(object):
+    def test_counters_and_histograms(self):
+        m = Metrics()
+        m.incr('a')
+        m.incr('a', 2)
+        with m.timer('t'):
+            pass
+        m.observe('t', 100.0)
+        snap = m.snapshot()
+        nosey.assert_equal(3, snap['counters']['a'])
+        hist = snap['histograms']['t']
+        nosey.assert_equal(2, hist['count'])
+        nosey.assert_equal(100.0, hist['max'])
+        nosey.assert_equal(1, hist['buckets']['inf'])
+        m.reset()
+        nosey.assert_equal({}, m.snapshot()['counters'])
+
+    def test_disabled_records_nothing(self):
+        model = rw.RandomWords(corpus_dir=DATA_DIR)
+        nosey.assert_is(NULL_METRICS, model.metrics)
+        nosey.assert_is(NULL_METRICS, model.prob_dict.metrics)
+        model.make_words(10)
+        nosey.assert_equal({}, model.metrics.snapshot()['counters'])
+
+    def test_model_counters(self):
+        m = Metrics()
+        model = rw.RandomWords(corpus_dir=DATA_DIR, metrics=m)
+        counters = m.snapshot()['counters']
+        nosey.assert_greater(counters['tokens_ingested'], 0)
+        nosey.assert_equal(len(list(rw.FileGen(DATA_DIR))), counters['documents'])
+
+        model.make_words(25)
+        model.prob_dict.get('not a token')
+        model.prob_dict.add('', 'x')
+        snap = m.snapshot()
+        nosey.assert_equal(25, snap['counters']['tokens_generated'])
+        nosey.assert_equal(26, snap['counters']['sampling_calls'])
+        nosey.assert_greater_equal(snap['counters']['unknown_tokens'], 1)
+        nosey.assert_equal(1, snap['counters']['bad_tokens'])
+        nosey.assert_equal(1, snap['histograms']['make_words']['count'])
+
+    def test_enable_and_pickle(self):
+        model = rw.RandomWords(corpus_dir=DATA_DIR, compact=True)
+        m = model.enable_metrics()
+        model.make_words(5)
+        nosey.assert_equal(5, m.snapshot()['counters']['sampling_calls'])
+        # Metrics aren't part of the saved model
+        copy = pickle.loads(pickle.dumps(model.prob_dict))
+        nosey.assert_is(NULL_METRICS, copy.metrics)
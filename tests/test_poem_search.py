@@ -0,0 +1,155 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the poem line search strategies.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+
+import random_words.poem_search as ps
+
+
+#
+# Globals
+#
+
+# Words that can follow each word
+GRAPH = {
+    'a': ['b', 'c', 'a'],
+    'b': ['c', 'a'],
+    'c': ['a', 'b', 'c'],
+}
+FIRST_WORDS = ['a', 'b', 'c']
+
+
+#
+# Helpers
+#
+
+class FakeLine(object):
+    """
+    Stands in for random_poem.Line: valid when it spells target, over when
+    it's longer than target, scored by how far it is from target
+    """
+    def __init__(self, target, tokens=(), log=None):
+        self.target = tuple(target)
+        self.tokens = tuple(tokens)
+        # Every line made, in order, shared by the whole search
+        self.log = log if log is not None else []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, key):
+        return self.tokens[key]
+
+    def __repr__(self):
+        return ''.join(self.tokens)
+
+    def add(self, word):
+        line = FakeLine(self.target, self.tokens + (word,), self.log)
+        self.log.append(line)
+        return line
+
+    def score(self):
+        misses = sum(1 for t, g in zip(self.tokens, self.target) if t != g)
+        return misses + abs(len(self.target) - len(self.tokens))
+
+    def better(self, l):
+        return not l or self.score() < l.score()
+
+    def valid(self):
+        return self.tokens == self.target
+
+    def over(self):
+        return len(self.tokens) > len(self.target)
+
+
+def make_queue(word, line):
+    return GRAPH[word]
+
+
+def recursive_search(queue, line):
+    """The search RandomPoem used before poem_search, for comparison"""
+    for word in queue:
+        l = line.add(word)
+        if l.valid():
+            return l
+        if l.over():
+            continue
+        new_l = recursive_search(make_queue(word, l), l)
+        if new_l:
+            return new_l
+    return None
+
+
+def search(strategy, target):
+    line = FakeLine(target)
+    return strategy.search(FIRST_WORDS, line, make_queue), line.log
+
+
+#
+# Tests
+#
+
+class TestPoemSearch(object):
+    def test_dfs_matches_recursive(self):
+        # One reachable target, and one that makes both search everything
+        for target in ('cab', 'bb'):
+            expected = FakeLine(target)
+            expected_line = recursive_search(FIRST_WORDS, expected)
+            result, log = search(ps.DepthFirstSearch(), target)
+            nosey.assert_equal(map(repr, expected.log), map(repr, log))
+            nosey.assert_equal(repr(expected_line), repr(result.line))
+            nosey.assert_equal(len(log), result.nodes)
+            nosey.assert_false(result.exhausted)
+
+    def test_max_nodes(self):
+        for strategy in (ps.DepthFirstSearch(max_nodes=5), ps.BeamSearch(max_nodes=5),
+                         ps.BestFirstSearch(max_nodes=5)):
+            result, log = search(strategy, 'bb')
+            nosey.assert_is_none(result.line)
+            nosey.assert_true(result.exhausted)
+            nosey.assert_equal(5, result.nodes)
+            nosey.assert_equal(5, len(log))
+
+    def test_timeout(self):
+        for name in ps.STRATEGIES:
+            result, log = search(ps.get_search(name, timeout=0), 'bb')
+            nosey.assert_is_none(result.line)
+            nosey.assert_true(result.exhausted)
+            nosey.assert_equal(1, result.nodes)
+
+    def test_finds_line(self):
+        for name in ps.STRATEGIES:
+            result, _ = search(ps.get_search(name, max_nodes=1000), 'cab')
+            nosey.assert_equal(('c', 'a', 'b'), result.line.tokens)
+            nosey.assert_false(result.exhausted)
+
+    def test_beam_width(self):
+        result, log = search(ps.BeamSearch(beam_width=2), 'bb')
+        nosey.assert_is_none(result.line)
+        # Only beam_width lines of each length get extended
+        for length in range(1, 4):
+            parents = set(l.tokens[:-1] for l in log if len(l) == length + 1)
+            nosey.assert_less_equal(len(parents), 2)
+        nosey.assert_true(any(len(l) == 3 for l in log))
+
+    def test_best_is_tracked(self):
+        for name in ps.STRATEGIES:
+            result, log = search(ps.get_search(name, max_nodes=7), 'bb')
+            nosey.assert_equal(min(l.score() for l in log), result.best.score())
+            # Ties go to the line seen first
+            nosey.assert_is(next(l for l in log if l.score() == result.best.score()), result.best)
+
+    def test_get_search(self):
+        dfs = ps.DepthFirstSearch()
+        nosey.assert_is(dfs, ps.get_search(dfs))
+        beam = ps.get_search('beam', beam_width=3, max_nodes=10)
+        nosey.assert_is_instance(beam, ps.BeamSearch)
+        nosey.assert_equal(3, beam.beam_width)
+        nosey.assert_equal(10, beam.max_nodes)
+        nosey.assert_raises(Exception, ps.get_search, 'astar')
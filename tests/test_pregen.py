@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the pre-generation buffer.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+
+import random_words.random_words as rw
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Tests
+#
+
+class TestPregenBuffer(object):
+    @classmethod
+    def setUpClass(cls):
+        cls.rw = rw.RandomWords(corpus_dir=DATA_DIR)
+
+    def test_hits_and_misses(self):
+        buf = self.rw.pregenerate([10, (5, 'I')], capacity=8, seed=1)
+        buf.fill()
+        nosey.assert_equal(dict(hits=0, misses=0, buffered={'10:': 8, '5:I': 8}), buf.stats())
+        nosey.assert_equal(10, len(buf.get(10).split()))
+        nosey.assert_equal(5, len(buf.get(5, 'I').split()))
+        # Not a bucket, generated on the spot
+        nosey.assert_equal(7, len(buf.get(7).split()))
+        stats = buf.stats()
+        nosey.assert_equal(2, stats['hits'])
+        nosey.assert_equal(1, stats['misses'])
+        buf.close()
+
+    def test_refills(self):
+        buf = self.rw.pregenerate([10], capacity=8, low_watermark=4, seed=1)
+        buf.fill()
+        results = [buf.get(10) for _ in range(20)]
+        nosey.assert_true(all(len(r.split()) == 10 for r in results))
+        buf.fill()
+        nosey.assert_equal(8, buf.stats()['buffered']['10:'])
+        stats = buf.stats()
+        nosey.assert_equal(20, stats['hits'] + stats['misses'])
+        buf.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+
+"""
+Tests for model pruning and quantization.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+
+import random_words.random_words as rw
+import random_words.pruning as pr
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Tests
+#
+
+class TestPruning(object):
+    @classmethod
+    def setUpClass(cls):
+        cls.rw = rw.RandomWords(corpus_dir=DATA_DIR)
+
+    def test_no_options_keeps_everything(self):
+        pruned = pr.prune(self.rw.prob_dict)
+        nosey.assert_is_instance(pruned, rw.CompactProbDict)
+        for t in self.rw.prob_dict.keys():
+            nosey.assert_dict_equal(dict(self.rw.prob_dict.successors(t)), pruned.successors(t))
+        nosey.assert_equal(0.0, pr.distribution_change(self.rw.prob_dict, pruned))
+
+    def test_min_count_and_top_k(self):
+        pruned = pr.prune(self.rw.prob_dict, min_count=2, top_k=3)
+        for t in self.rw.prob_dict.keys():
+            before = self.rw.prob_dict.successors(t)
+            after = pruned.successors(t)
+            if not before:
+                continue
+            # The most frequent successor always survives
+            nosey.assert_true(1 <= len(after) <= 3)
+            nosey.assert_in(max(after.itervalues()), before.values())
+            nosey.assert_true(all(f >= 2 for f in sorted(after.values(), reverse=True)[1:]))
+
+    def test_max_vocab(self):
+        pruned = pr.prune(self.rw.prob_dict, max_vocab=100)
+        nosey.assert_less_equal(len(pruned.keys()), 100)
+        freqs = pr.token_frequencies(self.rw.prob_dict)
+        top = max(freqs, key=freqs.get)
+        nosey.assert_in(top, pruned.keys())
+
+    def test_count_bits(self):
+        row = [(1000, 'a'), (10, 'b'), (1, 'c')]
+        quantized = pr.quantize_row(row, 255)
+        nosey.assert_less_equal(sum(f for f, _ in quantized), 255)
+        nosey.assert_equal(['a', 'b', 'c'], [t for _, t in quantized])
+        nosey.assert_true(all(f >= 1 for f, _ in quantized))
+        pruned = pr.prune(self.rw.prob_dict, count_bits=8)
+        nosey.assert_equal('B', pruned.cum_counts.typecode)
+
+    def test_rw_prune(self):
+        model = rw.RandomWords(corpus_dir=DATA_DIR)
+        report = model.prune(min_count=2)
+        nosey.assert_is_instance(model.prob_dict, rw.CompactProbDict)
+        nosey.assert_less(report['after']['transitions'], report['before']['transitions'])
+        nosey.assert_less(report['after']['memory_bytes'], report['before']['memory_bytes'])
+        nosey.assert_true(0 < report['distribution_change'] < 1)
+        nosey.assert_equal(25, len(model.make_words(25).split()))
+
+    def test_prune_saved(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'kanye.model')
+            for save_args in (dict(binary=True), dict(shards=3)):
+                self.rw.save(path, **save_args)
+                model = rw.RandomWords()
+                model.load(path)
+                report = model.prune(min_count=2)
+                nosey.assert_is_instance(model.prob_dict, rw.CompactProbDict)
+                nosey.assert_less(report['after']['transitions'], report['before']['transitions'])
+                nosey.assert_greater(report['before']['memory_bytes'], 0)
+                nosey.assert_is_none(report['before']['pickle_bytes'])
+                nosey.assert_equal(0.0, pr.distribution_change(pr.prune(self.rw.prob_dict, min_count=2),
+                                                               model.prob_dict))
+                # Saving the pruned model over its source works too
+                model.save(path, **save_args)
+        finally:
+            shutil.rmtree(tmp_dir)
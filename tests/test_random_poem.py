@@ -0,0 +1,317 @@
+#!/usr/bin/env python2
+
+"""
+Tests for Random_Poem.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import types
+from collections import Counter
+
+try:
+    import fuzzy
+except ImportError:
+    # random_poem makes its metaphone encoder on import.  These tests
+    # inject their phonetic keys, so a stand-in module will do.
+    fuzzy = types.ModuleType('fuzzy')
+    fuzzy.DMetaphone = lambda: lambda token: [None, None]
+    sys.modules['fuzzy'] = fuzzy
+
+import random_words.random_words as rw
+import random_words.delta_log as dl
+import random_words.random_poem as rp
+
+
+#
+# Globals
+#
+
+COUNTS = {'a': 1, 'b': 3, 'c': 6}
+# (s_goal, r_goal, tolerance, tokens, score, valid, over) as the original,
+# list backed Line scored them, with TestLine's phonetic keys
+OLD_LINE_SCORES = [
+    (3, 'cat', 1, ['cat'], 2, False, False),
+    (3, 'cat', 1, ['the', 'cat'], 1, True, False),
+    (3, 'cat', 1, ['the', 'the', 'cat'], 0, True, False),
+    (3, 'cat', 1, ['the', 'dog', 'hat'], 1, True, False),
+    (3, 'cat', 1, ['the', 'the', 'dog'], 2, False, False),
+    (3, 'cat', 1, ['the', 'hat', 'the'], 1, True, False),
+    (3, 'cat', 1, ['the', 'the', 'the', 'the'], 2, True, False),
+    (3, 'cat', 1, ['the', 'the', 'the', 'the', 'cat'], 2, False, True),
+    (2, None, 2, ['dog'], 1, True, False),
+    (2, None, 2, ['the', 'dog', 'hat', 'cat'], 2, True, False),
+    (2, None, 2, ['the', 'the', 'the', 'the', 'the'], 3, False, True),
+    (4, 'dog', 0, ['the', 'the', 'the', 'dog'], 0, True, False),
+    (4, 'dog', 0, ['the', 'the', 'the', 'cat'], 2, False, False),
+    (4, 'dog', 0, ['the', 'the', 'dog'], 1, False, False),
+    (4, 'dog', 0, ['cat', 'cat', 'cat', 'cat', 'hat'], 3, False, True),
+]
+
+
+#
+# Helpers
+#
+
+def draw_probability(order, counts):
+    """Chance of drawing words in order from counts without replacement"""
+    p = 1.0
+    left = dict(counts)
+    for t in order:
+        p *= left[t] / float(sum(left.values()))
+        del left[t]
+    return p
+
+
+#
+# Tests
+#
+
+class TestWordQueue(object):
+    def __init__(self):
+        self.prob_dict = None
+
+    def setUp(self):
+        self.prob_dict = rw.ProbDict()
+        for t, f in COUNTS.iteritems():
+            self.prob_dict.add('I', t, f)
+
+    def test_permutation_frequencies(self):
+        rng = random.Random(0)
+        n = 20000
+        orders = Counter(tuple(rp.WordQueue('I', self.prob_dict, rng)) for _ in xrange(n))
+        nosey.assert_equal(6, len(orders))
+        for order in itertools.permutations(COUNTS):
+            nosey.assert_almost_equal(draw_probability(order, COUNTS), orders[order] / float(n), delta=0.015)
+
+    def test_only_exclude(self):
+        rng = random.Random(0)
+        nosey.assert_items_equal(['a', 'c'], rp.WordQueue('I', self.prob_dict, rng, only={'a', 'c', 'd'}))
+        nosey.assert_items_equal(['a', 'b'], rp.WordQueue('I', self.prob_dict, rng, exclude={'c'}))
+        nosey.assert_items_equal(['a'], rp.WordQueue('I', self.prob_dict, rng, only={'a', 'c'}, exclude={'c'}))
+        nosey.assert_items_equal([], rp.WordQueue('nobody', self.prob_dict, rng))
+
+    def test_model_not_mutated(self):
+        queue = rp.WordQueue('I', self.prob_dict, random.Random(0), exclude={'b'})
+        nosey.assert_is(self.prob_dict.map['I'], queue.map)
+        list(queue)
+        list(queue)
+        nosey.assert_dict_equal(COUNTS, self.prob_dict.map['I'])
+
+
+class TestLine(object):
+    def __init__(self):
+        self.phonetics = None
+
+    def setUp(self):
+        # Reversed metaphone keys, as PhoneticKeys.encode would give them
+        self.phonetics = rp.PhoneticKeys()
+        self.phonetics.keys = {'cat': 'TK', 'hat': 'TH', 'dog': 'KT', 'the': '0'}
+
+    def test_add_shares_parent(self):
+        empty = rp.Line(3, 'cat', phonetics=self.phonetics)
+        the = empty.add('the')
+        cat = the.add('cat')
+        dog = the.add('dog')
+        nosey.assert_is(the, cat.parent)
+        nosey.assert_is(the, dog.parent)
+        nosey.assert_is(empty.goal, dog.goal)
+        # Adding leaves the parent as it was
+        nosey.assert_equal(['the'], the.tokens)
+        nosey.assert_equal([], empty.tokens)
+
+    def test_sequence_protocol(self):
+        line = rp.Line(3, None, phonetics=self.phonetics).add('the').add('cat').add('hat')
+        nosey.assert_equal(3, len(line))
+        nosey.assert_equal('hat', line[-1])
+        nosey.assert_equal('the', line[0])
+        nosey.assert_equal(['cat', 'hat'], line[1:])
+        nosey.assert_equal(['the', 'cat', 'hat'], line.tokens)
+        nosey.assert_equal('the cat hat', str(line))
+        nosey.assert_equal(0, len(rp.Line(3, None, phonetics=self.phonetics)))
+
+    def test_scores_match_old_line(self):
+        for s_goal, r_goal, tolerance, tokens, score, valid, over in OLD_LINE_SCORES:
+            line = rp.Line(s_goal, r_goal, tolerance, tokens=tokens, phonetics=self.phonetics)
+            nosey.assert_equal((score, valid, over), (line.score(), line.valid(), line.over()))
+            # Built a word at a time, every prefix scores the same
+            chained = rp.Line(s_goal, r_goal, tolerance, phonetics=self.phonetics)
+            for t in tokens:
+                chained = chained.add(t)
+            nosey.assert_equal((score, valid, over), (chained.score(), chained.valid(), chained.over()))
+            nosey.assert_true(line.better(None))
+            nosey.assert_false(line.better(chained))
+        lines = [rp.Line(*case[:3], tokens=case[3], phonetics=self.phonetics) for case in OLD_LINE_SCORES]
+        for a, b in itertools.product(lines, repeat=2):
+            nosey.assert_equal(a.score() < b.score(), a.better(b))
+
+    def test_tokens_match_add(self):
+        tokens = ['the', 'dog', 'hat']
+        chained = rp.Line(3, 'cat', phonetics=self.phonetics)
+        for t in tokens:
+            chained = chained.add(t)
+        line = rp.Line(3, 'cat', tokens=tokens, phonetics=self.phonetics)
+        nosey.assert_equal(chained.tokens, line.tokens)
+        nosey.assert_equal(chained.parent.tokens, line.parent.tokens)
+        for attr in ('s_goal', 'r_goal', 's_tolerance', 'r_tolerance', 's_count', 'r_dist'):
+            nosey.assert_equal(getattr(chained, attr), getattr(line, attr))
+        nosey.assert_equal(chained.score(), line.score())
+        nosey.assert_equal(chained.valid(), line.valid())
+        nosey.assert_equal(['the', 'dog', 'hat', 'cat'], line.add('cat').tokens)
+
+
+class TestRhymeIndex(object):
+    def __init__(self):
+        self.poem = None
+
+    def setUp(self):
+        self.poem = rp.RandomPoem(['3a'])
+        self.poem.add_tokens('the big cat ran the dog sat big hat'.split())
+        self.poem.phonetics = self.phonetics()
+
+    @staticmethod
+    def phonetics():
+        phonetics = rp.PhoneticKeys()
+        phonetics.keys = {'the': '0A', 'big': 'KP', 'cat': 'TK', 'hat': 'TH', 'dog': 'KT', 'ran': 'NR',
+                          'sat': 'TS', 'pat': 'TP'}
+        return phonetics
+
+    def queue(self, root_word, tokens):
+        """Candidates for the word after root_word in a 3 syllable line rhyming with cat"""
+        line = rp.Line(3, 'cat', tolerance=1, tokens=tokens, phonetics=self.poem.phonetics)
+        return list(self.poem._RandomPoem__make_queue(root_word, line))
+
+    def test_rhymes_reaching(self):
+        index = self.poem._get_rhyme_index()
+        nosey.assert_equal({'cat', 'hat', 'sat'}, index.rhymes('cat'))
+        nosey.assert_equal({'cat'}, index.rhymes('cat', tolerance=0))
+        # Words that can be followed by a rhyme
+        nosey.assert_equal({'big', 'dog'}, index.reaching('cat'))
+        nosey.assert_equal({'ran'}, index.rhymes('ran'))
+
+    def test_targeted_queues(self):
+        # Early in the line, every successor
+        nosey.assert_items_equal(['big', 'dog'], self.queue('the', []))
+        nosey.assert_items_equal(['big', 'dog'], self.queue('the', ['ran']))
+        # One word before the last, only words that can reach a rhyme,
+        # with rhymes first
+        nosey.assert_items_equal(['big', 'dog'], self.queue('the', ['ran', 'the']))
+        nosey.assert_equal([], self.queue('cat', ['ran', 'the']))
+        # Last word, only rhymes
+        nosey.assert_items_equal(['cat', 'hat'], self.queue('big', ['ran', 'the', 'big']))
+        nosey.assert_equal([], self.queue('the', ['ran', 'the', 'big']))
+        # Untargeted, everything
+        self.poem.targeted = False
+        nosey.assert_items_equal(['ran'], self.queue('cat', ['ran', 'the', 'big']))
+
+    def test_index_follows_model(self):
+        old = self.poem._get_rhyme_index()
+        self.poem.add_to_model(["big pat"])
+        nosey.assert_is_none(self.poem.rhyme_index)
+        nosey.assert_is_none(self.poem.phonetics)
+        self.poem.phonetics = self.phonetics()
+        nosey.assert_is_not(old, self.poem._get_rhyme_index())
+        nosey.assert_in('pat', self.poem.rhyme_index.rhymes('cat'))
+        # New words can end a line
+        nosey.assert_items_equal(['cat', 'hat', 'pat'], self.queue('big', ['ran', 'the', 'big']))
+        self.poem._get_rhyme_index()
+        self.poem.prune(report=False)
+        nosey.assert_is_none(self.poem.rhyme_index)
+
+
+class TestPhoneticKeys(object):
+    def __init__(self):
+        self.tmp_dir = None
+        self.phonetics = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.phonetics = rp.PhoneticKeys()
+        self.phonetics.keys = {'cat': 'TK', 'hat': 'TH', 'the': '0A', '42': ''}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmp_dir, 'keys', 'kanye.model.phonetics')
+        self.phonetics.save(path)
+        loaded = rp.PhoneticKeys.load(path)
+        nosey.assert_dict_equal(self.phonetics.keys, loaded.keys)
+        nosey.assert_equal(4, len(loaded))
+
+    def test_saved_with_model(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        poem = rp.RandomPoem(['3a'])
+        poem.add_tokens('the cat hat the'.split())
+        # Nothing to save until the keys are built
+        poem.save(path)
+        nosey.assert_false(os.path.exists(path + rp.PHONETICS_EXT))
+        poem.phonetics = self.phonetics
+        poem.save(path)
+        loaded = rp.RandomPoem(['3a'], path)
+        nosey.assert_dict_equal(self.phonetics.keys, loaded.phonetics.keys)
+        nosey.assert_is(loaded.phonetics, loaded._get_phonetics())
+
+    def test_save_load_args(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        poem = rp.RandomPoem(['3a'])
+        poem.add_tokens('the cat hat the'.split())
+        poem.phonetics = self.phonetics
+        poem.save(path, shards=2)
+        loaded = rp.RandomPoem(['3a'])
+        loaded.load(path, max_resident_shards=1)
+        nosey.assert_equal(2, loaded.prob_dict.n_shards)
+        nosey.assert_equal(1, loaded.prob_dict.max_resident)
+        nosey.assert_dict_equal(self.phonetics.keys, loaded.phonetics.keys)
+        poem.save(path, False)
+        loaded.load(path)
+        nosey.assert_is_instance(loaded.prob_dict, rw.ProbDict)
+
+    def test_checkpoint(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        poem = rp.RandomPoem(['3a'])
+        poem.add_to_model(["the cat hat"])
+        poem.save(path, shards=2)
+        grown = rp.RandomPoem(['3a'])
+        grown.load(path, replay=False)
+        grown.add_to_model(["the dog sat"])
+        grown.checkpoint()
+        nosey.assert_true(os.path.exists(dl.log_path(path)))
+        # Replayed on load, or not
+        loaded = rp.RandomPoem(['3a'])
+        loaded.load(path)
+        nosey.assert_items_equal(['cat', 'dog'], loaded.prob_dict.successors('the'))
+        loaded.load(path, replay=False)
+        nosey.assert_items_equal(['cat'], loaded.prob_dict.successors('the'))
+        # Compacting keeps the sharded format
+        grown.compact_deltas()
+        nosey.assert_false(os.path.exists(dl.log_path(path)))
+        nosey.assert_equal(dict(shards=2), dl.snapshot_format(path))
+        loaded.load(path)
+        nosey.assert_items_equal(['cat', 'dog'], loaded.prob_dict.successors('the'))
+
+    def test_missing_keys(self):
+        dmeta = rp.DMETA
+        rp.DMETA = lambda token: [None, None]
+        try:
+            # Encoded on first lookup and remembered
+            nosey.assert_equal('', self.phonetics['1999'])
+            nosey.assert_in('1999', self.phonetics.keys)
+        finally:
+            rp.DMETA = dmeta
+        # Words without a key never rhyme, rather than raising
+        nosey.assert_equal(rp.RHYME_SOUNDS, rp.rhyme_dist(self.phonetics['cat'], self.phonetics['42']))
+        nosey.assert_equal(rp.RHYME_SOUNDS, rp.rhyme_dist(self.phonetics['42'], self.phonetics['42']))
+        line = rp.Line(1, '42', phonetics=self.phonetics).add('hat')
+        nosey.assert_false(line.valid())
+        line = rp.Line(1, 'cat', phonetics=self.phonetics).add('42')
+        nosey.assert_false(line.valid())
+        nosey.assert_true(rp.Line(1, 'cat', phonetics=self.phonetics).add('hat').valid())
@@ -10,7 +10,14 @@ __author__ = 'eric'
 import nose.tools as nosey
 import os
 import re
-from collections import defaultdict
+import random
+import shutil
+import tempfile
+import gzip
+import bz2
+import tarfile
+import cPickle as pickle
+from collections import defaultdict, Counter
 
 import random_words.random_words as rw
 
@@ -20,7 +27,18 @@ import random_words.random_words as rw
 #
 
 DATA_DIR = os.path.join('tests', 'data', 'kanye')
+MODEL_PATH = 'kanye_1_NewLines-F_Uniq-F.model'
 WS_PATTERN = re.compile(r"(\s)")
+TEST_STRING = (
+    "I am the very model of a modern Major-General, "
+    "I've information vegetable, animal, and mineral, "
+    "I know the kings of England, and I quote the fights historical "
+    "From Marathon to Waterloo, in order categorical; "
+    "I'm very well acquainted, too, with matters mathematical, "
+    "I understand equations, both the simple and quadratical, "
+    "About binomial theorem I'm teeming with a lot o' news, "
+    "With many cheerful facts about the square of the hypotenuse."
+)
 
 
 #
@@ -31,6 +49,11 @@ def tokenize(s):
     return WS_PATTERN.sub(" ", s).split()
 
 
+def as_dicts(prob_dict):
+    """Plain {str: {str: int}} copy of a model's transitions"""
+    return dict((t, dict(prob_dict.successors(t))) for t in prob_dict.keys())
+
+
 #
 # Tests
 #
@@ -44,16 +67,7 @@ class TestProbDict(object):
     @classmethod
     def setUpClass(cls):
         # cls.kanye_file = os.path.join(DATA_DIR, 'good_morning.txt')
-        cls.test_string = (
-            "I am the very model of a modern Major-General, "
-            "I've information vegetable, animal, and mineral, "
-            "I know the kings of England, and I quote the fights historical "
-            "From Marathon to Waterloo, in order categorical; "
-            "I'm very well acquainted, too, with matters mathematical, "
-            "I understand equations, both the simple and quadratical, "
-            "About binomial theorem I'm teeming with a lot o' news, "
-            "With many cheerful facts about the square of the hypotenuse."
-        )
+        cls.test_string = TEST_STRING
         cls.ws_pattern = re.compile(r"(\s)")
 
     def setUp(self):
@@ -79,6 +93,26 @@ class TestProbDict(object):
         # Check freqs
         nosey.assert_dict_equal({'am': 1}, self.prob_dict.map['I'])
 
+    def test_prob_dict_bulk_add(self):
+        tokens = self.test_tokens + ['', 'I', 'am', '']
+        self.add_tokens(tokens)
+        by_sequence = rw.ProbDict()
+        by_sequence.add_sequence(tokens)
+        by_counts = rw.ProbDict()
+        by_counts.add_counts(Counter(zip(tokens, tokens[1:])))
+        for bulk in (by_sequence, by_counts):
+            nosey.assert_equal(self.prob_dict.map, bulk.map)
+        # Sampling tables and start tokens see the new pairs
+        self.prob_dict.add_start('am')
+        self.prob_dict.get('I')
+        nosey.assert_equal('am', self.prob_dict.get_start())
+        self.prob_dict.add_sequence(['am', 'I', 'be'])
+        self.prob_dict.add_start('be')
+        nosey.assert_in('be', self.prob_dict.successors('I'))
+        nosey.assert_true(any(self.prob_dict.get('I') == 'be' for _ in range(200)))
+        self.prob_dict.add_counts({('be', 'am'): 1000})
+        nosey.assert_true(any(self.prob_dict.get_start() == 'be' for _ in range(200)))
+
     def test_prob_dict_add_few(self):
         s = "I am the very model of a modern Major-General and I am getting tired of this song."
         toks = tokenize(s)
@@ -116,6 +150,55 @@ class TestProbDict(object):
         # Test value
         nosey.assert_in(self.prob_dict.get('I'), ['am', 'quote', 'understand', 'know'])
 
+    def test_prob_dict_get_after_add(self):
+        self.prob_dict.add('I', 'am')
+        nosey.assert_equal('am', self.prob_dict.get('I'))
+        # Adding a successor must invalidate the cached sampling table
+        self.prob_dict.add('I', 'know')
+        seen = set(self.prob_dict.get('I') for _ in range(200))
+        nosey.assert_equal({'am', 'know'}, seen)
+
+    def test_prob_dict_get_matches_linear_scan(self):
+        self.add_tokens(self.test_tokens)
+
+        def linear_get(token):
+            freqs = self.prob_dict.map[token]
+            rnd = random.randint(1, sum(freqs.values()))
+            summ = 0
+            for t, f in freqs.iteritems():
+                summ += f
+                if summ >= rnd:
+                    return t
+
+        random.seed(42)
+        expected = [linear_get(t) for t in self.test_tokens[:-1]]
+        random.seed(42)
+        actual = [self.prob_dict.get(t) for t in self.test_tokens[:-1]]
+        nosey.assert_equal(expected, actual)
+
+    def test_prob_dict_pickle(self):
+        self.add_tokens(self.test_tokens)
+        self.prob_dict.get('I')
+        pd2 = pickle.loads(pickle.dumps(self.prob_dict))
+        nosey.assert_equal(self.prob_dict.map, pd2.map)
+        nosey.assert_in(pd2.get('I'), ['am', 'quote', 'understand', 'know'])
+
+    def test_prob_dict_starts(self):
+        nosey.assert_is_none(self.prob_dict.get_start())
+        self.prob_dict.add_start('I', 3)
+        # No successors yet, can't start from it
+        nosey.assert_is_none(self.prob_dict.get_start())
+        self.add_tokens(self.test_tokens)
+        self.prob_dict.add_start('am')
+        rng = random.Random(0)
+        counts = defaultdict(int)
+        for _ in range(4000):
+            counts[self.prob_dict.get_start(rng)] += 1
+        nosey.assert_items_equal(['I', 'am'], counts.keys())
+        nosey.assert_almost_equal(0.75, counts['I'] / 4000.0, delta=0.03)
+        pd2 = pickle.loads(pickle.dumps(self.prob_dict))
+        nosey.assert_equal({'I': 3, 'am': 1}, pd2.starts.counts)
+
 
 class TestRandomWords(object):
     def __init__(self):
@@ -148,3 +231,255 @@ class TestRandomWords(object):
         print words
         nosey.assert_is_instance(words, str)
         nosey.assert_equal(25, len(words.split()))
+
+    def test_rw_matches_shipped_model(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR)
+        shipped = pickle.load(open(MODEL_PATH, 'rb'))
+        nosey.assert_equal(as_dicts(shipped), as_dicts(rw2.prob_dict))
+
+    def test_rw_parallel_matches_serial(self):
+        for newlines in (False, True):
+            serial = rw.RandomWords(corpus_dir=DATA_DIR, newlines=newlines, uniq_lines=True)
+            parallel = rw.RandomWords(newlines=newlines, uniq_lines=True)
+            parallel.add_to_model(DATA_DIR, workers=2)
+            nosey.assert_equal(as_dicts(serial.prob_dict), as_dicts(parallel.prob_dict))
+
+    def test_rw_parallel_source_errors(self):
+        def failing_docs():
+            yield "one doc"
+            raise IOError("source went away")
+
+        for uniq_lines in (False, True):
+            nosey.assert_raises(IOError, rw.RandomWords(uniq_lines=uniq_lines).add_to_model,
+                                failing_docs(), workers=2)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            nosey.assert_raises(Exception, rw.RandomWords().add_to_model, tmp_dir, workers=2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rw_sequence_chunks(self):
+        model = rw.RandomWords()
+        token_lines = [line.split() for line in open(os.path.join(DATA_DIR, 'stronger.txt')) if line.strip()]
+        pairs = list(model._line_pairs(token_lines))
+        chunks = list(model._line_sequences(token_lines, chunk_size=10))
+        nosey.assert_greater(len(chunks), 1)
+        nosey.assert_equal(pairs, [p for seq in chunks for p in zip(seq, seq[1:])])
+
+    def test_rw_sources_match_dir(self):
+        expected = as_dicts(rw.RandomWords(corpus_dir=DATA_DIR).prob_dict)
+        paths = sorted(rw.FileGen(DATA_DIR))
+        docs = [open(p).read() for p in paths]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # Compressed copies of each file
+            for p, doc in zip(paths, docs):
+                name = os.path.join(tmp_dir, os.path.basename(p))
+                f = gzip.open(name + '.gz', 'wb')
+                f.write(doc)
+                f.close()
+                f = bz2.BZ2File(name + '.bz2', 'w')
+                f.write(doc)
+                f.close()
+            # A tar archive of the corpus
+            tar_path = os.path.join(tmp_dir, 'kanye.tar.gz')
+            archive = tarfile.open(tar_path, 'w:gz')
+            for p in paths:
+                archive.add(p, arcname=os.path.basename(p))
+            archive.close()
+
+            # Each entry is a list of sources added one after another
+            sources = [
+                [docs],
+                [[d.splitlines() for d in docs]],
+                [open(p) for p in paths],
+                [os.path.join(tmp_dir, os.path.basename(p) + '.gz') for p in paths],
+                [os.path.join(tmp_dir, os.path.basename(p) + '.bz2') for p in paths],
+                [tar_path],
+            ]
+            for source in sources:
+                rw2 = rw.RandomWords()
+                for src in source:
+                    rw2.add_to_model(src)
+                nosey.assert_equal(expected, as_dicts(rw2.prob_dict))
+            # Parallel workers take non-path documents too
+            rw2 = rw.RandomWords()
+            rw2.add_to_model(docs, workers=2)
+            nosey.assert_equal(expected, as_dicts(rw2.prob_dict))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rw_unicode_docs(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'cafe.model')
+            for newlines in (False, True):
+                rw2 = rw.RandomWords(newlines=newlines, uniq_lines=True)
+                rw2.add_to_model([u'caf\xe9 au lait\ncaf\xe9 au lait\nna\xefve caf\xe9\n'])
+                # Stored as utf-8, like the tokenizers' output
+                for t in rw2.prob_dict.keys():
+                    nosey.assert_is_instance(t, str)
+                nosey.assert_in('caf\xc3\xa9', rw2.prob_dict.keys())
+                # The repeated line was skipped
+                nosey.assert_equal(1, dict(rw2.prob_dict.successors('caf\xc3\xa9'))['au'])
+                rw2.save(path)
+                loaded = rw.RandomWords()
+                loaded.load(path)
+                nosey.assert_equal(dict(rw2.prob_dict.successors('caf\xc3\xa9')),
+                                   dict(loaded.prob_dict.successors('caf\xc3\xa9')))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rw_batch(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR)
+        lines = rw2.make_words_batch(50, 10)
+        nosey.assert_equal(50, len(lines))
+        for line in lines:
+            nosey.assert_is_instance(line, str)
+            nosey.assert_equal(10, len(line.split()))
+        # Token ids need an array backed model
+        nosey.assert_raises(Exception, rw2.make_words_batch, 5, 10, as_ids=True)
+        # The array backed copy is reused until the model changes
+        batch_model = rw2._get_batch_model()
+        rw2.make_words_batch(5, 10)
+        nosey.assert_is(batch_model, rw2._get_batch_model())
+        rw2.add_tokens(['zyzzyva', 'zyzzyvas'])
+        nosey.assert_is_not(batch_model, rw2._get_batch_model())
+        nosey.assert_equal(['zyzzyvas'], rw2.make_words_batch(1, 1, init_tokens=['zyzzyva']))
+        rw2.prob_dict = rw.ProbDict()
+        nosey.assert_equal([], rw2._get_batch_model().keys())
+
+    def test_rw_batch_ids(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR, compact=True)
+        rows = rw2.make_words_batch(20, 5, init_tokens=['I'] * 20, as_ids=True)
+        nosey.assert_equal(20, len(rows))
+        id2token = rw2.prob_dict.dictionary.id2token
+        for row in rows:
+            nosey.assert_equal(5, len(row))
+            # First token must follow the init token, and so on
+            prev = 'I'
+            for token_id in row:
+                if token_id < 0:
+                    # Dead end, the rest of the row stays unknown
+                    nosey.assert_equal({}, rw2.prob_dict.successors(prev))
+                    break
+                nosey.assert_in(id2token[token_id], rw2.prob_dict.successors(prev))
+                prev = id2token[token_id]
+
+    def test_rw_instances_dont_interfere(self):
+        rw1 = rw.RandomWords(corpus_dir=DATA_DIR)
+        expected = [rw1.make_words(10, seed=7) for _ in range(3)]
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR)
+        rw3 = rw.RandomWords(corpus_dir=DATA_DIR)
+        actual = []
+        for _ in range(3):
+            actual.append(rw2.make_words(10, seed=7))
+            rw3.make_words(10, seed=99)
+            random.random()
+        nosey.assert_equal(expected, actual)
+
+    def test_rw_generate_many(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR, compact=True)
+        requests = [(10, None, seed) for seed in range(20)] + [(5, 'I', 3), (10, None, 0)]
+        results = rw2.generate_many(requests, workers=4)
+        nosey.assert_equal(len(requests), len(results))
+        # Same seed, same output, whichever thread served it
+        nosey.assert_equal(results[0], results[-1])
+        nosey.assert_equal(results, rw2.generate_many(requests, workers=2))
+        nosey.assert_equal(5, len(results[-2].split()))
+
+    def test_rw_kanye_compact(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR, compact=True)
+        nosey.assert_is_instance(rw2.prob_dict, rw.CompactProbDict)
+        words = rw2.make_words(25)
+        nosey.assert_equal(25, len(words.split()))
+
+    def test_rw_start_tokens(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR)
+        line_starts = set()
+        for path in rw.FileGen(DATA_DIR):
+            for line in open(path):
+                if line.split():
+                    line_starts.add(line.split()[0])
+        nosey.assert_items_equal(line_starts, rw2.prob_dict.starts.counts.keys())
+        parallel = rw.RandomWords()
+        parallel.add_to_model(DATA_DIR, workers=2)
+        nosey.assert_equal(rw2.prob_dict.starts.counts, parallel.prob_dict.starts.counts)
+        compact = rw2.prob_dict.compact()
+        for _ in range(50):
+            token = rw2._get_itoken(None)
+            nosey.assert_in(token, line_starts)
+            nosey.assert_true(rw2.prob_dict.successors(token))
+            nosey.assert_true(compact.successors(compact.get_start()))
+
+    def test_rw_start_tokens_old_model(self):
+        # Models pickled before start tokens were recorded still get one
+        rw2 = rw.RandomWords()
+        rw2.load(MODEL_PATH)
+        nosey.assert_equal(0, len(rw2.prob_dict.starts))
+        nosey.assert_in(rw2._get_itoken(None), rw2.prob_dict.keys())
+
+
+class TestCompactProbDict(object):
+    def __init__(self):
+        self.prob_dict = None
+        self.test_tokens = []
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_string = TEST_STRING
+
+    def setUp(self):
+        self.prob_dict = rw.CompactProbDict()
+        self.test_tokens = tokenize(self.test_string)
+
+    def add_tokens(self, prob_dict, tokens):
+        prev = tokens[0]
+        for t in tokens[1:]:
+            prob_dict.add(prev, t)
+            prev = t
+
+    def test_compact_add_one(self):
+        self.prob_dict.add('I', 'am')
+        nosey.assert_items_equal(['I', 'am'], self.prob_dict.keys())
+        nosey.assert_dict_equal({'am': 1}, self.prob_dict.successors('I'))
+        nosey.assert_equal("am", self.prob_dict.get('I'))
+
+    def test_compact_matches_prob_dict(self):
+        prob_dict = rw.ProbDict()
+        self.add_tokens(prob_dict, self.test_tokens)
+        self.add_tokens(self.prob_dict, self.test_tokens)
+        nosey.assert_items_equal(prob_dict.keys(), self.prob_dict.keys())
+        for t in prob_dict.keys():
+            nosey.assert_dict_equal(dict(prob_dict.map[t]), self.prob_dict.successors(t))
+        # Converting gives the same transitions
+        converted = prob_dict.compact()
+        for t in prob_dict.keys():
+            nosey.assert_dict_equal(dict(prob_dict.map[t]), converted.successors(t))
+
+    def test_compact_bulk_add(self):
+        tokens = self.test_tokens + ['', 'I', 'am', '']
+        self.add_tokens(self.prob_dict, tokens)
+        by_sequence = rw.CompactProbDict()
+        by_sequence.add_sequence(tokens)
+        by_counts = rw.CompactProbDict()
+        by_counts.add_counts(Counter(zip(tokens, tokens[1:])))
+        for bulk in (by_sequence, by_counts):
+            nosey.assert_items_equal(self.prob_dict.keys(), bulk.keys())
+            for t in self.prob_dict.keys():
+                nosey.assert_dict_equal(self.prob_dict.successors(t), bulk.successors(t))
+
+    def test_compact_add_after_get(self):
+        self.prob_dict.add('I', 'am')
+        self.prob_dict.get('I')
+        self.prob_dict.add('I', 'know')
+        self.prob_dict.add('I', 'am')
+        self.prob_dict.add('know', 'the')
+        nosey.assert_dict_equal({'am': 2, 'know': 1}, self.prob_dict.successors('I'))
+        nosey.assert_dict_equal({'the': 1}, self.prob_dict.successors('know'))
+        nosey.assert_in(self.prob_dict.get('I'), ['am', 'know'])
+
+    def test_compact_unknown_token(self):
+        self.prob_dict.add('I', 'am')
+        nosey.assert_equal("<UNK>", self.prob_dict.get('am'))
+        nosey.assert_equal("<UNK>", self.prob_dict.get('foo'))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the generation server.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fuzzy
+except ImportError:
+    # Poem workers import random_poem, which makes its metaphone encoder on
+    # import.  Their poems have no rhymes to match, so a stand-in will do.
+    fuzzy = types.ModuleType('fuzzy')
+    fuzzy.DMetaphone = lambda: lambda token: [None, None]
+    sys.modules['fuzzy'] = fuzzy
+
+import random_words.random_words as rw
+import random_words.server as srv
+
+
+#
+# Globals
+#
+
+PICKLED_MODEL = 'kanye_1_NewLines-F_Uniq-F.model'
+
+
+#
+# Helpers
+#
+
+def request_lines(path, requests):
+    """Sends requests on one connection, returns the responses by id"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    f = sock.makefile('rw')
+    for r in requests:
+        f.write(json.dumps(r) + '\n')
+    f.flush()
+    sock.shutdown(socket.SHUT_WR)
+    responses = [json.loads(line) for line in f]
+    sock.close()
+    return dict((r['id'], r) for r in responses)
+
+
+#
+# Tests
+#
+
+class TestServer(object):
+    def __init__(self):
+        self.tmp_dir = None
+        self.server = None
+        self.socket_path = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'rw.sock')
+        self.server = srv.GenerationServer(PICKLED_MODEL, poem_workers=0, max_wait=0.05)
+        thread = threading.Thread(target=self.server.serve, args=(self.socket_path,))
+        thread.daemon = True
+        thread.start()
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_words(self):
+        responses = request_lines(self.socket_path, [
+            dict(id=1, type='words', length=10),
+            dict(id=2, type='words', length=5, init_token='I'),
+            dict(id=3, type='words', length=7, seed=4),
+        ])
+        nosey.assert_equal(10, len(responses[1]['result'].split()))
+        nosey.assert_equal(5, len(responses[2]['result'].split()))
+        # Seeded requests match make_words with the same seed
+        model = rw.RandomWords()
+        model.load(PICKLED_MODEL)
+        model.prob_dict = model.prob_dict.compact()
+        nosey.assert_equal(model._make_request((7, None, 4)), responses[3]['result'])
+
+    def test_errors(self):
+        responses = request_lines(self.socket_path, [
+            dict(id=1, type='poem', scheme=['5a']),
+            dict(id=2, type='dance'),
+        ])
+        nosey.assert_in('disabled', responses[1]['error'])
+        nosey.assert_in('Unknown request type', responses[2]['error'])
+        responses = request_lines(self.socket_path, [
+            dict(id=1, type='words', length=srv.MAX_LENGTH + 1),
+            dict(id=2, type='words', length=0),
+        ])
+        nosey.assert_in('length', responses[1]['error'])
+        nosey.assert_in('length', responses[2]['error'])
+
+    def test_batching(self):
+        requests = [[dict(id=i, type='words', length=8)] for i in range(40)]
+        pool = ThreadPool(20)
+        results = pool.map(lambda r: request_lines(self.socket_path, r), requests)
+        pool.close()
+        nosey.assert_true(all(len(r.values()[0]['result'].split()) == 8 for r in results))
+        stats = request_lines(self.socket_path, [dict(id=0, type='stats')])[0]['result']['counters']
+        nosey.assert_equal(40, stats['batched_requests'])
+        nosey.assert_less(stats['batches'], 40)
+
+
+class TestPoemServer(object):
+    def __init__(self):
+        self.tmp_dir = None
+        self.server = None
+        self.socket_path = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'rw.sock')
+        self.server = srv.GenerationServer(PICKLED_MODEL, poem_workers=1, threads=1, max_wait=0.01)
+        thread = threading.Thread(target=self.server.serve, args=(self.socket_path,))
+        thread.daemon = True
+        thread.start()
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_poems(self):
+        # More poems than request threads, they don't hold one while they're searched
+        requests = [dict(id=i, type='poem', scheme=['3a', '4b'], seed=i) for i in range(4)]
+        requests += [dict(id=4, type='words', length=5), dict(id=5, type='poem'),
+                     dict(id=6, type='poem', scheme=['a'])]
+        responses = request_lines(self.socket_path, requests)
+        for i in range(4):
+            nosey.assert_equal(2, len(responses[i]['result'].split('\n')))
+        nosey.assert_equal(5, len(responses[4]['result'].split()))
+        nosey.assert_in('scheme', responses[5]['error'])
+        nosey.assert_not_in('result', responses[6])
+        # Seeded poems are reproducible
+        again = request_lines(self.socket_path, requests[:1])
+        nosey.assert_equal(responses[0]['result'], again[0]['result'])
+        counters = self.server.metrics.snapshot()['counters']
+        nosey.assert_equal(2, counters['request_errors'])
@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+
+"""
+Tests for sharded models.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+
+import random_words.random_words as rw
+import random_words.sharded_model as sm
+from random_words.metrics import Metrics
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Tests
+#
+
+class TestShardedModel(object):
+    def __init__(self):
+        self.tmp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rw = rw.RandomWords(corpus_dir=DATA_DIR)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        sm.save_sharded(self.rw.prob_dict, path, 8)
+        nosey.assert_true(sm.is_sharded_model(path))
+        sharded = sm.load_sharded(path)
+        nosey.assert_items_equal(self.rw.prob_dict.keys(), sharded.keys())
+        for t in self.rw.prob_dict.keys():
+            nosey.assert_dict_equal(dict(self.rw.prob_dict.map[t]), sharded.successors(t))
+        nosey.assert_in(sharded.get('I'), self.rw.prob_dict.map['I'])
+        nosey.assert_equal("<UNK>", sharded.get('not a token'))
+        nosey.assert_raises(Exception, sharded.add, 'I', 'am')
+        # Start tokens come from the index, without opening a shard
+        sharded = sm.load_sharded(path)
+        nosey.assert_in(sharded.get_start(), self.rw.prob_dict.starts.counts)
+        nosey.assert_equal([], sharded.resident_shards())
+
+    def test_lazy_lru(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        sm.save_sharded(self.rw.prob_dict, path, 8)
+        sharded = sm.load_sharded(path, max_resident=2)
+        metrics = Metrics()
+        sharded.metrics = metrics
+        nosey.assert_equal([], sharded.resident_shards())
+        sharded.get('I')
+        nosey.assert_equal([sm.shard_of('I', 8)], sharded.resident_shards())
+        for t in self.rw.prob_dict.keys():
+            sharded.successors(t)
+            nosey.assert_less_equal(len(sharded.resident_shards()), 2)
+        counters = metrics.snapshot()['counters']
+        nosey.assert_greater(counters['shard_loads'], 2)
+        nosey.assert_equal(counters['shard_loads'] - 2, counters['shard_evictions'])
+
+    def test_rw_save_load(self):
+        path = os.path.join(self.tmp_dir, 'models', 'kanye.model')
+        self.rw.save(path, shards=4)
+        rw2 = rw.RandomWords()
+        rw2.load(path, max_resident_shards=1)
+        nosey.assert_is_instance(rw2.prob_dict, sm.ShardedProbDict)
+        nosey.assert_equal(25, len(rw2.make_words(25).split()))
+        nosey.assert_equal(1, len(rw2.prob_dict.resident_shards()))
+        compact = rw2.prob_dict.compact()
+        nosey.assert_items_equal(self.rw.prob_dict.keys(), compact.keys())
+        # Adding documents copies the model into memory
+        rw2.add_to_model(["I am a god"])
+        nosey.assert_is_instance(rw2.prob_dict, rw.CompactProbDict)
+        nosey.assert_equal(self.rw.prob_dict.map['I']['am'] + 1, rw2.prob_dict.successors('I')['am'])
+
+    def test_save_over(self):
+        path = os.path.join(self.tmp_dir, 'kanye.model')
+        sm.save_sharded(self.rw.prob_dict, path, 8)
+        sharded = sm.load_sharded(path, max_resident=8)
+        for t in self.rw.prob_dict.keys():
+            sharded.successors(t)
+        small = rw.RandomWords(corpus_dir=[["I am a god"]])
+        sm.save_sharded(small.prob_dict, path, 3)
+        # Open shards keep the model they were opened with
+        for t in self.rw.prob_dict.keys():
+            nosey.assert_dict_equal(dict(self.rw.prob_dict.map[t]), sharded.successors(t))
+        # Only the new model's files are left
+        nosey.assert_items_equal(['kanye.model'] + [os.path.basename(sm.shard_path(path, i)) for i in range(3)],
+                                 os.listdir(self.tmp_dir))
+        reloaded = sm.load_sharded(path)
+        nosey.assert_items_equal(small.prob_dict.keys(), reloaded.keys())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the tokenized corpus cache.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+import shutil
+import tempfile
+
+import random_words.random_words as rw
+from random_words.token_cache import TokenCache
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Helpers
+#
+
+def as_dicts(prob_dict):
+    """Plain {str: {str: int}} copy of a model's transitions"""
+    return dict((t, dict(prob_dict.successors(t))) for t in prob_dict.keys())
+
+
+#
+# Tests
+#
+
+class TestTokenCache(object):
+    def __init__(self):
+        self.tmp_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_get(self):
+        cache = TokenCache(os.path.join(self.tmp_dir, 'cache'))
+        lines = [['I', 'am', 'the'], [], ['very', 'model\n', 'I']]
+        cache.put('abcd', lines)
+        nosey.assert_equal(lines, cache.get('abcd'))
+        nosey.assert_is_none(cache.get('ef01'))
+        nosey.assert_equal(1, cache.hits)
+        nosey.assert_equal(1, cache.misses)
+
+    def test_key_depends_on_content_and_options(self):
+        path = os.path.join(self.tmp_dir, 'a.txt')
+        with open(path, 'w') as f:
+            f.write("I am the very model\n")
+        key = TokenCache.key(path, (False, False, None))
+        nosey.assert_equal(key, TokenCache.key(path, (False, False, None)))
+        nosey.assert_not_equal(key, TokenCache.key(path, (True, False, None)))
+        with open(path, 'a') as f:
+            f.write("of a modern Major-General\n")
+        nosey.assert_not_equal(key, TokenCache.key(path, (False, False, None)))
+
+    def test_rw_cached_build_matches(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        for newlines in (False, True):
+            expected = as_dicts(rw.RandomWords(corpus_dir=DATA_DIR, newlines=newlines).prob_dict)
+            # Cold cache
+            rw2 = rw.RandomWords(corpus_dir=DATA_DIR, newlines=newlines, cache_dir=cache_dir)
+            nosey.assert_equal(0, rw2.token_cache.hits)
+            nosey.assert_equal(expected, as_dicts(rw2.prob_dict))
+            # Warm cache, in parallel too
+            rw3 = rw.RandomWords(corpus_dir=DATA_DIR, newlines=newlines, cache_dir=cache_dir)
+            nosey.assert_equal(0, rw3.token_cache.misses)
+            nosey.assert_equal(expected, as_dicts(rw3.prob_dict))
+            rw4 = rw.RandomWords(newlines=newlines, cache_dir=cache_dir)
+            rw4.add_to_model(DATA_DIR, workers=2)
+            nosey.assert_equal(expected, as_dicts(rw4.prob_dict))
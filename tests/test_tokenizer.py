@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+
+"""
+Tests for the tokenizer backends.
+Meant to be run with nosetests
+"""
+
+__author__ = 'eric'
+
+import nose.tools as nosey
+import os
+
+import random_words.tokenizer as tk
+import random_words.random_words as rw
+
+
+#
+# Globals
+#
+
+DATA_DIR = os.path.join('tests', 'data', 'kanye')
+
+
+#
+# Tests
+#
+
+class TestRegexTokenizer(object):
+    def test_sentence_markers(self):
+        tokens = list(tk.RegexTokenizer("I am the very model. Of a modern general!"))
+        nosey.assert_equal(['<s>', 'I', 'am', 'the', 'very', 'model', '.', '</s>',
+                            '<s>', 'Of', 'a', 'modern', 'general', '!', '</s>'], tokens)
+
+    def test_merges_hyphens(self):
+        tokens = list(tk.RegexTokenizer("a modern Major-General"))
+        nosey.assert_equal(['<s>', 'a', 'modern', 'Major-', 'General', '</s>'], tokens)
+
+    def test_merges_apostrophes(self):
+        doc = "I've information, I'm teeming"
+        nosey.assert_in("'ve", list(tk.RegexTokenizer(doc)))
+        tokens = list(tk.RegexTokenizer(doc, merge_apostrophes=True))
+        nosey.assert_equal(['<s>', "I've", 'information', ',', "I'm", 'teeming', '</s>'], tokens)
+
+    def test_newline_tokens(self):
+        doc = "Good morning\n\n\nlook at the valedictorian"
+        nosey.assert_not_in('\n', list(tk.RegexTokenizer(doc)))
+        tokens = list(tk.RegexTokenizer(doc, replace_whitespace=False))
+        nosey.assert_equal(1, tokens.count('\n'))
+
+    def test_get_tokenizer(self):
+        nosey.assert_is(tk.RegexTokenizer, tk.get_tokenizer('regex'))
+        nosey.assert_is(tk.Tokenizer, tk.get_tokenizer('spacy'))
+        nosey.assert_raises(Exception, tk.get_tokenizer, 'foo')
+
+    def test_spacy_not_loaded_on_import(self):
+        nosey.assert_is_none(tk.NLP)
+
+    def test_rw_regex_tokenizer(self):
+        rw2 = rw.RandomWords(corpus_dir=DATA_DIR, tokenizer='regex')
+        nosey.assert_in('</s>', rw2.prob_dict.keys())
+        nosey.assert_is_instance(rw2.prob_dict.keys()[0], str)
+        nosey.assert_equal(25, len(rw2.make_words(25).split()))
+
+
+class TestBatchTokenization(object):
+    def __init__(self):
+        self.docs = []
+
+    def setUp(self):
+        self.docs = [open(os.path.join(DATA_DIR, f)).read().decode('utf-8')
+                     for f in sorted(os.listdir(DATA_DIR))]
+
+    def test_batch_matches_single(self):
+        expected = [list(tk.RegexTokenizer(d)) for d in self.docs]
+        nosey.assert_equal(expected, list(tk.RegexTokenizer.tokenize_batch(self.docs, batch_size=3)))
+
+    def test_parallel_matches_serial(self):
+        expected = [list(tk.RegexTokenizer(d, replace_whitespace=False)) for d in self.docs]
+        actual = list(tk.tokenize_parallel(iter(self.docs), 'regex', n_process=2, chunk_size=3,
+                                           replace_whitespace=False))
+        nosey.assert_equal(expected, actual)
+
+    def test_rw_add_tokenized(self):
+        serial = rw.RandomWords(tokenizer='regex')
+        serial.add_tokenized(DATA_DIR)
+        parallel = rw.RandomWords(tokenizer='regex')
+        parallel.add_tokenized(DATA_DIR, workers=2, chunk_size=2)
+        nosey.assert_items_equal(serial.prob_dict.keys(), parallel.prob_dict.keys())
+        for t in serial.prob_dict.keys():
+            nosey.assert_equal(serial.prob_dict.successors(t), parallel.prob_dict.successors(t))
+        # Sentence markers follow each other across sentences
+        nosey.assert_in('<s>', serial.prob_dict.successors('</s>'))
+        # Needs a tokenizer backend
+        nosey.assert_raises(Exception, rw.RandomWords().add_tokenized, DATA_DIR)